@@ -2,71 +2,90 @@
 
 from flask import Flask, render_template, request, jsonify
 import os
+import sys
+
+# Anonymous page cache shared with the backend app (backend/page_cache.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+from page_cache import PageCache
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 
+# Every page here renders the same HTML for every visitor
+PAGE_CACHE = PageCache(max_entries=64, ttl=300)
+
 
 # -------------------------
 # ROUTES
 # -------------------------
 
 @app.route('/')
+@PAGE_CACHE.cached('index.html')
 def home():
     """Render the homepage"""
     return render_template('index.html')
 
 
 @app.route('/services')
+@PAGE_CACHE.cached('services.html')
 def services():
     """Services page (currently uses same template)"""
     return render_template('services.html')
 
 
 @app.route('/doctor')
+@PAGE_CACHE.cached('doctorReg.html')
 def doctor():
     """Doctor page (currently uses same template)"""
     return render_template('doctorReg.html')
 
 @app.route('/doctor_login')
+@PAGE_CACHE.cached('doctorLog.html')
 def doctor_login():
     """Doctor page (currently uses same template)"""
     return render_template('doctorLog.html')
 
 @app.route('/dashboard')
+@PAGE_CACHE.cached('dashboard.html')
 def dashboard():
     """Doctor page (currently uses same template)"""
     return render_template('dashboard.html')
 
 @app.route('/form')
+@PAGE_CACHE.cached('form.html')
 def form():
     """Doctor page (currently uses same template)"""
     return render_template('form.html')
 
 
 @app.route('/patient')
+@PAGE_CACHE.cached('patient.html')
 def patient():
     """Patient page (currently uses same template)"""
     return render_template('patient.html')
 
 @app.route('/patient_login')
+@PAGE_CACHE.cached('patientLog.html')
 def patient_login():
     """Patient page (currently uses same template)"""
     return render_template('patientLog.html')
 
 @app.route('/patient_register')
+@PAGE_CACHE.cached('patientReg.html')
 def patient_register():
     """Patient page (currently uses same template)"""
     return render_template('patientReg.html')
 
 
 @app.route('/contact')
+@PAGE_CACHE.cached('contact.html')
 def contact():
     """Contact page (currently uses same template)"""
     return render_template('contact.html')
 
 
 @app.route('/generate-report', methods=['GET', 'POST'])
+@PAGE_CACHE.cached('index.html')
 def generate_report():
     """Handle report generation requests"""
     if request.method == 'POST':
@@ -0,0 +1,89 @@
+# backend/api_tokens.py
+# Bearer tokens for the /api/v1 inference API used by hospital systems.
+#
+# Only the SHA-256 of a token is stored (api_tokens table, migration 9 in
+# db_init.py); the token itself is shown once, when it is created.
+#
+# Usage:
+#   python api_tokens.py --create "Radiology PACS"
+#   python api_tokens.py --list
+#   python api_tokens.py --revoke 3
+import argparse
+import hashlib
+import secrets
+import sqlite3
+
+TOKEN_PREFIX = "vai_"
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def create_token(conn, name: str):
+    """
+    Creates an API token.
+
+    Returns:
+        tuple: (token id, token). The token cannot be recovered later.
+    """
+    token = TOKEN_PREFIX + secrets.token_urlsafe(32)
+    cur = conn.execute("INSERT INTO api_tokens (name, token_hash) VALUES (?, ?)", (name, hash_token(token)))
+    conn.commit()
+    return cur.lastrowid, token
+
+
+def verify_token(conn, token: str):
+    """Returns the (id, name) of an active token, or None."""
+    if not token or not token.startswith(TOKEN_PREFIX):
+        return None
+    return conn.execute("SELECT id, name FROM api_tokens WHERE token_hash = ? AND revoked_at IS NULL",
+                        (hash_token(token),)).fetchone()
+
+
+def token_from_headers(headers):
+    """Reads a token from an "Authorization: Bearer ..." or "X-API-Key" header."""
+    auth = headers.get("Authorization", "")
+    if auth[:7].lower() == "bearer ":
+        return auth[7:].strip()
+    return headers.get("X-API-Key", "").strip() or None
+
+
+def revoke_token(conn, token_id: int) -> bool:
+    cur = conn.execute("UPDATE api_tokens SET revoked_at = CURRENT_TIMESTAMP WHERE id = ? AND revoked_at IS NULL",
+                       (token_id,))
+    conn.commit()
+    return cur.rowcount > 0
+
+
+if __name__ == "__main__":
+    from db_init import DB_PATH, migrate_db
+
+    parser = argparse.ArgumentParser(description="Manage /api/v1 API tokens")
+    parser.add_argument("--create", type=str, metavar="NAME", help="Create a token for this integration")
+    parser.add_argument("--list", action="store_true", help="List tokens")
+    parser.add_argument("--revoke", type=int, metavar="ID", help="Revoke a token")
+    parser.add_argument("--db", type=str, default=DB_PATH, help="Path to records.db")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        migrate_db(conn)
+        if args.create:
+            token_id, token = create_token(conn, args.create)
+            print(f"✅ Created token {token_id} for '{args.create}'. Store it now, it is not shown again:")
+            print(token)
+        elif args.revoke is not None:
+            if revoke_token(conn, args.revoke):
+                print(f"✅ Revoked token {args.revoke}.")
+            else:
+                print(f"❌ No active token with id {args.revoke}.")
+        elif args.list:
+            for token_id, name, created_at, revoked_at in conn.execute(
+                    "SELECT id, name, created_at, revoked_at FROM api_tokens ORDER BY id"):
+                state = f"revoked {revoked_at}" if revoked_at else "active"
+                print(f"{token_id:>4}  {name:<30} created {created_at}  {state}")
+        else:
+            parser.print_help()
+    finally:
+        conn.close()
@@ -1,25 +1,52 @@
 # backend/app.py (Final Version with Patient Portal and Image Reports)
 
+import json
 import os # <-- Make sure 'os' is imported
 import sqlite3
+import time
 import uuid
+import numpy as np
 from flask import (Flask, render_template, request, redirect, url_for,
-                   send_from_directory, flash, session, abort) 
+                   send_from_directory, flash, session, abort, jsonify, g)
 from werkzeug.security import generate_password_hash, check_password_hash
 # We no longer need pathlib
 # from pathlib import Path 
 
 # --- Assuming backend_utils, report_generator, db_init are in the same directory ---
 try:
-    from backend_utils import preprocess_image, load_class_mapping, load_dr_model
-    from report_generator import generate_pdf
+    from backend_utils import (preprocess_image, preprocess_image_bytes, predict_probabilities,
+                               predict_with_embeddings, predict_with_gradcam)
+    from model_registry import ModelRegistry
+    from embedding_index import store_for
+    from near_duplicates import (DEFAULT_DISTANCE, MAX_DISTANCE, find_near_duplicates, hamming, phash,
+                                 store_hashes)
+    from attention_maps import save_attention_maps
     from db_init import init_db
+    from pagination import PAGE_SIZES, get_page_size, keyset_page
+    from screening_stats import get_doctor_stats
+    from patient_search import search_patients
+    from blob_store import store_stream, register_blob, discard_blob, resolve_path
+    from image_derivatives import ensure_derivatives, derivative_path, get_derivative
+    from image_quality import assess_image, load_thresholds
+    from report_delivery import ensure_report_pdf, send_report_pdf
+    from camp_upload import start_camp_job, get_camp_job, resume_stale_jobs
+    from api_tokens import verify_token, token_from_headers
+    from request_metrics import LatencyTracker
+    from static_assets import init_app as init_static_assets
+    from page_cache import PageCache
 except ImportError as e:
      print(f"Error importing local modules: {e}. Make sure files are in the 'backend' directory.")
      
 # --- App Configuration: Points to your UI folder ---
 app = Flask(__name__, template_folder='../Flask/templates', static_folder='../Flask/static')
 app.secret_key = "visionai_final_submission_key_needs_to_be_stronger" # Change this!
+app.jinja_env.globals["page_sizes"] = PAGE_SIZES
+# Optional hand-off of report PDF transfers to a front proxy:
+# "" (Flask sends the file), "x-sendfile" (Apache/lighttpd) or "x-accel-redirect" (nginx)
+app.config["REPORT_SENDFILE"] = os.environ.get("VISIONAI_REPORT_SENDFILE", "")
+app.config["X_ACCEL_PREFIX"] = os.environ.get("VISIONAI_X_ACCEL_PREFIX", "/protected-uploads/")
+# Fingerprinted, precompressed assets from build_static.py (plain static files if not built)
+init_static_assets(app)
 
 # --- **START OF PATH FIX** ---
 # --- Paths and Configuration ---
@@ -34,13 +61,78 @@ if not os.path.exists(UPLOAD_FOLDER):
 # --- **END OF PATH FIX** ---
 
 # --- Load AI Model ---
-try:
-    MODEL = load_dr_model()
-    CLASS_MAPPING = load_class_mapping()
-    print("✅ AI Model and class mappings loaded successfully.")
-except Exception as e:
-    print(f"❌ CRITICAL ERROR: Could not load the AI model. {e}")
-    MODEL, CLASS_MAPPING = None, None 
+# The model, its class mapping and version live in MODELS (model_registry.py) and
+# can be reloaded without a restart. Routes take one snapshot per request:
+# bundle = MODELS.current.
+# With VISIONAI_GRADCAM=1 (the default), /generate_report gets each eye's
+# attention map from the same batched pass that classifies it and embeds the
+# overlays in the report PDF. VISIONAI_GRADCAM=0 runs plain inference only.
+# VISIONAI_MODEL_WATCH=<seconds> reloads the model file when it changes
+# (as a shadow candidate with VISIONAI_MODEL_WATCH_SHADOW=1), and
+# VISIONAI_SHADOW_FRACTION is the share of predictions re-run on a candidate.
+# Each graded eye's embedding is stored for similar-case retrieval
+# (embedding_index.py, /report/<report_id>/similar).
+# VISIONAI_LOAD_MODEL=0 leaves MODELS empty for the caller to load (serve.py
+# does, in each worker after the fork, when workers get their own thread pools).
+MODELS = ModelRegistry(gradcam=os.environ.get("VISIONAI_GRADCAM", "1") != "0",
+                       shadow_fraction=float(os.environ.get("VISIONAI_SHADOW_FRACTION", 0.1)),
+                       watch_interval=float(os.environ.get("VISIONAI_MODEL_WATCH", 0)),
+                       watch_shadow=os.environ.get("VISIONAI_MODEL_WATCH_SHADOW", "0") == "1")
+if os.environ.get("VISIONAI_LOAD_MODEL", "1") != "0":
+    try:
+        MODELS.load()
+        print("✅ AI Model and class mappings loaded successfully.")
+    except Exception as e:
+        print(f"❌ CRITICAL ERROR: Could not load the AI model. {e}")
+
+# --- Image-Quality Gate ---
+# Uploads are checked for gradability (image_quality.py) before the model runs:
+# VISIONAI_QUALITY_GATE=reject (default) sends failing uploads back to the form,
+# "flag" saves the record with the failing eye marked Ungradable and not run
+# through the model, and "off" skips the check.
+QUALITY_GATE = os.environ.get("VISIONAI_QUALITY_GATE", "reject")
+if QUALITY_GATE not in ("reject", "flag", "off"):
+    print(f"⚠️ Unknown VISIONAI_QUALITY_GATE={QUALITY_GATE!r}; using 'reject'.")
+    QUALITY_GATE = "reject"
+QUALITY_THRESHOLDS = load_thresholds()
+UNGRADABLE = "Ungradable"
+
+# --- Near-Duplicate Uploads ---
+# Each uploaded eye is compared with the doctor's earlier images by perceptual
+# hash (near_duplicates.py). VISIONAI_DUPLICATES=warn (default) saves it with a
+# warning naming the earlier record; the upload is still graded by the model.
+# "off" skips the check. VISIONAI_DUPLICATE_DISTANCE is the largest Hamming
+# distance, of 64 bits, that counts as a near-duplicate.
+DUPLICATES = os.environ.get("VISIONAI_DUPLICATES", "warn")
+if DUPLICATES not in ("warn", "off"):
+    print(f"⚠️ Unknown VISIONAI_DUPLICATES={DUPLICATES!r}; using 'warn'.")
+    DUPLICATES = "warn"
+DUPLICATE_DISTANCE = min(int(os.environ.get("VISIONAI_DUPLICATE_DISTANCE", DEFAULT_DISTANCE)), MAX_DISTANCE)
+
+# --- Request Latency ---
+# The JSON API and the HTML routes are tracked separately (see /api/v1/metrics)
+API_LATENCY = LatencyTracker()
+HTML_LATENCY = LatencyTracker()
+API_MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+# --- Public Page Cache ---
+# Rendered HTML of the public pages, for anonymous visitors (VISIONAI_PAGE_CACHE_SIZE=0 disables it)
+PAGE_CACHE = PageCache(max_entries=int(os.environ.get("VISIONAI_PAGE_CACHE_SIZE", 64)),
+                       ttl=float(os.environ.get("VISIONAI_PAGE_CACHE_TTL", 300)))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if "request_start" in g:
+        elapsed = time.perf_counter() - g.request_start
+        tracker = API_LATENCY if request.path.startswith("/api/") else HTML_LATENCY
+        tracker.record(request.endpoint or "unmatched", elapsed)
+        if tracker is API_LATENCY:
+            response.headers["Server-Timing"] = f"total;dur={elapsed * 1000:.1f}"
+    return response
 
 # --- Database Helper ---
 def get_db_connection():
@@ -55,14 +147,17 @@ def get_db_connection():
 
 # --- Public Routes ---
 @app.route("/")
+@PAGE_CACHE.cached("index.html")
 def home():
     return render_template("index.html")
 
 @app.route("/services")
+@PAGE_CACHE.cached("services.html")
 def services():
     return render_template("services.html")
 
 @app.route("/contact")
+@PAGE_CACHE.cached("contact.html")
 def contact():
     return render_template("contact.html")
 
@@ -198,17 +293,113 @@ def dashboard():
         flash("Please log in as a doctor to access the dashboard.", "warning")
         return redirect(url_for("doctor_login"))
 
+    per_page = get_page_size(request.args.get("per_page"))
     conn = get_db_connection()
     if not conn:
         flash("Database error. Cannot load dashboard.", "danger")
-        return render_template("dashboard.html", patients=[], doctor=None)
+        return render_template("dashboard.html", patients=[], doctor=None, per_page=per_page, stats=None)
 
-    patients = conn.execute("SELECT * FROM patients WHERE doctor_id = ? ORDER BY created_at DESC", (session["user_id"],)).fetchall()
+    query = request.args.get("q", "").strip()
+    page = request.args.get("page", 1, type=int)
+    if query:
+        # Ranked full-text search; pages are numbered rather than cursor-based
+        patients, has_next = search_patients(conn, session["user_id"], query, page, per_page)
+        next_cursor, prev_cursor = None, None
+    else:
+        # Keyset-paginated, and only the columns the dashboard table shows
+        patients, next_cursor, prev_cursor = keyset_page(
+            conn, ["name", "age", "gender", "report_id", "combined_result",
+                   "left_result", "right_result", "left_confirmed", "right_confirmed"],
+            "doctor_id = ?", (session["user_id"],), per_page,
+            after=request.args.get("after"), before=request.args.get("before"))
+        has_next = False
     doctor = conn.execute("SELECT full_name FROM users WHERE id = ?", (session["user_id"],)).fetchone()
+    stats = get_doctor_stats(conn, session["user_id"], months=6)
     conn.close()
 
     doctor_name = doctor['full_name'] if doctor else "Doctor"
-    return render_template("dashboard.html", patients=patients, doctor={'full_name': doctor_name})
+    return render_template("dashboard.html", patients=patients, doctor={'full_name': doctor_name},
+                           per_page=per_page, next_cursor=next_cursor, prev_cursor=prev_cursor,
+                           stats=stats, query=query, page=page, has_next_page=has_next,
+                           grades=confirmable_grades())
+
+def confirmable_grades():
+    """Grade labels a doctor can confirm, in class index order (none if no model is loaded)."""
+    bundle = MODELS.current
+    return [bundle.class_mapping[i] for i in sorted(bundle.class_mapping)] if bundle else []
+
+@app.route("/report/<report_id>/confirm", methods=["POST"])
+def confirm_report(report_id):
+    """
+    Records the grades the doctor confirms or corrects for each eye (blank:
+    not confirmed, e.g. for an ungradable eye). finetune_head.py trains on them.
+    """
+    if session.get("role") != "doctor":
+        flash("Please log in as a doctor.", "warning")
+        return redirect(url_for("doctor_login"))
+
+    grades = confirmable_grades()
+    confirmed = {eye: request.form.get(f"{eye}_grade") or None for eye in ("left", "right")}
+    if any(grade is not None and grade not in grades for grade in confirmed.values()):
+        flash("Unknown grade.", "danger")
+        return redirect(request.referrer or url_for("dashboard"))
+
+    conn = get_db_connection()
+    if not conn:
+        flash("Database error. Could not save the confirmation.", "danger")
+        return redirect(url_for("dashboard"))
+    try:
+        updated = conn.execute("""
+            UPDATE patients SET left_confirmed = ?, right_confirmed = ?,
+                   confirmed_at = CASE WHEN ? IS NULL AND ? IS NULL THEN NULL ELSE CURRENT_TIMESTAMP END
+            WHERE report_id = ? AND doctor_id = ?
+        """, (confirmed["left"], confirmed["right"], confirmed["left"], confirmed["right"],
+              report_id, session["user_id"])).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    if updated:
+        flash("Grades confirmed.", "success")
+    else:
+        flash("Report not found or permission denied.", "danger")
+    return redirect(request.referrer or url_for("dashboard"))
+
+@app.route("/dashboard/stats")
+def dashboard_stats():
+    if session.get("role") != "doctor":
+        return jsonify({"error": "Please log in as a doctor."}), 401
+
+    months = request.args.get("months", 12, type=int)
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database error."}), 500
+    try:
+        stats = get_doctor_stats(conn, session["user_id"], months=max(1, min(months, 120)))
+    finally:
+        conn.close()
+    return jsonify(stats)
+
+@app.route("/dashboard/search")
+def dashboard_search():
+    if session.get("role") != "doctor":
+        return jsonify({"error": "Please log in as a doctor."}), 401
+
+    query = request.args.get("q", "").strip()
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = get_page_size(request.args.get("per_page"))
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database error."}), 500
+    try:
+        rows, has_next = search_patients(conn, session["user_id"], query, page, per_page)
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Search failed: {e}"}), 500
+    finally:
+        conn.close()
+    return jsonify({
+        "query": query, "page": page, "per_page": per_page, "has_next": has_next,
+        "results": [dict(row) for row in rows],
+    })
 
 @app.route("/form")
 def form():
@@ -218,9 +409,50 @@ def form():
     doctor_name = session.get("full_name", "Doctor")
     return render_template("form.html", doctor={'full_name': doctor_name})
 
+def check_near_duplicates(paths, doctor_id):
+    """
+    Hashes an upload's eye images and finds the closest earlier image of the
+    doctor's for each.
+
+    Args:
+        paths (dict): eye -> saved upload path.
+        doctor_id (int): The uploading doctor.
+
+    Returns:
+        tuple: (eye -> phash, eye -> the earlier record's row as a dict, plus the
+        matching "eye" and its Hamming "distance")
+    """
+    hashes, duplicates = {}, {}
+    for eye, path in paths.items():
+        try:
+            hashes[eye] = phash(get_derivative(path, "thumb"))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not hash the {eye} eye image: {e}")
+    conn = get_db_connection()
+    if not conn:
+        return hashes, duplicates
+    try:
+        for eye, value in hashes.items():
+            matches = find_near_duplicates(conn, doctor_id, value, DUPLICATE_DISTANCE)
+            if not matches:
+                continue
+            distance, record_id, matched_eye = matches[0]
+            row = conn.execute("""
+                SELECT id, report_id, name, created_at, left_result, right_result, left_confirmed, right_confirmed
+                FROM patients WHERE id = ?
+            """, (record_id,)).fetchone()
+            if row:
+                duplicates[eye] = {**dict(row), "eye": matched_eye, "distance": distance}
+    except sqlite3.Error as e:
+        print(f"⚠️ Near-duplicate lookup failed: {e}")
+    finally:
+        conn.close()
+    return hashes, duplicates
+
 @app.route("/generate_report", methods=["POST"])
 def generate_report():
-    if session.get("role") != "doctor" or not MODEL:
+    bundle = MODELS.current  # this request's model, whatever a reload swaps in meanwhile
+    if session.get("role") != "doctor" or not bundle:
         flash("Unauthorized or AI Model not available.", "danger")
         return redirect(url_for("doctor_login"))
 
@@ -241,64 +473,156 @@ def generate_report():
         flash("Please fill required fields (Name, Patient ID/Email) & upload both eye images.", "danger")
         return redirect(url_for("form"))
 
-    # --- Use os.path.join for all path construction ---
+    # --- Content-addressed storage: identical uploads share one stored file ---
+    # Each stored image holds a pending reference until the record is saved
+    # (register_blob) or the upload is rejected (discard_uploads)
+    conn = get_db_connection()
+    if not conn:
+        flash("Database error. Could not save report.", "danger")
+        return redirect(url_for("form"))
+    left_blob = None
     try:
         left_ext = os.path.splitext(left_eye.filename)[1]
         right_ext = os.path.splitext(right_eye.filename)[1]
-        left_filename = f"{uuid.uuid4()}_left{left_ext}"
-        right_filename = f"{uuid.uuid4()}_right{right_ext}"
-        left_path = os.path.join(UPLOAD_FOLDER, left_filename)
-        right_path = os.path.join(UPLOAD_FOLDER, right_filename)
-        left_eye.save(left_path)
-        right_eye.save(right_path)
+        left_blob = store_stream(left_eye.stream, left_ext, conn)
+        right_blob = store_stream(right_eye.stream, right_ext, conn)
+        left_path = resolve_path(left_blob, must_exist=False)
+        right_path = resolve_path(right_blob, must_exist=False)
     except Exception as e:
+        if left_blob:
+            discard_blob(conn, left_blob)
         flash(f"Error saving uploaded images: {e}", "danger")
         return redirect(url_for("form"))
+    finally:
+        conn.close()
 
+    # Print-resolution JPEG for the PDF and a dashboard thumbnail, cached next to each blob
+    for path in {left_path, right_path}:
+        try:
+            ensure_derivatives(path)
+        except Exception as e:
+            print(f"⚠️ Could not create image derivatives for {path}: {e}")
+
+    def discard_uploads():
+        conn = get_db_connection()
+        if conn:
+            for blob in (left_blob, right_blob):  # one pending reference each, even if identical
+                discard_blob(conn, blob)  # only removed if no record or other upload holds it
+            conn.close()
+
+    # Gradability check on the print-size JPEG, which decodes far faster than a full-size upload
+    paths = {"left": left_path, "right": right_path}
+    quality = {}
+    if QUALITY_GATE != "off":
+        for eye, path in paths.items():
+            try:
+                quality[eye] = assess_image(get_derivative(path, "print"), QUALITY_THRESHOLDS)
+            except ValueError as e:
+                quality[eye] = {"passed": False, "reasons": [str(e)]}
+    failed = [eye for eye in paths if eye in quality and not quality[eye]["passed"]]
+    if failed and QUALITY_GATE == "reject":
+        problems = "; ".join(f"{eye} eye: {', '.join(quality[eye]['reasons'])}" for eye in failed)
+        flash(f"Image quality check failed ({problems}). Please retake the photo(s).", "danger")
+        discard_uploads()
+        return redirect(url_for("form"))
+
+    # Near-duplicates of the doctor's earlier uploads
+    hashes, duplicates = {}, {}
+    if DUPLICATES != "off":
+        hashes, duplicates = check_near_duplicates(paths, session["user_id"])
+
+    results = {eye: UNGRADABLE for eye in failed}
+    gradable = [eye for eye in paths if eye not in failed]
     try:
-        left_pred = MODEL.predict(preprocess_image(left_path)).argmax(axis=1)[0]
-        right_pred = MODEL.predict(preprocess_image(right_path)).argmax(axis=1)[0]
+        # The gradable eyes in one eager batch (see predict_probabilities / predict_with_gradcam)
+        cams = embeddings = None
+        if gradable:
+            batch = np.concatenate([preprocess_image(paths[eye]) for eye in gradable])
+            if bundle.gradcam_model is not None:
+                probabilities, cams, embeddings = predict_with_gradcam(bundle.gradcam_model, batch)
+            elif bundle.embedding_model is not None:
+                probabilities, embeddings = predict_with_embeddings(bundle.embedding_model, batch)
+            else:
+                probabilities = predict_probabilities(bundle.model, batch)
+            MODELS.shadow_sample(batch, probabilities)
+            predictions = dict(zip(gradable, (int(p) for p in probabilities.argmax(axis=1))))
+            results.update({eye: bundle.class_mapping.get(p, "Unknown") for eye, p in predictions.items()})
     except Exception as e:
          flash(f"AI prediction failed: {e}. Ensure model & images are valid.", "danger")
-         if os.path.exists(left_path): os.remove(left_path)
-         if os.path.exists(right_path): os.remove(right_path)
+         discard_uploads()
          return redirect(url_for("form"))
 
+    if cams is not None:
+        try:
+            # Cached next to the uploads; build_patient_info finds them when the PDF is rendered
+            save_attention_maps([paths[eye] for eye in gradable], cams, bundle.version)
+        except Exception as e:
+            print(f"⚠️ Could not save attention maps: {e}")
+
     patient_info.update({
         "left_eye_path": left_path, # Pass absolute string path
         "right_eye_path": right_path,
-        "left_result": CLASS_MAPPING.get(left_pred, "Unknown"),
-        "right_result": CLASS_MAPPING.get(right_pred, "Unknown"),
-        "combined_result": CLASS_MAPPING.get(max(left_pred, right_pred), "Unknown"),
+        "left_result": results["left"],
+        "right_result": results["right"],
+        # A screening with an ungradable eye is incomplete, whatever the other eye shows
+        "combined_result": UNGRADABLE if failed else bundle.class_mapping.get(max(predictions.values()), "Unknown"),
     })
+    if failed:
+        problems = "; ".join(f"{eye} eye: {', '.join(quality[eye]['reasons'])}" for eye in failed)
+        flash(f"Saved with ungradable image(s), not assessed by the AI ({problems}).", "warning")
+    for eye, match in duplicates.items():
+        confirmed = match[f"{match['eye']}_confirmed"]
+        grade = f"confirmed {confirmed}" if confirmed else f"graded {match[match['eye'] + '_result']}"
+        flash(f"The {eye} eye image looks like a near-duplicate of {match['name']}'s {match['eye']} eye "
+              f"(report of {(match['created_at'] or '')[:10]}, {grade}). "
+              "Please check it is a new photo of this patient.", "warning")
+    if len(hashes) == 2 and hamming(hashes["left"], hashes["right"]) <= DUPLICATE_DISTANCE:
+        flash("The left and right eye images are near-identical. Please check both eyes were uploaded.", "warning")
 
     conn = get_db_connection()
     if not conn:
         flash("Database error. Could not save report.", "danger")
+        discard_uploads()
         return redirect(url_for("form"))
+    saved = False
     try:
+        register_blob(conn, left_blob)
+        register_blob(conn, right_blob)
         conn.execute("""
             INSERT INTO patients (doctor_id, name, patient_id, age, gender, diabetes_duration,
             blood_pressure, medications, other_conditions, left_eye_path, right_eye_path,
-            left_result, right_result, combined_result, report_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            left_result, right_result, combined_result, report_id, model_version,
+            left_image_quality, right_image_quality)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             session["user_id"], patient_info["name"], patient_info["patient_id"], patient_info["age"],
             patient_info["gender"], patient_info["diabetes_duration"], patient_info["blood_pressure"],
             patient_info["medications"], patient_info["other_conditions"],
-            os.path.join("uploads", left_filename), # Store relative path in DB
-            os.path.join("uploads", right_filename),
+            left_blob, right_blob, # Store relative blob paths in DB; the insert trigger counts the references
             patient_info["left_result"], patient_info["right_result"],
-            patient_info["combined_result"], patient_info["report_id"]
+            patient_info["combined_result"], patient_info["report_id"], bundle.version,
+            json.dumps(quality["left"]) if "left" in quality else None,
+            json.dumps(quality["right"]) if "right" in quality else None,
         ))
         conn.commit()
+        saved = True
 
-        doctor = conn.execute("SELECT * FROM users WHERE id = ?", (session["user_id"],)).fetchone()
+        record = conn.execute("SELECT * FROM patients WHERE report_id = ?", (patient_info["report_id"],)).fetchone()
+        if embeddings is not None:
+            try:
+                store_for(bundle.version).append(record["id"], session["user_id"], gradable, embeddings)
+            except Exception as e:
+                print(f"⚠️ Could not store embeddings for similar cases: {e}")
+        if hashes:
+            try:
+                store_hashes(conn, record["id"], session["user_id"], hashes)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not store image hashes: {e}")
         
         # We will now check if the PDF generation succeeds
         try:
-            pdf_report_path = os.path.join(UPLOAD_FOLDER, f"{patient_info['report_id']}.pdf")
-            generate_pdf(patient_info, dict(doctor) if doctor else {}, pdf_report_path)
+            ensure_report_pdf(conn, dict(record))
             
             # Only flash success if PDF generation ALSO succeeds
             flash("Report generated successfully!", "success")
@@ -311,13 +635,224 @@ def generate_report():
         return redirect(url_for("dashboard"))
     except sqlite3.IntegrityError:
         flash("A patient with this ID (email) already has a record.", "danger")
-        return redirect(url_for("form"))
     except sqlite3.Error as e:
         flash(f"Database error saving report: {e}", "danger")
     finally:
         if conn: conn.close()
+        if not saved:
+            discard_uploads()
     return redirect(url_for("form"))
 
+# --- Doctor: Bulk Screening-Camp Upload ---
+def resume_camp_jobs(doctor_id):
+    """Restarts the doctor's camp jobs whose worker process died (camp_upload.resume_stale_jobs)."""
+    bundle = MODELS.current
+    if not bundle:
+        return
+    try:
+        resume_stale_jobs(DB_PATH, bundle.model, bundle.class_mapping, bundle.version, doctor_id=doctor_id)
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not resume interrupted camp jobs: {e}")
+
+@app.route("/camp_upload", methods=["GET", "POST"])
+def camp_upload():
+    if session.get("role") != "doctor":
+        return redirect(url_for("doctor_login"))
+
+    if request.method == "POST":
+        archive = request.files.get("archive")
+        manifest = request.files.get("manifest")
+        if not archive or not archive.filename:
+            flash("Please upload a ZIP archive of fundus images.", "danger")
+            return redirect(url_for("camp_upload"))
+        bundle = MODELS.current  # the whole job runs on this model, even across a reload
+        if not bundle:
+            flash("AI Model not available.", "danger")
+            return redirect(url_for("camp_upload"))
+        try:
+            # Extracts the images now; inference, saving and PDFs run in the background
+            job_id = start_camp_job(DB_PATH, session["user_id"], archive.stream,
+                                    manifest.stream if manifest and manifest.filename else None,
+                                    model=bundle.model, class_mapping=bundle.class_mapping,
+                                    model_version=bundle.version)
+        except ValueError as e:
+            flash(f"Camp upload rejected: {e}", "danger")
+            return redirect(url_for("camp_upload"))
+        return redirect(url_for("camp_job", job_id=job_id))
+
+    resume_camp_jobs(session["user_id"])
+    conn = get_db_connection()
+    jobs = []
+    if conn:
+        jobs = conn.execute("""
+            SELECT id, status, total_rows, inserted, created_at FROM camp_jobs
+            WHERE doctor_id = ? ORDER BY created_at DESC LIMIT 10
+        """, (session["user_id"],)).fetchall()
+        conn.close()
+    return render_template("camp_upload.html", doctor={'full_name': session.get("full_name", "Doctor")}, jobs=jobs)
+
+@app.route("/camp_upload/<job_id>")
+def camp_job(job_id):
+    if session.get("role") != "doctor":
+        return redirect(url_for("doctor_login"))
+
+    resume_camp_jobs(session["user_id"])
+    conn = get_db_connection()
+    if not conn: abort(500, description="Database connection failed")
+    job = get_camp_job(conn, job_id, session["user_id"])
+    conn.close()
+    if not job:
+        flash("Camp upload not found.", "danger")
+        return redirect(url_for("camp_upload"))
+    return render_template("camp_job.html", doctor={'full_name': session.get("full_name", "Doctor")}, job=job)
+
+@app.route("/camp_upload/<job_id>/status")
+def camp_job_status(job_id):
+    if session.get("role") != "doctor":
+        return jsonify({"error": "Please log in as a doctor."}), 401
+
+    resume_camp_jobs(session["user_id"])
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "Database error."}), 500
+    try:
+        job = get_camp_job(conn, job_id, session["user_id"])
+    finally:
+        conn.close()
+    if not job:
+        return jsonify({"error": "Camp upload not found."}), 404
+    return jsonify(job)
+
+# --- JSON Inference API (token authenticated, nothing is stored) ---
+def api_error(message, status):
+    response = jsonify({"error": message})
+    response.status_code = status
+    if status == 401:
+        response.headers["WWW-Authenticate"] = 'Bearer realm="visionai"'
+    return response
+
+def api_authorized(headers):
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        return verify_token(conn, token_from_headers(headers)) is not None
+    finally:
+        conn.close()
+
+def predict_eyes(images):
+    """
+    Classifies {eye: image bytes} in one batch on the serving model (MODELS.current).
+    Shared by the Flask route and the native route of the ASGI server (asgi.py).
+
+    Raises:
+        ValueError: If an image cannot be decoded.
+
+    Returns:
+        dict: The JSON body of a /api/v1/predict response.
+    """
+    bundle = MODELS.current  # callers check that a model is loaded; reloads never unload it
+    start = time.perf_counter()
+    eyes = list(images)
+    batch = np.concatenate([preprocess_image_bytes(images[eye]) for eye in eyes])
+    decoded = time.perf_counter()
+    probabilities = predict_probabilities(bundle.model, batch)
+    inferred = time.perf_counter()
+    MODELS.shadow_sample(batch, probabilities)
+    API_LATENCY.record("predict.decode", decoded - start)
+    API_LATENCY.record("predict.inference", inferred - decoded)
+
+    results, predictions = {}, []
+    for eye, probs in zip(eyes, probabilities):
+        pred = int(probs.argmax())
+        predictions.append(pred)
+        results[eye] = {
+            "label": bundle.class_mapping.get(pred, "Unknown"),
+            "class_index": pred,
+            "probabilities": {bundle.class_mapping.get(i, str(i)): round(float(p), 6) for i, p in enumerate(probs)},
+        }
+    return {
+        "eyes": results,
+        "combined_result": bundle.class_mapping.get(max(predictions), "Unknown"),
+        "model_version": bundle.version,
+        "timing_ms": {"decode": round((decoded - start) * 1000, 2),
+                      "inference": round((inferred - decoded) * 1000, 2)},
+    }
+
+def read_api_images():
+    """
+    Images of a /api/v1/predict request as {eye: bytes}: either multipart
+    fields left_eye / right_eye, or one raw image body with ?eye=left|right.
+    """
+    if request.mimetype == "multipart/form-data":
+        images = {eye: request.files[f"{eye}_eye"].read() for eye in ("left", "right")
+                  if f"{eye}_eye" in request.files}
+    else:
+        eye = request.args.get("eye", "left")
+        if eye not in ("left", "right"):
+            raise ValueError("eye must be 'left' or 'right'")
+        images = {eye: request.get_data(cache=False)}
+    images = {eye: data for eye, data in images.items() if data}
+    if not images:
+        raise ValueError("Send a left_eye and/or right_eye image, or a raw image body with ?eye=left|right")
+    if any(len(data) > API_MAX_IMAGE_BYTES for data in images.values()):
+        raise ValueError(f"Images are limited to {API_MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+    return images
+
+@app.route("/api/v1/predict", methods=["POST"])
+def api_predict():
+    if not api_authorized(request.headers):
+        return api_error("Missing or invalid API token.", 401)
+    if not MODELS.current:
+        return api_error("AI model not available.", 503)
+    if request.content_length and request.content_length > 2 * API_MAX_IMAGE_BYTES + 64 * 1024:
+        return api_error("Request too large.", 413)
+
+    try:
+        response = jsonify(predict_eyes(read_api_images()))
+    except ValueError as e:
+        return api_error(str(e), 400)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/api/v1/metrics")
+def api_metrics():
+    if not api_authorized(request.headers):
+        return api_error("Missing or invalid API token.", 401)
+    return jsonify({"api": API_LATENCY.snapshot(), "html": HTML_LATENCY.snapshot(),
+                    "page_cache": PAGE_CACHE.stats(), "model": MODELS.stats(),
+                    "since": API_LATENCY.started_at})
+
+# --- Model Administration (token authenticated; acts on the worker that serves the call) ---
+@app.route("/api/v1/admin/model")
+def api_model_status():
+    if not api_authorized(request.headers):
+        return api_error("Missing or invalid API token.", 401)
+    return jsonify(MODELS.stats())
+
+@app.route("/api/v1/admin/model/reload", methods=["POST"])
+def api_model_reload():
+    """Reloads the model file in the background; ?shadow=1 loads it as a shadow candidate."""
+    if not api_authorized(request.headers):
+        return api_error("Missing or invalid API token.", 401)
+    if not MODELS.reload_async(shadow=request.args.get("shadow") == "1"):
+        return api_error("A model reload is already running.", 409)
+    response = jsonify(MODELS.stats())
+    response.status_code = 202
+    return response
+
+@app.route("/api/v1/admin/model/<action>", methods=["POST"])
+def api_model_shadow(action):
+    """Promotes the shadow candidate to serving, or discards it."""
+    if not api_authorized(request.headers):
+        return api_error("Missing or invalid API token.", 401)
+    if action not in ("promote", "discard"):
+        abort(404)
+    bundle = MODELS.promote_shadow() if action == "promote" else MODELS.discard_shadow()
+    if bundle is None:
+        return api_error("There is no shadow model.", 409)
+    return jsonify(MODELS.stats())
+
 # --- Doctor: View/Download Specific Report ---
 @app.route("/report/<report_id>")
 def report(report_id):
@@ -335,28 +870,115 @@ def report(report_id):
          conn.close()
          abort(403) # Forbidden
 
-    conn.close()
-
     if not report_data:
+        conn.close()
         flash("Report not found or permission denied.", "danger")
         return redirect(url_for("dashboard"))
 
-    pdf_filename = f"{report_id}.pdf"
-    
-    # --- ** THIS IS THE FIX ** ---
-    # Create the full, absolute path as a string
-    pdf_path_str = os.path.join(UPLOAD_FOLDER, pdf_filename)
-    
-    # Use os.path.isfile() with the string path
-    if os.path.isfile(pdf_path_str):
-        action = request.args.get('action', 'view') 
-        # Pass the string UPLOAD_FOLDER to send_from_directory
-        return send_from_directory(UPLOAD_FOLDER, pdf_filename, as_attachment=(action == 'download'))
-    else:
-        # This is the error you are seeing
-        flash(f"Report PDF file is missing from the server. [Path: {pdf_filename}]", "danger")
-        print(f"❌ File check failed. Looking for: {pdf_path_str}") 
+    # Renders the PDF on demand if it is missing or stale, then serves it with ETag/Range support
+    try:
+        pdf_path_str, etag = ensure_report_pdf(conn, dict(report_data))
+    except Exception as e:
+        flash(f"Report PDF could not be generated: {e}", "danger")
+        print(f"❌ FAILED TO GENERATE PDF for {report_id}: {e}")
         return redirect(url_for("dashboard"))
+    finally:
+        conn.close()
+
+    action = request.args.get('action', 'view')
+    return send_report_pdf(pdf_path_str, etag, as_attachment=(action == 'download'))
+
+# --- Doctor: Similar Prior Cases ---
+SIMILAR_CASES = 10
+
+@app.route("/report/<report_id>/similar")
+def similar_cases(report_id):
+    """
+    The doctor's prior cases whose fundus images the serving model sees as
+    most similar to this one (embedding_index.py), with their grades.
+    ?format=json returns them as JSON.
+    """
+    if session.get("role") != "doctor":
+        flash("Please log in as a doctor.", "warning")
+        return redirect(url_for("doctor_login"))
+    bundle = MODELS.current
+    if not bundle:
+        flash("AI Model not available.", "danger")
+        return redirect(url_for("dashboard"))
+
+    conn = get_db_connection()
+    if not conn: abort(500, description="Database connection failed")
+    try:
+        report_data = conn.execute("SELECT * FROM patients WHERE report_id = ? AND doctor_id = ?",
+                                   (report_id, session["user_id"])).fetchone()
+        if not report_data:
+            flash("Report not found or permission denied.", "danger")
+            return redirect(url_for("dashboard"))
+
+        store = store_for(bundle.version)
+        hits = store.similar_records(report_data["id"], session["user_id"], SIMILAR_CASES)
+        if hits is None and bundle.embedding_model is not None:
+            # Not embedded by this model yet (an older record or model): embed its gradable eyes now
+            eyes = [eye for eye in ("left", "right")
+                    if report_data[f"{eye}_result"] in bundle.class_mapping.values()
+                    and resolve_path(report_data[f"{eye}_eye_path"])]
+            try:
+                if eyes:
+                    batch = np.concatenate([preprocess_image(resolve_path(report_data[f"{eye}_eye_path"]))
+                                            for eye in eyes])
+                    _, embeddings = predict_with_embeddings(bundle.embedding_model, batch)
+                    store.append(report_data["id"], session["user_id"], eyes, embeddings)
+                    hits = store.similar_records(report_data["id"], session["user_id"], SIMILAR_CASES)
+            except Exception as e:
+                print(f"⚠️ Could not embed report {report_id} for similar cases: {e}")
+
+        rows = {}
+        if hits:
+            placeholders = ", ".join("?" * len(hits))
+            rows = {row["id"]: row for row in conn.execute(f"""
+                SELECT id, report_id, name, created_at, left_result, right_result, left_confirmed, right_confirmed
+                FROM patients WHERE doctor_id = ? AND id IN ({placeholders})
+            """, (session["user_id"], *(hit["record"] for hit in hits)))}
+    finally:
+        conn.close()
+
+    cases = []
+    for hit in hits or []:
+        row = rows.get(hit["record"])
+        if row is None:
+            continue  # deleted since it was embedded
+        case = {key: row[key] for key in row.keys() if key != "id"}
+        case.update(eye=hit["eye"], query_eye=hit["query_eye"], score=hit["score"],
+                    # The doctor-confirmed grade where there is one, otherwise the AI's
+                    left_grade=row["left_confirmed"] or row["left_result"],
+                    right_grade=row["right_confirmed"] or row["right_result"])
+        cases.append(case)
+    if request.args.get("format") == "json":
+        return jsonify({"report_id": report_id, "model_version": bundle.version, "cases": cases})
+    return render_template("similar_cases.html", doctor={'full_name': session.get("full_name", "Doctor")},
+                           report=report_data, cases=cases, indexed=hits is not None)
+
+# --- Doctor: Fundus Image Thumbnails ---
+@app.route("/report/<report_id>/thumbnail/<eye>")
+def report_thumbnail(report_id, eye):
+    if session.get("role") != "doctor":
+        abort(403)
+    if eye not in ("left", "right"):
+        abort(404)
+
+    conn = get_db_connection()
+    if not conn: abort(500, description="Database connection failed")
+    row = conn.execute(f"SELECT {eye}_eye_path FROM patients WHERE report_id = ? AND doctor_id = ?",
+                       (report_id, session["user_id"])).fetchone()
+    conn.close()
+
+    original = resolve_path(row[0]) if row else None
+    if not original:
+        abort(404)
+    thumb = derivative_path(original, "thumb")
+    if not os.path.isfile(thumb):
+        ensure_derivatives(original, kinds=("thumb",))
+    return send_from_directory(os.path.dirname(thumb), os.path.basename(thumb), max_age=86400)
 
 # --- Patient Portal (Login Required) ---
 @app.route("/patient_dashboard")
@@ -364,17 +986,23 @@ def patient_dashboard():
     if session.get("role") != "patient":
         return redirect(url_for("patient_login"))
 
+    per_page = get_page_size(request.args.get("per_page"))
     conn = get_db_connection()
     if not conn:
         flash("Database error.", "danger")
-        return render_template("patient.html", reports=[], user=None)
+        return render_template("patient.html", reports=[], user=None, per_page=per_page)
 
-    reports = conn.execute("SELECT * FROM patients WHERE patient_id = ? ORDER BY created_at DESC",
-                           (session["username"],)).fetchall()
-    user_details = conn.execute("SELECT * FROM users WHERE id = ?", (session["user_id"],)).fetchone()
+    reports, next_cursor, prev_cursor = keyset_page(
+        conn, ["report_id", "combined_result"],
+        "patient_id = ?", (session["username"],), per_page,
+        after=request.args.get("after"), before=request.args.get("before"))
+    user_details = conn.execute("""
+        SELECT full_name, username, age, gender, contact_number, address FROM users WHERE id = ?
+    """, (session["user_id"],)).fetchone()
     conn.close()
 
-    return render_template("patient.html", reports=reports, user=user_details)
+    return render_template("patient.html", reports=reports, user=user_details,
+                           per_page=per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 # --- Patient Report Access ---
 @app.route("/patient_report/<report_id>")
@@ -388,25 +1016,22 @@ def patient_report(report_id):
 
     report_data = conn.execute("SELECT * FROM patients WHERE report_id = ? AND patient_id = ?",
                                (report_id, session["username"])).fetchone()
-    conn.close()
 
     if report_data:
-        pdf_filename = f"{report_id}.pdf"
-        
-        # --- ** THIS IS THE FIX ** ---
-        # Create the full, absolute path as a string
-        pdf_path_str = os.path.join(UPLOAD_FOLDER, pdf_filename)
-        
-        # Use os.path.isfile() with the string path
-        if os.path.isfile(pdf_path_str):
-            action = request.args.get('action', 'view')
-            # Pass the string UPLOAD_FOLDER to send_from_directory
-            return send_from_directory(UPLOAD_FOLDER, pdf_filename, as_attachment=(action == 'download'))
-        else:
-            flash("Report PDF file is missing.", "danger")
-            print(f"❌ File check failed (patient). Looking for: {pdf_path_str}")
+        # Renders the PDF on demand if it is missing or stale, then serves it with ETag/Range support
+        try:
+            pdf_path_str, etag = ensure_report_pdf(conn, dict(report_data))
+        except Exception as e:
+            flash("Report PDF could not be generated.", "danger")
+            print(f"❌ FAILED TO GENERATE PDF for {report_id} (patient): {e}")
             return redirect(url_for("patient_dashboard"))
+        finally:
+            conn.close()
+
+        action = request.args.get('action', 'view')
+        return send_report_pdf(pdf_path_str, etag, as_attachment=(action == 'download'))
     else:
+        conn.close()
         flash("Report not found or access denied.", "danger")
         return redirect(url_for("patient_dashboard"))
 # --- ** END OF FIX ** ---
@@ -415,10 +1040,12 @@ def patient_report(report_id):
 if __name__ == "__main__":
     if not os.path.exists(DB_PATH): # Use os.path.exists
         print(f"Database not found at {DB_PATH}. Initializing...")
-        try:
-            init_db()
-        except Exception as e:
-            print(f"❌ Failed to initialize database: {e}")
+    try:
+        # Creates missing tables and applies any pending schema migrations,
+        # so existing records.db files are upgraded in place.
+        init_db()
+    except Exception as e:
+        print(f"❌ Failed to initialize database: {e}")
     
     print("🚀 Starting VisionAI Flask server...")
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,305 @@
+# backend/asgi.py
+# Async (ASGI) serving mode for the VisionAI Flask app.
+#
+#   uvicorn asgi:app --app-dir backend --host 0.0.0.0 --port 5000
+#
+# Lifespan startup creates and migrates records.db (db_init.init_db) before
+# the server accepts requests, as `python app.py` and serve.py do.
+#
+# The event loop owns every socket. A request body is received completely
+# (spooled to disk past SPOOL_MEMORY) before any thread is involved, and the
+# response body, including send_file PDFs, is written back chunk by chunk while
+# the loop waits on slow clients. A Flask route therefore holds one thread of
+# the bounded request pool only while it is actually computing. That pool is
+# where its DB access, inference and PDF rendering run.
+#
+# POST /api/v1/predict with a raw image body is served natively. Token lookup,
+# decoding and inference run on a separate bounded inference pool, so API
+# traffic is not queued behind page renders. Multipart API requests and every
+# other route go through the Flask app unchanged. When MAX_PENDING requests
+# are already waiting for a thread (running ones do not count), new ones get
+# 503 + Retry-After rather than an ever-growing queue.
+#
+# Environment:
+#   VISIONAI_ASGI_THREADS       request pool size (default 8)
+#   VISIONAI_INFERENCE_THREADS  inference pool size (default 1; TensorFlow
+#                               already parallelises each batch internally)
+#   VISIONAI_MAX_PENDING        requests waiting for a thread before answering 503 (default 64)
+#   VISIONAI_MAX_BODY_MB        largest accepted request body (default 512)
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.datastructures import Headers
+
+import app as flask_app
+from db_init import init_db
+
+REQUEST_THREADS = int(os.environ.get("VISIONAI_ASGI_THREADS", 8))
+INFERENCE_THREADS = int(os.environ.get("VISIONAI_INFERENCE_THREADS", 1))
+MAX_PENDING = int(os.environ.get("VISIONAI_MAX_PENDING", 64))
+MAX_BODY = int(os.environ.get("VISIONAI_MAX_BODY_MB", 512)) * 1024 * 1024
+SPOOL_MEMORY = 1024 * 1024  # request bodies larger than this are buffered on disk
+IO_THREADS = 4  # reading response chunks (e.g. PDF files) off disk
+
+_END = object()
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class VisionAIASGI:
+    """ASGI application that serves a WSGI (Flask) app from bounded thread pools."""
+
+    def __init__(self, wsgi_app, request_threads=REQUEST_THREADS, inference_threads=INFERENCE_THREADS,
+                 max_pending=MAX_PENDING):
+        self.wsgi_app = wsgi_app
+        self.request_pool = ThreadPoolExecutor(request_threads, thread_name_prefix="asgi-request")
+        self.inference_pool = ThreadPoolExecutor(inference_threads, thread_name_prefix="asgi-inference")
+        self.io_pool = ThreadPoolExecutor(IO_THREADS, thread_name_prefix="asgi-io")
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            if self.pending >= self.max_pending:
+                await _send_simple(send, 503, b"Server busy, please retry.", [(b"retry-after", b"1")])
+                return
+            headers = _headers(scope)
+            try:
+                if (scope["path"] == "/api/v1/predict" and scope["method"] == "POST"
+                        and not headers.get("Content-Type", "").startswith("multipart/")):
+                    await self._predict(scope, receive, send, headers)
+                else:
+                    await self._call_wsgi(scope, receive, send, headers)
+            except ClientDisconnected:
+                pass
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    # Off the event loop: a migration can take a while on a large records.db
+                    await asyncio.get_running_loop().run_in_executor(None, init_db, flask_app.DB_PATH)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": f"Database migration failed: {e}"})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for pool in (self.request_pool, self.inference_pool, self.io_pool):
+                    pool.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _run(self, pool, fn, *args):
+        """Runs fn on a pool, counting it as pending until a thread picks it up."""
+        loop = asyncio.get_running_loop()
+        queued = True
+
+        def dequeued():
+            # On the event loop thread, like every other access to self.pending
+            nonlocal queued
+            if queued:
+                queued = False
+                self.pending -= 1
+
+        def call():
+            loop.call_soon_threadsafe(dequeued)
+            return fn(*args)
+
+        self.pending += 1
+        try:
+            return await loop.run_in_executor(pool, call)
+        finally:
+            dequeued()  # finished before the callback ran, or cancelled while queued
+
+    # --- Flask (WSGI) routes ---
+
+    async def _call_wsgi(self, scope, receive, send, headers):
+        try:
+            body, length = await _receive_body(receive, tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY))
+        except BodyTooLarge:
+            await _send_simple(send, 413, b"Request body too large.")
+            return
+        try:
+            environ = _wsgi_environ(scope, headers, body, length)
+            status, response_headers, iterable = await self._run(self.request_pool, _start_wsgi,
+                                                                self.wsgi_app, environ)
+            await send({"type": "http.response.start", "status": status, "headers": response_headers})
+            loop = asyncio.get_running_loop()
+            try:
+                if isinstance(iterable, (list, tuple)):
+                    for chunk in iterable:
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                else:
+                    # Files and generators are read off the loop; the loop only waits on the client
+                    iterator = iter(iterable)
+                    while (chunk := await loop.run_in_executor(self.io_pool, next, iterator, _END)) is not _END:
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            finally:
+                if hasattr(iterable, "close"):
+                    await loop.run_in_executor(self.io_pool, iterable.close)
+        finally:
+            body.close()
+
+    # --- Native /api/v1/predict ---
+
+    async def _predict(self, scope, receive, send, headers):
+        start = time.perf_counter()
+        eye = parse_qs(scope["query_string"].decode("latin-1")).get("eye", ["left"])[0]
+        try:
+            body, _ = await _receive_body(receive, tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY),
+                                          limit=flask_app.API_MAX_IMAGE_BYTES)
+        except BodyTooLarge:
+            await _send_json(send, 413, {"error": "Request too large."})
+            return
+        with body:
+            data = body.read()
+        status, payload = await self._run(self.inference_pool, _predict_raw, headers, eye, data)
+        extra = [(b"www-authenticate", b'Bearer realm="visionai"')] if status == 401 else []
+        elapsed = time.perf_counter() - start
+        flask_app.API_LATENCY.record("api_predict", elapsed)
+        extra.append((b"server-timing", f"total;dur={elapsed * 1000:.1f}".encode()))
+        await _send_json(send, status, payload, extra)
+
+
+def _predict_raw(headers, eye, data):
+    """Inference-pool body of the native predict route: (status, JSON payload)."""
+    if not flask_app.api_authorized(headers):
+        return 401, {"error": "Missing or invalid API token."}
+    if not flask_app.MODELS.current:
+        return 503, {"error": "AI model not available."}
+    if eye not in ("left", "right"):
+        return 400, {"error": "eye must be 'left' or 'right'"}
+    if not data:
+        return 400, {"error": "Send a raw image body with ?eye=left|right"}
+    try:
+        return 200, flask_app.predict_eyes({eye: data})
+    except ValueError as e:
+        return 400, {"error": str(e)}
+
+
+def _start_wsgi(wsgi_app, environ):
+    """Request-pool body: runs the WSGI app up to its first response chunk."""
+    captured = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        captured["status"] = int(status.split(" ", 1)[0])
+        captured["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response_headers]
+        return lambda data: captured.setdefault("written", []).append(data)
+
+    iterable = wsgi_app(environ, start_response)
+    if isinstance(iterable, (list, tuple)):
+        chunks = list(captured.get("written", [])) + list(iterable)
+        return captured["status"], captured["headers"], chunks
+    # Pull the first chunk here so start_response has been called for lazy iterables too
+    iterator = iter(iterable)
+    first = next(iterator, _END)
+    chunks = captured.get("written", []) + ([] if first is _END else [first])
+
+    class Rest:
+        def __iter__(self):
+            yield from chunks
+            yield from iterator
+
+        def close(self):
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    return captured["status"], captured["headers"], Rest()
+
+
+def _headers(scope):
+    headers = Headers()
+    for key, value in scope["headers"]:
+        headers.add(key.decode("latin-1"), value.decode("latin-1"))
+    return headers
+
+
+async def _receive_body(receive, body, limit=MAX_BODY):
+    """Reads the whole request body from the client into `body`; returns (body, length)."""
+    length = 0
+    more = True
+    try:
+        while more:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+            chunk = message.get("body", b"")
+            length += len(chunk)
+            if length > limit:
+                raise BodyTooLarge()
+            body.write(chunk)
+            more = message.get("more_body", False)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body, length
+
+
+def _wsgi_environ(scope, headers, body, length):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for key, value in headers.items():
+        name = key.upper().replace("-", "_")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            name = f"HTTP_{name}"
+            # Repeated headers are joined; cookies use their own separator
+            separator = "; " if name == "HTTP_COOKIE" else ","
+            environ[name] = f"{environ[name]}{separator}{value}" if name in environ else value
+    return environ
+
+
+async def _send_simple(send, status, body, extra_headers=()):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                            (b"content-length", str(len(body)).encode()), *extra_headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, status, payload, extra_headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"cache-control", b"no-store"),
+                            (b"content-length", str(len(body)).encode()), *extra_headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+app = VisionAIASGI(flask_app.app)
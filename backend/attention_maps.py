@@ -0,0 +1,102 @@
+# backend/attention_maps.py
+# Grad-CAM attention overlays of uploaded fundus images, cached next to the
+# upload like its other derivatives (see image_derivatives.py):
+#   <original>.gradcam-<model tag>.jpg
+#
+# The maps come from backend_utils.predict_with_gradcam, computed in the same
+# pass that classifies both eyes. The model tag is derived from the model
+# version, so a retrained model never reuses maps of an older one. Records
+# that still show the older model's results keep theirs.
+import hashlib
+import os
+import re
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from image_derivatives import get_derivative
+
+OVERLAY_ALPHA = 0.5  # heat colour opacity at the map's maximum
+OVERLAY_QUALITY = 85
+ATTENTION_MAP_SUFFIX = re.compile(r"\.gradcam-[0-9a-f]+\.jpg$")
+
+
+def model_tag(model_version: str) -> str:
+    return hashlib.sha256(str(model_version).encode("utf-8")).hexdigest()[:10]
+
+
+def attention_map_path(original_path: str, model_version: str) -> str:
+    """Cache path of an image's attention overlay for a model version."""
+    return f"{original_path}.gradcam-{model_tag(model_version)}.jpg"
+
+
+def is_attention_map(path: str) -> bool:
+    return bool(ATTENTION_MAP_SUFFIX.search(path))
+
+
+def find_attention_map(original_path, model_version):
+    """The cached overlay of an image for a model version, or None if there is none."""
+    if not original_path or not model_version:
+        return None
+    path = attention_map_path(original_path, model_version)
+    return path if os.path.isfile(path) else None
+
+
+def _jet(values: np.ndarray) -> np.ndarray:
+    """Blue -> cyan -> yellow -> red colour map of values in [0, 1], as float RGB."""
+    v = values[..., None]
+    centers = np.array([0.75, 0.5, 0.25], dtype=np.float32)  # where R, G, B peak
+    return np.clip(1.5 - np.abs(4.0 * (v - centers)), 0.0, 1.0)
+
+
+def render_overlay(original_path: str, cam: np.ndarray, out_path: str):
+    """
+    Blends a Grad-CAM map over the print-resolution copy of an image.
+
+    Args:
+        original_path (str): Absolute path of the uploaded image.
+        cam (np.ndarray): Map scaled to [0, 1], shape (height, width) at layer resolution.
+        out_path (str): Where to write the JPEG overlay.
+    """
+    with Image.open(get_derivative(original_path, "print")) as img:
+        base = np.asarray(img.convert("RGB"), dtype=np.float32) / 255.0
+    # The model saw the whole image stretched to a square, so the map stretches back the same way
+    heat = Image.fromarray(np.uint8(np.clip(cam, 0.0, 1.0) * 255)).resize(
+        (base.shape[1], base.shape[0]), Image.BICUBIC)
+    heat = np.asarray(heat, dtype=np.float32) / 255.0
+    # Weighting the opacity by the map keeps the fundus visible where the model did not look
+    alpha = OVERLAY_ALPHA * heat[..., None]
+    blended = base * (1.0 - alpha) + _jet(heat) * alpha
+    out = Image.fromarray(np.uint8(np.clip(blended, 0.0, 1.0) * 255 + 0.5))
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".jpg")
+    os.close(fd)
+    try:
+        out.save(tmp_path, "JPEG", quality=OVERLAY_QUALITY, optimize=True)
+        os.replace(tmp_path, out_path)  # atomic: readers never see a partial file
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_attention_maps(original_paths, cams, model_version: str) -> list:
+    """
+    Writes the overlays for a batch of images, skipping ones already cached.
+
+    Args:
+        original_paths (list): Absolute paths of the images, in batch order.
+        cams (np.ndarray): Their maps, as returned by predict_with_gradcam.
+        model_version (str): Version of the model that produced the maps.
+
+    Returns:
+        list: Overlay paths, in batch order.
+    """
+    paths = []
+    for original_path, cam in zip(original_paths, cams):
+        out_path = attention_map_path(original_path, model_version)
+        if not os.path.isfile(out_path):
+            render_overlay(original_path, cam, out_path)
+        paths.append(out_path)
+    return paths
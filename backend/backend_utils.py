@@ -39,12 +39,17 @@
 
 # backend_utils.py
 
+import io
 import json
+import os
 from pathlib import Path
 from typing import Dict, Tuple
 
 import numpy as np
-from tensorflow.keras.models import Model, load_model
+import tensorflow as tf
+from PIL import Image
+from tensorflow.keras.layers import Dense
+from tensorflow.keras.models import Model, load_model, model_from_json
 from tensorflow.keras.preprocessing import image
 
 # --- Constants and Path Definitions ---
@@ -52,12 +57,24 @@ from tensorflow.keras.preprocessing import image
 # Use pathlib for a modern, object-oriented approach to paths
 # ROOT_DIR is the main project folder (e.g., DRDETECTION)
 ROOT_DIR: Path = Path(__file__).resolve().parent.parent
-MODEL_PATH: Path = ROOT_DIR / "models" / "best_model.keras"
+# VISIONAI_MODEL_PATH (relative to ROOT_DIR) selects another model file, e.g. the
+# memory-mappable models/best_model.mmap.json written by convert_model.py --mmap
+MODEL_PATH: Path = ROOT_DIR / os.environ.get("VISIONAI_MODEL_PATH", "models/best_model.keras")
 CLASS_PATH: Path = ROOT_DIR / "models" / "class_indices.json"
 
 # Set of allowed image file extensions
 ALLOWED_EXTENSIONS: set[str] = {"png", "jpg", "jpeg"}
 
+# Memory-mappable model format (see convert_model.py): a JSON index holding the
+# architecture and the shape, dtype and offset of every weight array, and one
+# flat file of the raw arrays, each starting on an MMAP_ALIGNMENT boundary
+MMAP_INDEX_SUFFIX: str = ".mmap.json"
+MMAP_FORMAT: str = "visionai-mmap-1"
+MMAP_ALIGNMENT: int = 64
+
+# Last convolution of the VGG16 base: 14x14 spatial maps at 224x224 input
+GRADCAM_LAYER: str = "block5_conv3"
+
 
 # --- Helper Functions ---
 
@@ -94,6 +111,145 @@ def preprocess_image(
     return x
 
 
+def preprocess_image_bytes(
+    data: bytes, target_size: Tuple[int, int] = (224, 224)
+) -> np.ndarray:
+    """
+    In-memory equivalent of preprocess_image for uploaded bytes, so a
+    prediction does not need the image written to disk first. Mirrors
+    Keras' load_img (RGB, nearest-neighbour resize) exactly.
+
+    Args:
+        data (bytes): The encoded image (PNG or JPEG).
+        target_size (Tuple[int, int], optional): The target size for the image. Defaults to (224, 224).
+
+    Raises:
+        ValueError: If the bytes are not a readable image.
+
+    Returns:
+        np.ndarray: The preprocessed image as a NumPy array with a batch dimension.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        img = img.convert("RGB")
+    except Exception:
+        raise ValueError("not a readable PNG or JPEG image")
+    width_height = (target_size[1], target_size[0])
+    if img.size != width_height:
+        img = img.resize(width_height, Image.NEAREST)
+    x = np.asarray(img, dtype=np.float32) / 255.0
+    return np.expand_dims(x, axis=0)
+
+
+def predict_probabilities(model: Model, batch: np.ndarray) -> np.ndarray:
+    """
+    Runs the model on a small batch and returns its class probabilities.
+    Calls the model directly instead of Model.predict, which sets up a
+    tf.data pipeline on every call and dominates latency for one or two images.
+    Eager calls also run on the calling thread, which keeps inference safe in
+    workers forked from a preloaded master (see serve.py).
+
+    Args:
+        model (Model): The loaded Keras model.
+        batch (np.ndarray): Preprocessed images, shape (n, height, width, 3).
+
+    Returns:
+        np.ndarray: Shape (n, number of classes).
+    """
+    return np.asarray(model(batch, training=False))
+
+
+def build_gradcam_model(model: Model, layer_name: str = GRADCAM_LAYER) -> Model:
+    """
+    Wraps the classifier so one call returns the activations of `layer_name`,
+    the class scores to explain, the class probabilities and the embeddings
+    (see build_embedding_model). Shares the classifier's weights. When the
+    head is a softmax Dense layer, the scores are its pre-softmax logits,
+    from a linear copy of the head: a confident softmax output has near-zero
+    gradients.
+
+    Args:
+        model (Model): The loaded Keras model.
+        layer_name (str, optional): Convolution layer to explain. Defaults to GRADCAM_LAYER.
+
+    Raises:
+        ValueError: If the model has no layer called `layer_name`.
+
+    Returns:
+        Model: Model with outputs [activations, scores, probabilities, embeddings].
+    """
+    activations = model.get_layer(layer_name).output
+    head = model.layers[-1]
+    scores = model.output
+    if isinstance(head, Dense) and head.get_config().get("activation") == "softmax":
+        linear = Dense(head.units, name="gradcam_logits")
+        scores = linear(head.input)
+        linear.set_weights(head.get_weights())
+    return Model(inputs=model.inputs, outputs=[activations, scores, model.output, head.input])
+
+
+def predict_with_gradcam(gradcam_model: Model, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Class probabilities, Grad-CAM maps and embeddings for a batch from a
+    single forward and backward pass. The images in a batch do not interact
+    at inference time, so the gradient of the summed top-class scores gives
+    every image the gradient of its own top-class score.
+
+    Args:
+        gradcam_model (Model): Model built by build_gradcam_model.
+        batch (np.ndarray): Preprocessed images, shape (n, height, width, 3).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Probabilities, shape (n, number of classes),
+        maps scaled to [0, 1], shape (n, layer height, layer width), and embeddings, shape (n, 1024).
+    """
+    x = tf.convert_to_tensor(batch)
+    with tf.GradientTape() as tape:
+        activations, scores, probabilities, embeddings = gradcam_model(x, training=False)
+        top_class = tf.argmax(probabilities, axis=1)
+        score = tf.reduce_sum(tf.gather(scores, top_class, axis=1, batch_dims=1))
+    gradients = tape.gradient(score, activations)
+
+    # Channel weights: spatially averaged gradients; map: ReLU of the weighted activation sum
+    weights = tf.reduce_mean(gradients, axis=(1, 2), keepdims=True)
+    cams = tf.nn.relu(tf.reduce_sum(weights * activations, axis=-1))
+    cams = cams / (tf.reduce_max(cams, axis=(1, 2), keepdims=True) + 1e-8)
+    return np.asarray(probabilities), np.asarray(cams), np.asarray(embeddings)
+
+
+def build_embedding_model(model: Model) -> Model:
+    """
+    Wraps the classifier so one call returns the class probabilities and the
+    image's embedding: the input of the classification head, i.e. the
+    Dense(1024) activations of build_vgg16_model (dropout is inactive at
+    inference). Shares the classifier's weights. Used for similar-case
+    retrieval (embedding_index.py).
+
+    Args:
+        model (Model): The loaded Keras model.
+
+    Returns:
+        Model: Model with outputs [probabilities, embeddings].
+    """
+    return Model(inputs=model.inputs, outputs=[model.output, model.layers[-1].input])
+
+
+def predict_with_embeddings(embedding_model: Model, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Class probabilities and embeddings for a batch, eagerly as predict_probabilities.
+
+    Args:
+        embedding_model (Model): Model built by build_embedding_model.
+        batch (np.ndarray): Preprocessed images, shape (n, height, width, 3).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Probabilities, shape (n, number of classes),
+        and embeddings, shape (n, 1024).
+    """
+    probabilities, embeddings = embedding_model(batch, training=False)
+    return np.asarray(probabilities), np.asarray(embeddings)
+
+
 def load_class_mapping() -> Dict[int, str]:
     """
     Loads the class index to class name mapping from a JSON file.
@@ -112,9 +268,67 @@ def load_class_mapping() -> Dict[int, str]:
     return {int(k): v for k, v in class_mapping.items()}
 
 
-def load_dr_model() -> Model:
+def configure_tensorflow_threads(intra_op: int, inter_op: int) -> None:
+    """
+    Sets TensorFlow's CPU thread pool sizes. Must run before the model is
+    loaded: the pools are created when the TensorFlow runtime starts and
+    cannot be resized afterwards.
+
+    Args:
+        intra_op (int): Threads used inside a single op (e.g. one convolution).
+        inter_op (int): Threads used to run independent ops concurrently.
+    """
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+
+def load_mmap_model(index_path: str | Path) -> Model:
+    """
+    Builds a model from the memory-mappable format written by convert_model.py --mmap.
+    The weight file is mapped instead of parsed: each array is a view of the
+    page cache, which every process loading the same file shares, and is
+    assigned to its variable straight from that view. The variables are the
+    only private copy; float16 weights are widened one array at a time, so
+    the largest single weight is all that is allocated on top.
+
+    Args:
+        index_path (str | Path): The <name>.mmap.json index.
+
+    Raises:
+        ValueError: If the index is not in this format, does not match the
+                    architecture, or the weight file is truncated.
+
+    Returns:
+        Model: The model, not compiled (inference only).
+    """
+    index_path = Path(index_path)
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    if index.get("format") != MMAP_FORMAT:
+        raise ValueError(f"{index_path.name} is not a {MMAP_FORMAT} model index")
+
+    model = model_from_json(json.dumps(index["model"]))
+    data = np.memmap(index_path.with_name(index["data"]), dtype=np.uint8, mode="r")
+    variables = model.weights  # the order get_weights / set_weights use
+    if len(variables) != len(index["weights"]):
+        raise ValueError(f"{index_path.name} has {len(index['weights'])} weights, the model {len(variables)}")
+    for variable, entry in zip(variables, index["weights"]):
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        if entry["offset"] + count * dtype.itemsize > len(data):
+            raise ValueError(f"{index['data']} is truncated")
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=entry["offset"]).reshape(entry["shape"])
+        variable.assign(array.astype(np.float32) if dtype == np.float16 else array)
+    return model
+
+
+def load_dr_model(model_path: str | Path = MODEL_PATH) -> Model:
     """
-    Loads the trained Keras model for Diabetic Retinopathy detection.
+    Loads the trained Keras model for Diabetic Retinopathy detection, from a
+    .keras/.h5 file or a memory-mappable .mmap.json index (load_mmap_model).
+
+    Args:
+        model_path (str | Path, optional): The model file. Defaults to MODEL_PATH.
 
     Raises:
         FileNotFoundError: If the model file (best_model.keras) is not found.
@@ -122,7 +336,28 @@ def load_dr_model() -> Model:
     Returns:
         Model: The loaded TensorFlow/Keras model.
     """
-    if not MODEL_PATH.is_file():
-        raise FileNotFoundError(f"Model file not found at {MODEL_PATH}")
-    print(f"✅ Loading model from: {MODEL_PATH}")
-    return load_model(MODEL_PATH)
\ No newline at end of file
+    model_path = Path(model_path)
+    if not model_path.is_file():
+        raise FileNotFoundError(f"Model file not found at {model_path}")
+    print(f"✅ Loading model from: {model_path}")
+    if model_path.name.endswith(MMAP_INDEX_SUFFIX):
+        return load_mmap_model(model_path)
+    return load_model(model_path)
+
+
+def get_model_version(model_path: str | Path = MODEL_PATH) -> str:
+    """
+    Returns a short identifier of the deployed model file, recorded with each
+    prediction so reports can tell which model produced them.
+
+    Args:
+        model_path (str | Path, optional): The model file. Defaults to MODEL_PATH.
+
+    Returns:
+        str: "<file name>@<size>-<mtime>", or "unknown" if the file is missing.
+    """
+    path = Path(model_path)
+    if not path.is_file():
+        return "unknown"
+    stat = path.stat()
+    return f"{path.name}@{stat.st_size}-{int(stat.st_mtime)}"
\ No newline at end of file
@@ -0,0 +1,136 @@
+# backend/bench_concurrency.py
+# Concurrent-connection capacity: the Flask development server (what
+# `python app.py` runs) against the ASGI serving mode in asgi.py.
+#
+# For each level, N clients open a POST and then trickle its body one byte per
+# second, like a phone uploading over a weak camp connection. Meanwhile a probe
+# measures the latency of ordinary page loads, and the server's thread count
+# and resident memory are sampled from /proc.
+#
+# Usage: python bench_concurrency.py [--connections 10 100 500] [--servers flask-dev asgi]
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERS = {
+    "flask-dev": "import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)",
+    "asgi": "import uvicorn; uvicorn.run('asgi:app', host='127.0.0.1', port={port}, log_level='warning', "
+            "backlog=4096, timeout_keep_alive=30)",
+}
+SLOW_BODY_BYTES = 4096
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def proc_status(pid):
+    """(threads, RSS in MB) of a process, from /proc."""
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            fields[key] = value.strip()
+    return int(fields["Threads"]), int(fields["VmRSS"].split()[0]) / 1024
+
+
+async def wait_ready(port, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def slow_upload(port, stop):
+    """Sends request headers, then one body byte per second until stopped."""
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"POST /doctor_login HTTP/1.1\r\nHost: bench\r\n"
+                     b"Content-Type: application/x-www-form-urlencoded\r\n"
+                     b"Content-Length: %d\r\n\r\nusername=" % SLOW_BODY_BYTES)
+        await writer.drain()
+        while not stop.is_set():
+            writer.write(b"a")
+            await writer.drain()
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+        writer.close()
+        return True
+    except OSError:
+        return False
+
+
+async def probe(port, timeout=10.0):
+    """Latency (seconds) of one GET / on a fresh connection, or None on failure/timeout."""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+        writer.write(b"GET / HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        return time.perf_counter() - start if data.startswith(b"HTTP/1.1 200") or b" 200 " in data[:20] else None
+    except (OSError, asyncio.TimeoutError):
+        return None
+
+
+async def run_level(port, pid, connections, probes):
+    stop = asyncio.Event()
+    uploads = [asyncio.create_task(slow_upload(port, stop)) for _ in range(connections)]
+    await asyncio.sleep(2.0)  # let every slow client connect and start trickling
+    latencies = []
+    for _ in range(probes):
+        latencies.append(await probe(port))
+    threads, rss = proc_status(pid)
+    stop.set()
+    await asyncio.gather(*uploads, return_exceptions=True)
+    ok = [l for l in latencies if l is not None]
+    return {
+        "threads": threads, "rss_mb": rss, "failed": len(latencies) - len(ok),
+        "p50_ms": statistics.median(ok) * 1000 if ok else float("nan"),
+        "max_ms": max(ok) * 1000 if ok else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slow-client capacity: Flask dev server vs ASGI mode")
+    parser.add_argument("--connections", type=int, nargs="+", default=[10, 100, 500],
+                        help="Concurrent slow uploads per level")
+    parser.add_argument("--servers", nargs="+", default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument("--probes", type=int, default=20, help="Page loads measured per level")
+    args = parser.parse_args()
+
+    print(f"{'server':<11}{'slow conns':>11}{'threads':>9}{'RSS MB':>9}{'probe p50 ms':>14}"
+          f"{'probe max ms':>14}{'failed':>8}")
+    for name in args.servers:
+        port = free_port()
+        proc = subprocess.Popen([sys.executable, "-c", SERVERS[name].format(port=port)], cwd=BACKEND_DIR,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            asyncio.run(wait_ready(port))
+            for connections in args.connections:
+                r = asyncio.run(run_level(port, proc.pid, connections, args.probes))
+                print(f"{name:<11}{connections:>11}{r['threads']:>9}{r['rss_mb']:>9.0f}{r['p50_ms']:>14.1f}"
+                      f"{r['max_ms']:>14.1f}{r['failed']:>5}/{args.probes}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# backend/bench_db_indexes.py
+# Benchmarks the hot app.py queries on a synthetic records database,
+# before and after the schema migrations in db_init.py are applied.
+#
+# Usage: python bench_db_indexes.py [--rows 1000000] [--doctors 500] [--db /tmp/bench.db]
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from db_init import create_tables, migrate_db, get_schema_version
+
+RESULTS = ["No_DR", "Mild", "Moderate", "Severe", "Proliferative_DR"]
+
+# (label, sql, params factory) -- the queries issued by backend/app.py
+def hot_queries(n_rows, n_doctors, n_patient_users):
+    return [
+        ("dashboard (doctor_id, ORDER BY created_at)",
+         "SELECT * FROM patients WHERE doctor_id = ? ORDER BY created_at DESC",
+         lambda: (random.randint(1, n_doctors),)),
+        ("patient_dashboard (patient_id, ORDER BY created_at)",
+         "SELECT * FROM patients WHERE patient_id = ? ORDER BY created_at DESC",
+         lambda: (f"patient{random.randint(1, n_rows)}@example.com",)),
+        ("report lookup (report_id)",
+         "SELECT * FROM patients WHERE report_id = ? AND doctor_id = ?",
+         lambda: (f"report-{random.randint(1, n_rows)}", random.randint(1, n_doctors))),
+        ("patient login (lower(username), role)",
+         "SELECT * FROM users WHERE lower(username) = ? AND role = 'patient'",
+         lambda: (f"patient{random.randint(1, n_patient_users)}@example.com",)),
+    ]
+
+
+def build_synthetic_db(path, n_rows, n_doctors, n_patient_users):
+    """Creates the base (unmigrated) schema and fills it with synthetic rows."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    create_tables(conn)
+
+    users = [(f"doctor{i}@example.com", "x", "doctor", f"Doctor {i}") for i in range(1, n_doctors + 1)]
+    users += [(f"Patient{i}@example.com", "x", "patient", f"Patient {i}") for i in range(1, n_patient_users + 1)]
+    conn.executemany("INSERT INTO users (username, password, role, full_name) VALUES (?, ?, ?, ?)", users)
+
+    def rows():
+        base = time.time() - 3 * 365 * 86400
+        for i in range(1, n_rows + 1):
+            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(base + i * 90))
+            yield (random.randint(1, n_doctors), f"Patient {i}", f"patient{i}@example.com",
+                   random.randint(20, 80), random.choice(["Male", "Female"]),
+                   f"uploads/{uuid.uuid4()}_left.png", f"uploads/{uuid.uuid4()}_right.png",
+                   random.choice(RESULTS), random.choice(RESULTS), random.choice(RESULTS),
+                   f"report-{i}", ts)
+
+    conn.executemany("""
+        INSERT INTO patients (doctor_id, name, patient_id, age, gender, left_eye_path, right_eye_path,
+        left_result, right_result, combined_result, report_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows())
+    conn.commit()
+    return conn
+
+
+def measure(conn, queries, repeats):
+    results = []
+    for label, sql, params in queries:
+        plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params())]
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            conn.execute(sql, params()).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results.append((label, plan, timings[len(timings) // 2], timings[-1]))
+    return results
+
+
+def print_results(title, results):
+    print(f"\n=== {title} ===")
+    for label, plan, median_ms, max_ms in results:
+        print(f"{label}")
+        for step in plan:
+            print(f"    plan: {step}")
+        print(f"    median {median_ms:9.3f} ms   max {max_ms:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hot queries before/after DB migrations")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of synthetic patient rows")
+    parser.add_argument("--doctors", type=int, default=500, help="Number of synthetic doctors")
+    parser.add_argument("--patient-users", type=int, default=100_000, help="Number of patient accounts")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed executions per query")
+    parser.add_argument("--db", type=str, default=None, help="Path for the synthetic DB (default: temp file)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench_records.db")
+    if os.path.exists(path):
+        os.remove(path)
+
+    print(f"Building synthetic DB with {args.rows:,} patient rows at {path} ...")
+    start = time.perf_counter()
+    conn = build_synthetic_db(path, args.rows, args.doctors, args.patient_users)
+    print(f"Built in {time.perf_counter() - start:.1f}s (schema v{get_schema_version(conn)})")
+
+    queries = hot_queries(args.rows, args.doctors, args.patient_users)
+    before = measure(conn, queries, args.repeats)
+
+    start = time.perf_counter()
+    migrate_db(conn)
+    conn.execute("ANALYZE")
+    print(f"Migrated to schema v{get_schema_version(conn)} in {time.perf_counter() - start:.1f}s")
+    after = measure(conn, queries, args.repeats)
+
+    print_results("Before migrations", before)
+    print_results("After migrations", after)
+
+    print("\n=== Speedup (median) ===")
+    for (label, _, b, _), (_, _, a, _) in zip(before, after):
+        print(f"{label:<55} {b:9.3f} ms -> {a:9.3f} ms  ({b / max(a, 1e-6):,.0f}x)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# backend/bench_embedding_index.py
+# Query latency and recall of the similar-case index (embedding_index.py) on
+# synthetic embeddings, in a temporary store:
+#   - N unit vectors of the model's embedding size, drawn around --clusters
+#     random centres (real embeddings are clustered by grade and camera), split
+#     over --doctors doctors with skewed shares: a few large practices, many small
+#   - queries: perturbed copies of stored rows, each scoped to the doctor whose row it is
+#
+# Every query is timed twice: exact (no IVF) and through the IVF (build-ivf).
+# Recall@k is the share of the exact top-k the IVF search returns. Doctors are
+# grouped by size, since small doctors are always searched exactly.
+#
+# Usage: python bench_embedding_index.py [--rows 1000000] [--queries 200] [--k 10]
+#                                        [--nlist 1024] [--nprobe 16]
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+import embedding_index
+from embedding_index import EYES, EmbeddingStore, build_ivf
+
+DIM = 1024
+CHUNK = 50000
+
+
+def synthetic_store(directory, rows, clusters, doctors, rng):
+    """Fills a store with clustered unit vectors; returns the doctor share of each doctor."""
+    store = EmbeddingStore(directory, "synthetic")
+    centres = rng.standard_normal((clusters, DIM), dtype=np.float32)
+    # Zipf-like practice sizes: doctor 1 has the largest share
+    shares = 1.0 / np.arange(1, doctors + 1)
+    shares /= shares.sum()
+    for start in range(0, rows, CHUNK):
+        n = min(CHUNK, rows - start)
+        vectors = centres[rng.integers(clusters, size=n)] + 0.6 * rng.standard_normal((n, DIM), dtype=np.float32)
+        records = np.arange(start, start + n) // 2 + 1
+        store.append_rows(records, rng.choice(doctors, size=n, p=shares) + 1,
+                          [EYES[i % 2] for i in range(start, start + n)], vectors)
+    return store
+
+
+def timed_search(store, queries, k, nprobe):
+    results, samples = [], []
+    for vector, doctor, record in queries:
+        start = time.perf_counter()
+        results.append(store.search(vector, doctor, k, exclude_record=record, nprobe=nprobe))
+        samples.append((time.perf_counter() - start) * 1000)
+    return results, samples
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and recall of the similar-case index")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--doctors", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=embedding_index.DEFAULT_NPROBE)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        store = synthetic_store(tmp, args.rows, args.clusters, args.doctors, rng)
+        vectors, records, doctors, _ = store.refresh()
+        print(f"✅ {len(records)} synthetic rows for {args.doctors} doctors in {time.perf_counter() - start:.1f}s")
+
+        picks = rng.choice(len(records), args.queries, replace=False)
+        queries = [(vectors[i].astype(np.float32) + 0.05 * rng.standard_normal(DIM, dtype=np.float32),
+                    int(doctors[i]), int(records[i])) for i in picks]
+        doctor_rows = np.bincount(doctors)
+        groups = {"large": lambda n: n > embedding_index.EXACT_MAX,
+                  "small": lambda n: n <= embedding_index.EXACT_MAX}
+
+        # Exact: without an IVF every doctor's rows are scored in full
+        exact, exact_ms = timed_search(store, queries, args.k, args.nprobe)
+
+        start = time.perf_counter()
+        build_ivf(store, args.nlist)
+        print(f"   ↳ IVF built in {time.perf_counter() - start:.1f}s")
+        ivf, ivf_ms = timed_search(store, queries, args.k, args.nprobe)
+
+    print(f"\n{'doctors':<8}{'queries':>8}{'rows/dr':>10}{'exact p50':>11}{'p95':>8}"
+          f"{'IVF p50':>10}{'p95':>8}{f'recall@{args.k}':>11}")
+    for name, member in groups.items():
+        chosen = [i for i, (_, doctor, _) in enumerate(queries) if member(doctor_rows[doctor])]
+        if not chosen:
+            continue
+        recall = statistics.mean(
+            len({(r, e) for r, e, _ in ivf[i]} & {(r, e) for r, e, _ in exact[i]}) / max(1, len(exact[i]))
+            for i in chosen)
+        e50, e95 = percentiles([exact_ms[i] for i in chosen])
+        i50, i95 = percentiles([ivf_ms[i] for i in chosen])
+        rows = statistics.median(doctor_rows[queries[i][1]] for i in chosen)
+        print(f"{name:<8}{len(chosen):>8}{rows:>10.0f}{e50:>11.1f}{e95:>8.1f}{i50:>10.1f}{i95:>8.1f}{recall:>11.1%}")
+
+
+if __name__ == "__main__":
+    main()
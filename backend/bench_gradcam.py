@@ -0,0 +1,65 @@
+# backend/bench_gradcam.py
+# Latency of classifying both eyes of a report:
+#   plain      - predict_probabilities on the 2-image batch (VISIONAI_GRADCAM=0)
+#   single     - predict_with_gradcam on the same batch: probabilities and both
+#                Grad-CAM maps from one forward and one backward pass
+#   naive      - plain inference, then a separate forward + backward pass per eye
+#                to explain it (what bolting Grad-CAM onto the old path costs)
+#
+# Usage: python bench_gradcam.py [--left L.png --right R.png] [--runs 20]
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from backend_utils import (build_gradcam_model, load_dr_model, predict_probabilities, predict_with_gradcam,
+                           preprocess_image)
+
+
+def timed(fn, runs):
+    fn()  # warm-up: the first eager call traces and allocates
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plain inference vs single-pass and naive Grad-CAM")
+    parser.add_argument("--left", type=str, default=None, help="Left eye image (random pixels if omitted)")
+    parser.add_argument("--right", type=str, default=None, help="Right eye image (random pixels if omitted)")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    model = load_dr_model()
+    gradcam_model = build_gradcam_model(model)
+    rng = np.random.default_rng(0)
+    eyes = [preprocess_image(path) if path else rng.random((1, 224, 224, 3), dtype=np.float32)
+            for path in (args.left, args.right)]
+    batch = np.concatenate(eyes)
+
+    def naive():
+        predict_probabilities(model, batch)
+        for eye in eyes:
+            predict_with_gradcam(gradcam_model, eye)
+
+    # The single pass must agree with plain inference
+    probabilities, cams, _ = predict_with_gradcam(gradcam_model, batch)
+    assert np.allclose(probabilities, predict_probabilities(model, batch), atol=1e-5)
+    print(f"✅ Grad-CAM maps {cams.shape[1:]} for {len(batch)} eyes; probabilities match plain inference")
+
+    results = {
+        "plain": timed(lambda: predict_probabilities(model, batch), args.runs),
+        "single": timed(lambda: predict_with_gradcam(gradcam_model, batch), args.runs),
+        "naive": timed(naive, args.runs),
+    }
+    print(f"{'mode':<8}{'p50 ms':>10}{'max ms':>10}{'vs plain':>10}")
+    for mode, (p50, worst) in results.items():
+        print(f"{mode:<8}{p50:>10.1f}{worst:>10.1f}{p50 / results['plain'][0]:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
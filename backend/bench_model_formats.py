@@ -0,0 +1,259 @@
+# backend/bench_model_formats.py
+# Compares the model artifacts we could ship, on this machine:
+#   h5, keras        - Keras model files (load_dr_model)
+#   mmap             - the memory-mappable format (convert_model.py --mmap)
+#   savedmodel       - TensorFlow SavedModel, its serving_default signature
+#   tflite[-fp16|-dynamic] - TFLite interpreter (tflite_runtime if installed,
+#                      otherwise tf.lite), float32 / float16 / int8 weights
+#
+# Every format found in models/ (create them with convert_model.py) is run once
+# per thread count, each run in a fresh process so thread settings and memory
+# readings are not shared. A run measures load time, RSS before and after
+# loading (and its peak), batch-1 and batch-N latency (p50/p95) and batch-N
+# throughput. Each format's predictions on a fixed image set are compared with
+# the reference format: top-1 agreement and the largest probability difference,
+# which must stay within --tolerance.
+#
+# Prints a table and writes every measurement as JSON (--json).
+#
+# Usage: python bench_model_formats.py [--threads 1 2 4] [--batch 16] [--runs 20]
+#                                      [--images uploads] [--tolerance 1e-3] [--json model_formats.json]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "models")
+# name -> (path in models/, runtime)
+FORMATS = {
+    "h5": ("best_model.h5", "keras"),
+    "keras": ("best_model.keras", "keras"),
+    "mmap": ("best_model.mmap.json", "keras"),
+    "savedmodel": ("best_model_savedmodel", "savedmodel"),
+    "tflite": ("best_model.tflite", "tflite"),
+    "tflite-fp16": ("best_model.fp16.tflite", "tflite"),
+    "tflite-dynamic": ("best_model.dynamic.tflite", "tflite"),
+}
+FIXED_IMAGES = 16
+
+
+def artifact_mb(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files) / 1e6
+    size = os.path.getsize(path)
+    if path.endswith(".mmap.json"):
+        with open(path, "r") as f:
+            size += os.path.getsize(os.path.join(os.path.dirname(path), json.load(f)["data"]))
+    return size / 1e6
+
+
+def fixed_image_set(images_dir, count=FIXED_IMAGES, required=False):
+    """
+    The first `count` images (by path) under images_dir, preprocessed. The
+    directory is walked, so uploads in the blob store (uploads/blobs/ab/cd/)
+    are found; derivatives (<image>.thumb.jpg) and PDFs are not. Without
+    images this is seeded noise, or an error if the directory was required.
+    """
+    from backend_utils import allowed_file, preprocess_image
+    paths = sorted(os.path.join(d, n) for d, _, files in os.walk(images_dir)
+                   for n in files if allowed_file(n) and n.count(".") == 1)[:count]
+    if not paths:
+        if required:
+            sys.exit(f"❌ No images in {images_dir}")
+        print(f"⚠️ No images in {images_dir}; using {count} seeded random images")
+        return np.random.default_rng(0).random((count, 224, 224, 3), dtype=np.float32)
+    return np.concatenate([preprocess_image(path) for path in paths]).astype(np.float32)
+
+
+def memory_mb():
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                fields[key] = int(value.split()[0]) / 1024
+    return fields
+
+
+# --- Runtimes (run inside the child process) ---
+
+def load_runtime(runtime, path, threads):
+    """Loads a model and returns predict(batch) -> probabilities as a NumPy array."""
+    if runtime == "tflite":
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        interpreter = Interpreter(model_path=path, num_threads=threads)
+        interpreter.allocate_tensors()
+        input_index = interpreter.get_input_details()[0]["index"]
+        output_index = interpreter.get_output_details()[0]["index"]
+        allocated = [tuple(interpreter.get_input_details()[0]["shape"])]
+
+        def predict(batch):
+            if tuple(batch.shape) != allocated[0]:
+                interpreter.resize_tensor_input(input_index, batch.shape)
+                interpreter.allocate_tensors()
+                allocated[0] = tuple(batch.shape)
+            interpreter.set_tensor(input_index, batch)
+            interpreter.invoke()
+            return interpreter.get_tensor(output_index).copy()
+        return predict
+
+    from backend_utils import configure_tensorflow_threads
+    configure_tensorflow_threads(threads, 1)
+    if runtime == "savedmodel":
+        import tensorflow as tf
+        serve = tf.saved_model.load(path).signatures["serving_default"]
+        return lambda batch: np.asarray(next(iter(serve(tf.constant(batch)).values())))
+
+    from backend_utils import load_dr_model, predict_probabilities
+    model = load_dr_model(path)
+    return lambda batch: predict_probabilities(model, batch)
+
+
+def latency_ms(predict, batch, runs):
+    predict(batch)  # warm-up: the first call traces / allocates
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict(batch)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+def child(runtime, path, threads, images_path, batch_size, runs):
+    """One format at one thread count; prints its measurements as JSON."""
+    images = np.load(images_path)
+    before = memory_mb()
+    start = time.perf_counter()
+    predict = load_runtime(runtime, path, threads)
+    load_s = time.perf_counter() - start
+    loaded = memory_mb()
+    probabilities = np.concatenate([np.asarray(predict(images[i:i + 1]), dtype=np.float32)
+                                    for i in range(len(images))])
+    b1_p50, b1_p95 = latency_ms(predict, images[:1], runs)
+    batch = np.resize(images, (batch_size, *images.shape[1:]))
+    bn_p50, bn_p95 = latency_ms(predict, batch, runs)
+    print(json.dumps({
+        "load_s": round(load_s, 3),
+        "rss_before_mb": round(before["VmRSS"], 1), "rss_loaded_mb": round(loaded["VmRSS"], 1),
+        "rss_peak_mb": round(memory_mb()["VmHWM"], 1),
+        "batch1_p50_ms": round(b1_p50, 2), "batch1_p95_ms": round(b1_p95, 2),
+        "batchN_p50_ms": round(bn_p50, 2), "batchN_p95_ms": round(bn_p95, 2),
+        "images_per_s": round(batch_size / (bn_p50 / 1000), 1),
+        "probabilities": probabilities.tolist(),
+    }))
+
+
+def run_child(runtime, path, threads, images_path, batch_size, runs):
+    cmd = [sys.executable, __file__, "--child", runtime, path, str(threads), images_path,
+           "--batch", str(batch_size), "--runs", str(runs)]
+    out = subprocess.run(cmd, cwd=BACKEND_DIR, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "child failed")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def agreement(reference, probabilities, tolerance):
+    reference, probabilities = np.asarray(reference), np.asarray(probabilities)
+    max_diff = float(np.abs(reference - probabilities).max())
+    return {"top1_agreement": round(float((reference.argmax(axis=1) == probabilities.argmax(axis=1)).mean()), 4),
+            "max_abs_diff": max_diff, "within_tolerance": max_diff <= tolerance}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load time, memory, latency, throughput and agreement per model format")
+    parser.add_argument("--formats", nargs="+", choices=list(FORMATS), default=None,
+                        help="Formats to compare (default: every one present in models/)")
+    parser.add_argument("--reference", choices=list(FORMATS), default=None,
+                        help="Format the others must agree with (default: the first one compared)")
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--batch", type=int, default=16, help="Batch size N for batch latency and throughput")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--images", type=str, default=None,
+                        help="Directory of the fixed image set (default: uploads/, seeded noise if it has no images)")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Max probability difference to the reference")
+    parser.add_argument("--json", type=str, default="model_formats.json", help="Where to write the results")
+    parser.add_argument("--child", nargs=4, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        runtime, path, threads, images_path = args.child
+        child(runtime, path, int(threads), images_path, args.batch, args.runs)
+        return
+
+    formats = args.formats or list(FORMATS)
+    if args.reference and args.reference not in formats:
+        formats.insert(0, args.reference)
+    missing = [name for name in formats if not os.path.exists(os.path.join(MODELS_DIR, FORMATS[name][0]))]
+    if args.formats and missing:
+        print(f"⚠️ Not found in {MODELS_DIR}, skipped: {', '.join(missing)}")
+    formats = [name for name in formats if name not in missing]
+    if not formats:
+        print("❌ No model files found; create them with convert_model.py")
+        return
+    reference = args.reference if args.reference in formats else formats[0]
+    cpus = os.cpu_count() or 1
+    threads = sorted({t for t in args.threads if t <= cpus}) or [1]
+    if len(threads) < len(set(args.threads)):
+        print(f"⚠️ Only {cpus} CPUs: thread counts above {cpus} skipped")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images_path = os.path.join(tmp, "images.npy")
+        images = fixed_image_set(args.images or os.path.join(BACKEND_DIR, "uploads"), required=bool(args.images))
+        np.save(images_path, images)
+        results = {}
+        for name in formats:
+            file, runtime = FORMATS[name]
+            path = os.path.join(MODELS_DIR, file)
+            results[name] = {"path": path, "runtime": runtime, "size_mb": round(artifact_mb(path), 1), "runs": {}}
+            for count in threads:
+                try:
+                    results[name]["runs"][count] = run_child(runtime, path, count, images_path, args.batch, args.runs)
+                except Exception as e:
+                    results[name]["error"] = str(e)
+                    print(f"❌ {name} ({count} threads): {e}")
+                    break
+
+    # Predictions do not depend on the thread count: compare those of the first run
+    reference_probs = next(iter(results[reference]["runs"].values()), {}).get("probabilities")
+    for name, result in results.items():
+        first = next(iter(result["runs"].values()), None)
+        if first:
+            result["probabilities"] = first["probabilities"]
+            result["agreement"] = agreement(reference_probs, first["probabilities"], args.tolerance) \
+                if reference_probs is not None else None
+        for run in result["runs"].values():
+            run.pop("probabilities")
+
+    print(f"{'format':<16}{'thr':>4}{'MB':>8}{'load s':>8}{'RSS MB':>8}{'+load':>7}"
+          f"{'b1 p50':>8}{'b1 p95':>8}{f'b{args.batch} p50':>9}{'img/s':>10}")
+    for name, result in results.items():
+        for count, r in result["runs"].items():
+            print(f"{name:<16}{count:>4}{result['size_mb']:>8.1f}{r['load_s']:>8.2f}{r['rss_loaded_mb']:>8.0f}"
+                  f"{r['rss_loaded_mb'] - r['rss_before_mb']:>7.0f}{r['batch1_p50_ms']:>8.1f}"
+                  f"{r['batch1_p95_ms']:>8.1f}{r['batchN_p50_ms']:>9.1f}{r['images_per_s']:>10.1f}")
+    print(f"\nAgreement with {reference} on {len(images)} fixed images (tolerance {args.tolerance:g}):")
+    for name, result in results.items():
+        a = result.get("agreement")
+        if a:
+            status = "✅" if a["within_tolerance"] else "⚠️"
+            print(f"  {status} {name:<16} top-1 {a['top1_agreement']:.0%}  max diff {a['max_abs_diff']:.2e}")
+
+    with open(args.json, "w") as f:
+        json.dump({"reference": reference, "tolerance": args.tolerance, "batch": args.batch, "runs": args.runs,
+                   "threads": threads, "images": len(images), "formats": results}, f, indent=2)
+    print(f"  ↳ Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# backend/bench_model_startup.py
+# Model load time and memory per model format, cold and warm:
+#   cold  - the model's files are first evicted from the OS page cache, as after
+#           a reboot or a deploy of a new model
+#   warm  - straight after, with the files still cached, as for every further
+#           worker or restart on the same machine
+#
+# Each run is a fresh Python process. TensorFlow's own import is timed
+# separately and is the same for every format. Memory is read from
+# /proc/self/status after the first prediction: RSS, split into anonymous
+# memory (private to the process) and file-backed pages (the page cache,
+# shared by every process mapping the same file), plus the peak RSS while loading.
+#
+# Create the formats to compare with convert_model.py (default, --mmap, --mmap --float16).
+#
+# Usage: python bench_model_startup.py [MODEL ...]   (default: every model file in models/)
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "models")
+DEFAULT_MODELS = ["best_model.h5", "best_model.keras", "best_model.mmap.json"]
+
+
+def model_files(path):
+    """The files a model is loaded from: the file itself and, for an mmap index, its weight file."""
+    files = [path]
+    if path.endswith(".mmap.json"):
+        with open(path, "r") as f:
+            files.append(os.path.join(os.path.dirname(path), json.load(f)["data"]))
+    return files
+
+
+def evict(files):
+    """Drops the files' pages from the page cache (clean pages only; no root needed)."""
+    for path in files:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def memory_mb():
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM", "RssAnon", "RssFile"):
+                fields[key] = int(value.split()[0]) / 1024
+    return fields
+
+
+def child(path):
+    """One start: import, load, first prediction; prints the measurements as JSON."""
+    start = time.perf_counter()
+    import numpy as np
+    from backend_utils import load_dr_model, predict_probabilities
+    imported = time.perf_counter()
+    model = load_dr_model(path)
+    loaded = time.perf_counter()
+    predict_probabilities(model, np.zeros((1, *model.input_shape[1:]), dtype=np.float32))
+    predicted = time.perf_counter()
+    print(json.dumps({"import_s": imported - start, "load_s": loaded - imported,
+                      "first_predict_s": predicted - loaded, **memory_mb()}))
+
+
+def run(path):
+    out = subprocess.run([sys.executable, __file__, "--child", path], cwd=BACKEND_DIR,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold and warm model start time and RSS per model format")
+    parser.add_argument("models", nargs="*", help="Model files (default: those present in models/)")
+    parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    paths = args.models or [os.path.join(MODELS_DIR, name) for name in DEFAULT_MODELS
+                            if os.path.isfile(os.path.join(MODELS_DIR, name))]
+    if not paths:
+        print("❌ No model files found; create them with convert_model.py")
+        return
+
+    print(f"{'model':<30}{'start':<6}{'MB':>8}{'load s':>9}{'1st pred s':>11}"
+          f"{'RSS MB':>9}{'anon MB':>9}{'file MB':>9}{'peak MB':>9}")
+    for path in paths:
+        files = model_files(path)
+        size = sum(os.path.getsize(f) for f in files) / 1e6
+        label = os.path.basename(path)
+        if path.endswith(".mmap.json"):
+            with open(path, "r") as f:
+                label += " (fp16)" if json.load(f).get("float16") else " (fp32)"
+        evict(files)
+        for start in ("cold", "warm"):
+            r = run(path)
+            print(f"{label:<30}{start:<6}{size:>8.1f}{r['load_s']:>9.2f}{r['first_predict_s']:>11.2f}"
+                  f"{r['VmRSS']:>9.0f}{r['RssAnon']:>9.0f}{r['RssFile']:>9.0f}{r['VmHWM']:>9.0f}")
+    print(f"  ↳ TensorFlow import (every format): {r['import_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# backend/bench_near_duplicates.py
+# Checks the near-duplicate detection of near_duplicates.py:
+#   robustness - Hamming distances between each uploaded image's hash and the
+#                hashes of re-encoded copies of it (JPEG quality 70, PNG,
+#                resized to 80%, 5% brighter, 10% more contrast), and between different images:
+#                the threshold must fall between the two. As in the app, every
+#                image is hashed through its dashboard thumbnail
+#   lookup     - find_near_duplicates latency against --rows stored hashes of
+#                one doctor in a temporary database, and that every planted
+#                near-duplicate (1 to MAX_DISTANCE bits flipped) is found
+#
+# Usage: python bench_near_duplicates.py [--images uploads] [--rows 100000] [--queries 500]
+import argparse
+import hashlib
+import io
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from PIL import Image, ImageEnhance
+
+from db_init import create_tables, migrate_db
+from image_derivatives import DERIVATIVES
+from near_duplicates import DEFAULT_DISTANCE, MAX_DISTANCE, find_near_duplicates, hamming, phash, store_hashes
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def thumb_hash(img):
+    """pHash of an image's dashboard thumbnail (image_derivatives.py)."""
+    max_side, quality = DERIVATIVES["thumb"]
+    thumb = img.convert("RGB")
+    thumb.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+    buffer = io.BytesIO()
+    thumb.save(buffer, "JPEG", quality=quality, optimize=True)
+    buffer.seek(0)
+    return phash(buffer)
+
+
+def variants(img):
+    """Re-encoded copies of an image, decoded again."""
+    out = {}
+    for name, (copy, fmt, options) in {
+        "jpeg-q70": (img, "JPEG", {"quality": 70}),
+        "png": (img, "PNG", {}),
+        "resized-80%": (img.resize((int(img.width * 0.8), int(img.height * 0.8))), "JPEG", {"quality": 90}),
+        "brighter-5%": (ImageEnhance.Brightness(img).enhance(1.05), "JPEG", {"quality": 90}),
+        "contrast+10%": (ImageEnhance.Contrast(img).enhance(1.1), "JPEG", {"quality": 90}),
+    }.items():
+        buffer = io.BytesIO()
+        copy.save(buffer, fmt, **options)
+        buffer.seek(0)
+        out[name] = Image.open(buffer)
+    return out
+
+
+def robustness(images_dir, limit):
+    from backend_utils import allowed_file
+    names = sorted(n for n in os.listdir(images_dir) if allowed_file(n) and n.count(".") == 1)[:limit] \
+        if os.path.isdir(images_dir) else []
+    if len(names) < 2:
+        print(f"⚠️ Fewer than 2 images in {images_dir}; robustness check skipped")
+        return
+    hashes, same, digests = [], {}, set()
+    for name in names:
+        with open(os.path.join(images_dir, name), "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if digest in digests:  # byte-identical uploads are the blob store's job
+            continue
+        digests.add(digest)
+        with Image.open(os.path.join(images_dir, name)) as img:
+            img = img.convert("RGB")
+            original = thumb_hash(img)
+            hashes.append(original)
+            for variant, copy in variants(img).items():
+                same.setdefault(variant, []).append(hamming(original, thumb_hash(copy)))
+    different = [hamming(a, b) for i, a in enumerate(hashes) for b in hashes[i + 1:]]
+    print(f"✅ Robustness on {len(hashes)} distinct images (threshold {DEFAULT_DISTANCE} bits):")
+    for variant, distances in same.items():
+        print(f"   {variant:<14} max {max(distances):>2}  mean {statistics.mean(distances):5.1f}")
+    print(f"   {'other images':<14} min {min(different):>2}  mean {statistics.mean(different):5.1f}"
+          f"  ({sum(d <= DEFAULT_DISTANCE for d in different)} pairs within the threshold)")
+
+
+def lookup(rows, queries):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "records.db"))
+        create_tables(conn)
+        migrate_db(conn)
+        stored = [rng.getrandbits(64) for _ in range(rows)]
+        for start in range(0, rows, 10000):
+            for record_id in range(start, min(start + 10000, rows)):
+                store_hashes(conn, record_id + 1, 1, {"left": stored[record_id]})
+            conn.commit()
+        samples, found = [], 0
+        for _ in range(queries):
+            target = rng.randrange(rows)
+            query = stored[target]
+            for bit in rng.sample(range(64), rng.randint(1, MAX_DISTANCE)):
+                query ^= 1 << bit
+            start = time.perf_counter()
+            matches = find_near_duplicates(conn, 1, query, MAX_DISTANCE)
+            samples.append((time.perf_counter() - start) * 1000)
+            found += any(record_id == target + 1 for _, record_id, _ in matches)
+        conn.close()
+    samples.sort()
+    print(f"✅ Lookup among {rows} hashes: p50 {statistics.median(samples):.3f} ms, "
+          f"p95 {samples[int(len(samples) * 0.95)]:.3f} ms; planted near-duplicates found {found}/{queries}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate hash robustness and lookup latency")
+    parser.add_argument("--images", type=str, default=os.path.join(BACKEND_DIR, "uploads"))
+    parser.add_argument("--limit", type=int, default=50, help="Images used for the robustness check")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    robustness(args.images, args.limit)
+    lookup(args.rows, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# backend/bench_page_cache.py
+# Requests/sec of the public pages with the anonymous page cache off (every
+# request renders its Jinja template) and on (every request after the first is
+# a cache hit).
+#
+# Requests go straight to the WSGI app in-process, so the numbers are the
+# app's own per-request cost without any HTTP server or network in front of it.
+#
+# Usage: python bench_page_cache.py [--requests 2000] [--pages / /services /contact]
+import argparse
+import time
+
+from werkzeug.test import EnvironBuilder
+
+import app as flask_app
+
+PAGES = ["/", "/services", "/contact"]
+
+
+def requests_per_second(wsgi_app, path, requests):
+    environ = EnvironBuilder(path=path, method="GET", headers={"Accept-Encoding": "gzip, br"}).get_environ()
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(status)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        body = wsgi_app(dict(environ), start_response)
+        for _ in body:
+            pass
+        if hasattr(body, "close"):
+            body.close()
+    elapsed = time.perf_counter() - start
+    if not statuses[-1].startswith("200"):
+        raise RuntimeError(f"{path} returned {statuses[-1]}")
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Public page requests/sec: rendered vs page cache hits")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per page and mode")
+    parser.add_argument("--pages", nargs="+", default=PAGES)
+    args = parser.parse_args()
+
+    app = flask_app.app
+    cache = flask_app.PAGE_CACHE
+    max_entries = cache.max_entries
+
+    print(f"{'page':<12}{'rendered req/s':>16}{'cache hit req/s':>17}{'speed-up':>10}")
+    for path in args.pages:
+        cache.max_entries = 0  # disabled: every request renders
+        rendered = requests_per_second(app, path, args.requests)
+        cache.max_entries = max_entries
+        cache.clear()
+        requests_per_second(app, path, 1)  # the one miss that fills the cache
+        hits = requests_per_second(app, path, args.requests)
+        print(f"{path:<12}{rendered:>16.0f}{hits:>17.0f}{hits / rendered:>9.1f}x")
+    print(f"  ↳ Cache counters: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# backend/bench_patient_search.py
+# Benchmarks the doctor dashboard search (patient_search.py) on a synthetic
+# records database: the FTS5 query against a LIKE '%...%' scan of the same columns,
+# for broad prefix queries (short prefixes of common names and drugs, matching
+# thousands of a doctor's rows) and selective ones (a full patient email, a
+# rare drug, a full name with a condition).
+#
+# Usage: python bench_patient_search.py [--rows 300000] [--doctors 5] [--repeats 20] [--db /tmp/search.db]
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from db_init import create_tables, migrate_db
+from patient_search import build_match_query, doctor_match_query, search_patients
+
+FIRST_NAMES = ["Jan", "Janet", "Maria", "Mark", "Priya", "Pradeep", "Anil", "Anita", "Sam", "Sara",
+               "Ravi", "Rekha", "John", "Joan", "Kiran", "Krutika", "Li", "Lina", "Omar", "Olga"]
+LAST_NAMES = ["Doe", "Shah", "Patel", "Smith", "Kumar", "Rao", "Garcia", "Chen", "Iyer", "Khan",
+              "Nair", "Singh", "Brown", "Das", "Mehta", "Joshi", "Lopez", "Ali", "Gupta", "Reddy"]
+MEDICATIONS = ["metformin", "insulin glargine", "glipizide", "sitagliptin", "lisinopril", "amlodipine",
+               "atorvastatin", "aspirin", "losartan", "empagliflozin"]
+RARE_MEDICATIONS = ["pioglitazone", "acarbose", "repaglinide"]
+CONDITIONS = ["hypertension", "hyperlipidemia", "nephropathy", "neuropathy", "obesity", "none"]
+RESULTS = ["No_DR", "Mild", "Moderate", "Severe", "Proliferative_DR"]
+
+LIKE_COLUMNS = ("name", "patient_id", "medications", "other_conditions")
+
+
+def build_synthetic_db(path, n_rows, n_doctors):
+    """Creates and migrates the schema, then fills it with synthetic patient rows."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    create_tables(conn)
+    migrate_db(conn)
+
+    def rows():
+        for i in range(1, n_rows + 1):
+            first, last = random.choice(FIRST_NAMES), random.choice(LAST_NAMES)
+            medications = random.sample(MEDICATIONS, random.randint(1, 3))
+            if random.random() < 0.001:
+                medications.append(random.choice(RARE_MEDICATIONS))
+            yield (random.randint(1, n_doctors), f"{first} {last}",
+                   f"{first.lower()}.{last.lower()}{i}@example.com", random.randint(20, 80), random.choice(["Male", "Female"]), ", ".join(medications),
+                   random.choice(CONDITIONS), random.choice(RESULTS), f"report-{i}")
+
+    conn.executemany("""
+        INSERT INTO patients (doctor_id, name, patient_id, age, gender, medications, other_conditions,
+        combined_result, report_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows())
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def like_search(conn, doctor_id, text, page_size=25):
+    """The unindexed alternative: every word LIKE-matched against every column, newest first."""
+    clauses, params = [], []
+    for word in text.split():
+        clauses.append("(" + " OR ".join(f"{col} LIKE ?" for col in LIKE_COLUMNS) + ")")
+        params += [f"%{word}%"] * len(LIKE_COLUMNS)
+    return conn.execute(f"""
+        SELECT id FROM patients WHERE doctor_id = ? AND {" AND ".join(clauses)}
+        ORDER BY created_at DESC LIMIT ?
+    """, (doctor_id, *params, page_size + 1)).fetchall()
+
+
+def match_count(conn, doctor_id, text):
+    return conn.execute("""
+        SELECT count(*) FROM patients_fts JOIN patients AS p ON p.id = patients_fts.rowid
+        WHERE patients_fts MATCH ? AND p.doctor_id = ?
+    """, (doctor_match_query(doctor_id, build_match_query(text)), doctor_id)).fetchone()[0]
+
+
+def timed(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FTS5 patient search against LIKE scans")
+    parser.add_argument("--rows", type=int, default=300_000, help="Number of synthetic patient rows")
+    parser.add_argument("--doctors", type=int, default=5, help="Number of synthetic doctors")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed executions per query")
+    parser.add_argument("--db", type=str, default=None, help="Path for the synthetic DB (default: temp file)")
+    args = parser.parse_args()
+    random.seed(0)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench_search.db")
+    if os.path.exists(path):
+        os.remove(path)
+    print(f"Building synthetic DB with {args.rows:,} patient rows at {path} ...")
+    start = time.perf_counter()
+    conn = build_synthetic_db(path, args.rows, args.doctors)
+    print(f"Built in {time.perf_counter() - start:.1f}s")
+
+    doctor_id = 1
+    email = conn.execute("SELECT patient_id FROM patients WHERE doctor_id = ? LIMIT 1",
+                         (doctor_id,)).fetchone()[0]
+    queries = [("broad", "ja"), ("broad", "mar"), ("broad", "metformin"), ("broad", "jan doe"),
+               ("selective", email), ("selective", "pioglitazone"), ("selective", "krutika reddy nephro")]
+
+    print(f"\n{'query':<36}{'kind':<11}{'matches':>9}{'FTS p50':>10}{'max':>8}{'LIKE p50':>10}{'max':>8}")
+    for kind, text in queries:
+        fts = timed(lambda: search_patients(conn, doctor_id, text), args.repeats)
+        like = timed(lambda: like_search(conn, doctor_id, text), args.repeats)
+        print(f"{text[:35]:<36}{kind:<11}{match_count(conn, doctor_id, text):>9}"
+              f"{fts[0]:>10.1f}{fts[1]:>8.1f}{like[0]:>10.1f}{like[1]:>8.1f}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
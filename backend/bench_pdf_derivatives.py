@@ -0,0 +1,80 @@
+# backend/bench_pdf_derivatives.py
+# Compares report PDFs built from the raw uploaded fundus images against PDFs
+# built from the cached print-resolution derivatives (image_derivatives.py).
+#
+# Usage: python bench_pdf_derivatives.py [--left a.png --right b.png] [--runs 5]
+# Without --left/--right a synthetic multi-megapixel fundus-like PNG is used.
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_derivatives import ensure_derivatives
+from report_generator import generate_pdf
+
+
+def make_synthetic_fundus(path, size=3000):
+    """Writes a noisy, roughly circular RGB image that compresses like a real photo."""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[:size, :size]
+    r = np.hypot(xx - size / 2, yy - size / 2) / (size / 2)
+    base = np.clip(1.0 - r, 0, 1)[..., None] * np.array([200, 90, 40])
+    noise = rng.normal(0, 12, (size, size, 3))
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path)
+
+
+def time_renders(patient_info, out_path, runs, embed_derivatives):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        generate_pdf(patient_info, {"full_name": "Bench"}, out_path, embed_derivatives=embed_derivatives)
+        timings.append(time.perf_counter() - start)
+    return min(timings), sorted(timings)[len(timings) // 2], os.path.getsize(out_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF size and render time: raw uploads vs derivatives")
+    parser.add_argument("--left", type=str, default=None, help="Left eye image")
+    parser.add_argument("--right", type=str, default=None, help="Right eye image")
+    parser.add_argument("--runs", type=int, default=5, help="Renders per variant")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        left, right = args.left, args.right
+        if not (left and right):
+            left = right = os.path.join(work_dir, "synthetic_fundus.png")
+            make_synthetic_fundus(left)
+        # Work on copies so the derivative cache lands in the temp dir
+        left_copy = shutil.copy(left, os.path.join(work_dir, "left" + os.path.splitext(left)[1]))
+        right_copy = shutil.copy(right, os.path.join(work_dir, "right" + os.path.splitext(right)[1]))
+        print(f"Input images: {os.path.getsize(left_copy) / 1e6:.2f} MB + {os.path.getsize(right_copy) / 1e6:.2f} MB")
+
+        patient_info = {"name": "Bench Patient", "patient_id": "bench@example.com",
+                        "left_eye_path": left_copy, "right_eye_path": right_copy,
+                        "left_result": "Mild", "right_result": "No_DR", "combined_result": "Mild"}
+        out_path = os.path.join(work_dir, "report.pdf")
+
+        start = time.perf_counter()
+        for path in {left_copy, right_copy}:
+            ensure_derivatives(path)
+        ingest_s = time.perf_counter() - start
+
+        raw = time_renders(patient_info, out_path, args.runs, embed_derivatives=False)
+        derived = time_renders(patient_info, out_path, args.runs, embed_derivatives=True)
+
+        print(f"One-time derivative generation at ingest: {ingest_s * 1000:.0f} ms")
+        print(f"{'variant':<14}{'best ms':>10}{'median ms':>12}{'PDF size':>14}")
+        for label, (best, median, size) in (("raw uploads", raw), ("derivatives", derived)):
+            print(f"{label:<14}{best * 1000:>10.0f}{median * 1000:>12.0f}{size / 1024:>11.0f} KB")
+        print(f"PDF size: {raw[2] / derived[2]:.1f}x smaller, render: {raw[1] / derived[1]:.1f}x faster")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
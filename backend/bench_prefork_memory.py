@@ -0,0 +1,145 @@
+# backend/bench_prefork_memory.py
+# Proportional set size (PSS) per worker of serve.py, with the model
+# preloaded in the master (shared copy-on-write) vs loaded in every worker.
+#
+# PSS charges each shared page to the processes mapping it in equal parts,
+# so the PSS total is the real memory cost of the whole server and the
+# per-worker PSS is what one more worker costs. Before measuring, each server
+# answers --requests predictions through /api/v1/predict (with a temporary
+# API token), so every worker has run the model and touched its weights.
+#
+# Usage: python bench_prefork_memory.py [--workers 4] [--requests 50]
+import argparse
+import http.client
+import io
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from api_tokens import create_token, revoke_token
+from db_init import DB_PATH, init_db
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def smaps_rollup(pid):
+    """{Rss, Pss, Shared_Clean, Shared_Dirty, Private_Clean, Private_Dirty} in MB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[key] = int(value.split()[0]) / 1024
+    return fields
+
+
+def children(pid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The ppid is the 2nd field after the parenthesised command name
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return sorted(pids)
+
+
+def wait_for_workers(port, master, workers, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if len(children(master)) >= workers:
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                conn.request("GET", "/")
+                conn.getresponse().read()
+                return
+            except OSError:
+                pass
+        time.sleep(0.5)
+    raise RuntimeError("server did not start")
+
+
+def test_image():
+    buf = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 256, (512, 512, 3), dtype=np.uint8)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def warm_up(port, requests, token):
+    """Spreads predictions over the workers so each runs the model and touches its weights."""
+    image = test_image()
+    for _ in range(requests):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        conn.request("POST", "/api/v1/predict?eye=left", body=image,
+                     headers={"Content-Type": "image/png", "Authorization": f"Bearer {token}"})
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"/api/v1/predict returned {response.status}: {body[:200]!r}")
+
+
+def measure(preload, workers, requests, token):
+    port = free_port()
+    cmd = [sys.executable, "serve.py", "--port", str(port), "--host", "127.0.0.1",
+           "--workers", str(workers), "--threads", "2"] + ([] if preload else ["--no-preload"])
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_workers(port, proc.pid, workers)
+        warm_up(port, requests, token)
+        time.sleep(1.0)
+        return smaps_rollup(proc.pid), [smaps_rollup(pid) for pid in children(proc.pid)]
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def print_table(args, token):
+    print(f"{'mode':<12}{'process':<10}{'RSS MB':>9}{'PSS MB':>9}{'shared MB':>11}{'private MB':>12}")
+    for preload in (True, False):
+        mode = "preload" if preload else "per-worker"
+        master, workers = measure(preload, args.workers, args.requests, token)
+        rows = [("master", master)] + [(f"worker {i}", w) for i, w in enumerate(workers, 1)]
+        for name, m in rows:
+            shared = m["Shared_Clean"] + m["Shared_Dirty"]
+            private = m["Private_Clean"] + m["Private_Dirty"]
+            print(f"{mode:<12}{name:<10}{m['Rss']:>9.0f}{m['Pss']:>9.0f}{shared:>11.0f}{private:>12.0f}")
+        worker_pss = sum(w["Pss"] for w in workers) / max(1, len(workers))
+        total_pss = master["Pss"] + sum(w["Pss"] for w in workers)
+        print(f"{mode:<12}{'total':<10}{'':>9}{total_pss:>9.0f}   (mean worker PSS {worker_pss:.0f} MB)")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker PSS: preloaded vs per-worker model")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50, help="Warm-up predictions before measuring")
+    args = parser.parse_args()
+
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    token_id, token = create_token(conn, "bench_prefork_memory")
+    try:
+        print_table(args, token)
+    finally:
+        revoke_token(conn, token_id)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
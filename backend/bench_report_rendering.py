@@ -0,0 +1,56 @@
+# backend/bench_report_rendering.py
+# Report rendering throughput (reports/sec), single process vs the
+# render_reports process pool in report_generator.py.
+#
+# Usage: python bench_report_rendering.py [--reports 200] [--workers 1 2 4] [--image eye.png]
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from image_derivatives import ensure_derivatives
+from report_generator import render_reports
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "uploads", "1435e7bc-bd11-4266-9b22-bfbe70f885f9_left.png")
+
+
+def make_jobs(n, image_path, out_dir):
+    doctor = {"full_name": "Dr. Bench", "medical_id": "MED-0001", "hospital_name": "Bench Clinic"}
+    for i in range(n):
+        patient = {
+            "name": f"Patient {i}", "patient_id": f"patient{i}@example.com", "age": 40 + i % 40,
+            "gender": "Female" if i % 2 else "Male", "diabetes_duration": f"{i % 20} years",
+            "blood_pressure": "130/85", "medications": "Metformin 500mg", "other_conditions": "Hypertension",
+            "left_eye_path": image_path, "right_eye_path": image_path,
+            "left_result": "Mild", "right_result": "No_DR", "combined_result": "Mild",
+        }
+        yield patient, doctor, os.path.join(out_dir, f"report_{i}.pdf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report rendering throughput benchmark")
+    parser.add_argument("--reports", type=int, default=200, help="Reports rendered per configuration")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1],
+                        help="Worker process counts to compare")
+    parser.add_argument("--image", type=str, default=SAMPLE_IMAGE, help="Fundus image used for both eyes")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        image = shutil.copy(args.image, work_dir)
+        ensure_derivatives(image)  # as at ingest, so every config embeds the print JPEG
+
+        print(f"{'workers':>8}{'seconds':>10}{'reports/sec':>14}{'errors':>8}")
+        for workers in dict.fromkeys(args.workers):
+            start = time.perf_counter()
+            errors = sum(1 for _, err in render_reports(make_jobs(args.reports, image, work_dir), workers=workers) if err)
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>8}{elapsed:>10.2f}{args.reports / elapsed:>14.1f}{errors:>8}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# backend/bench_static.py
+# Bytes and requests a browser spends on static assets over a cold and a
+# repeat visit to the public pages: plain Flask static files against the
+# fingerprinted build from build_static.py.
+#
+# A small browser model runs against the app in-process (test client). It
+# fetches every stylesheet and image a page references, including url(...)
+# references inside stylesheets, sending the Accept/Accept-Encoding headers a
+# current browser sends. It caches each response the way HTTP caching
+# prescribes: a response with max-age is reused without a request until it
+# expires, and anything else is revalidated with If-None-Match /
+# If-Modified-Since (a 304 still costs a round trip and its headers). Bytes
+# are response status line + headers + body as sent over the wire, the body
+# compressed where a compressed variant was served.
+#
+# Usage: python build_static.py && python bench_static.py [--pages / /services]
+import argparse
+import gzip
+import posixpath
+import re
+from urllib.parse import urlsplit
+
+import brotli
+
+import app as flask_app
+
+PAGES = ["/", "/services", "/contact", "/doctor_login", "/doctor_register", "/patient_login",
+         "/patient_register"]
+BROWSER_HEADERS = {
+    "Accept-Encoding": "gzip, deflate, br",
+    "Accept": "image/avif,image/webp,image/png,image/svg+xml,image/*;q=0.8,*/*;q=0.5",
+}
+ASSET_REF = re.compile(r"""(?:href|src)=["']([^"']*/static/[^"']+)["']""")
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+class BrowserCache:
+    """A browser's HTTP cache: {url: (max_age, etag, last_modified)} plus the cached bodies."""
+
+    def __init__(self, client):
+        self.client = client
+        self.entries = {}
+        self.bodies = {}
+
+    def fetch(self, url):
+        """Fetches (or reuses) a URL; returns ((body, encoding, mimetype), request made?, bytes)."""
+        entry = self.entries.get(url)
+        if entry and entry[0]:
+            return self.bodies[url], False, 0
+        headers = dict(BROWSER_HEADERS)
+        if entry:
+            if entry[1]:
+                headers["If-None-Match"] = entry[1]
+            if entry[2]:
+                headers["If-Modified-Since"] = entry[2]
+        response = self.client.get(url, headers=headers)
+        header_bytes = len(f"HTTP/1.1 {response.status}\r\n{response.headers}")
+        if response.status_code == 304:
+            return self.bodies[url], True, header_bytes
+        body = response.get_data()
+        self.entries[url] = (response.cache_control.max_age or 0, response.headers.get("ETag"),
+                             response.headers.get("Last-Modified"))
+        self.bodies[url] = (body, response.headers.get("Content-Encoding"), response.mimetype)
+        return self.bodies[url], True, header_bytes + len(body)
+
+
+def page_assets(client, page):
+    html = client.get(page).get_data(as_text=True)
+    return sorted({urlsplit(ref).path for ref in ASSET_REF.findall(html)})
+
+
+def visit(cache, pages):
+    """Loads each page's assets through the cache; returns (requests, bytes)."""
+    requests = transferred = 0
+    seen = set()
+    queue = [url for page in pages for url in page_assets(cache.client, page)]
+    while queue:
+        url = queue.pop(0)
+        if url in seen:
+            continue
+        seen.add(url)
+        (body, encoding, mimetype), requested, size = cache.fetch(url)
+        requests += requested
+        transferred += size
+        if mimetype == "text/css":
+            if encoding == "br":
+                body = brotli.decompress(body)
+            elif encoding == "gzip":
+                body = gzip.decompress(body)
+            for _, ref in CSS_URL.findall(body.decode("utf-8")):
+                if not ref.startswith(("data:", "http:", "https:", "//", "#")):
+                    queue.append(posixpath.normpath(posixpath.join(posixpath.dirname(url), ref)))
+    return requests, transferred
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Static asset bytes per visit: plain vs fingerprinted build")
+    parser.add_argument("--pages", nargs="+", default=PAGES)
+    args = parser.parse_args()
+
+    app = flask_app.app
+    built = app.extensions.get("static_manifest") or {}
+    if not built:
+        print("⚠️ No static build found; run build_static.py first. Showing plain assets only.")
+
+    print(f"{'assets':<8}{'visit':<8}{'requests':>10}{'KB':>10}")
+    results = {}  # (mode, visit) -> (requests, bytes)
+    for mode, manifest in (("plain", {}), ("built", built)):
+        if mode == "built" and not built:
+            continue
+        app.extensions["static_manifest"] = manifest
+        cache = BrowserCache(app.test_client())
+        for visit_name in ("cold", "repeat"):
+            requests, transferred = visit(cache, args.pages)
+            results[(mode, visit_name)] = (requests, transferred)
+            print(f"{mode:<8}{visit_name:<8}{requests:>10}{transferred / 1024:>10.1f}")
+    app.extensions["static_manifest"] = built
+
+    if built:
+        for visit_name in ("cold", "repeat"):
+            (plain_requests, plain), (built_requests, fingerprinted) = (results[("plain", visit_name)],
+                                                                         results[("built", visit_name)])
+            print(f"  ↳ {visit_name} visit: {(plain - fingerprinted) / 1024:.1f} KB "
+                  f"({1 - fingerprinted / plain:.0%}) and {plain_requests - built_requests} requests saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+# backend/blob_store.py
+# Content-addressed, sharded storage for uploaded eye images and report PDFs.
+#
+# Eye images are named by the SHA-256 of their bytes and sharded two levels
+# deep (uploads/blobs/ab/cd/abcd...png), so no directory grows past a few
+# dozen entries and identical uploads are stored once. Every stored image has
+# a row in the `blobs` table whose refcount is maintained by triggers on
+# `patients` (migration 5 in db_init.py). An upload that is not saved yet
+# holds a pending reference instead (migration 13): store_stream(conn=...)
+# takes it before the file is put in place, and register_blob (the record was
+# inserted) or discard_blob (the upload was rejected) gives it back. A blob is
+# only deleted when neither a record nor an in-flight upload holds it, so two
+# concurrent uploads of the same image never delete each other's file.
+# Unreferenced blobs are removed by collect_garbage(). Report PDFs are
+# sharded the same way by report_id.
+#
+# Usage (one-shot upgrade of the flat legacy uploads/ layout):
+#   python blob_store.py --migrate [--keep-legacy] [--db records.db]
+#   python blob_store.py --gc [--sweep] [--db records.db]
+# --gc deletes blobs whose refcount dropped to zero; --sweep also deletes files
+# the database does not know at all (see sweep_orphan_files).
+import argparse
+import glob
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
+BLOB_DIR = os.path.join(UPLOAD_FOLDER, "blobs")
+REPORT_DIR = os.path.join(UPLOAD_FOLDER, "reports")
+TMP_DIR = os.path.join(UPLOAD_FOLDER, ".tmp")
+
+CHUNK_SIZE = 1024 * 1024
+BLOB_PREFIX = "uploads/blobs/"
+# Pending references older than this belong to a crashed upload; collect_garbage ignores them
+PENDING_EXPIRY = "-1 day"
+# sweep_orphan_files leaves younger files alone: they may belong to a request still in flight
+ORPHAN_MIN_AGE = 3600
+
+
+def _shard(name: str) -> str:
+    """Two-level shard directory for a hex digest or UUID (e.g. 'ab/cd')."""
+    key = name.replace("-", "")
+    return f"{key[:2]}/{key[2:4]}"
+
+
+def blob_relpath(digest: str, ext: str) -> str:
+    """DB path (relative to the backend folder) of a blob with this digest."""
+    return f"{BLOB_PREFIX}{_shard(digest)}/{digest}{ext.lower()}"
+
+
+def store_stream(stream, ext: str, conn=None) -> str:
+    """
+    Hashes and writes an uploaded file into the blob store.
+    If a blob with the same content already exists the new copy is discarded.
+
+    Args:
+        stream: A binary file-like object (e.g. FileStorage.stream).
+        ext (str): File extension including the dot, e.g. ".png".
+        conn (sqlite3.Connection, optional): If given, a pending reference is
+            taken (and committed) before the file is put in place; pass the
+            path to register_blob or discard_blob exactly once per call.
+
+    Returns:
+        str: The blob's DB path, e.g. "uploads/blobs/ab/cd/<sha256>.png".
+    """
+    os.makedirs(TMP_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=TMP_DIR)
+    acquired = None
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        relpath = blob_relpath(digest.hexdigest(), ext)
+        abs_path = resolve_path(relpath, must_exist=False)
+        if conn is not None:
+            _acquire(conn, relpath, os.path.getsize(tmp_path))
+            acquired = relpath
+        if os.path.exists(abs_path):
+            os.remove(tmp_path)  # duplicate content: keep the existing blob
+        else:
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            os.replace(tmp_path, abs_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if acquired:
+            discard_blob(conn, acquired)
+        raise
+    return relpath
+
+
+def store_file(path: str, ext: str = None) -> str:
+    """Stores an existing file on disk; see store_stream."""
+    with open(path, "rb") as f:
+        return store_stream(f, ext if ext is not None else os.path.splitext(path)[1])
+
+
+def _acquire(conn, relpath: str, size: int):
+    """Takes a pending reference on a blob, creating its row if needed."""
+    digest = os.path.splitext(os.path.basename(relpath))[0]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("INSERT OR IGNORE INTO blobs (path, digest, size) VALUES (?, ?, ?)",
+                     (relpath, digest, size))
+        conn.execute("UPDATE blobs SET pending = pending + 1, pending_at = CURRENT_TIMESTAMP WHERE path = ?",
+                     (relpath,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def register_blob(conn, relpath: str, pending: bool = True):
+    """
+    Records a stored blob in the `blobs` table and gives back the pending
+    reference store_stream took for it. Call this in the same transaction
+    that inserts the referencing patients row; the patients triggers then
+    count the reference.
+
+    Args:
+        conn (sqlite3.Connection): Connection inside the insert transaction.
+        relpath (str): The blob's DB path.
+        pending (bool, optional): False if the blob was stored without a
+            connection (no pending reference to give back). Defaults to True.
+    """
+    digest = os.path.splitext(os.path.basename(relpath))[0]
+    size = os.path.getsize(resolve_path(relpath, must_exist=False))
+    conn.execute("INSERT OR IGNORE INTO blobs (path, digest, size) VALUES (?, ?, ?)",
+                 (relpath, digest, size))
+    if pending:
+        conn.execute("UPDATE blobs SET pending = pending - 1 WHERE path = ? AND pending > 0", (relpath,))
+
+
+def discard_blob(conn, relpath: str):
+    """
+    Gives back the pending reference of an upload that was not saved (e.g.
+    after a failed prediction) and deletes the blob if nothing else holds it.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("UPDATE blobs SET pending = pending - 1 WHERE path = ? AND pending > 0", (relpath,))
+        _delete_unreferenced(conn, relpath, "pending <= 0")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def collect_garbage(conn) -> int:
+    """
+    Deletes blobs no record references and no recent upload holds.
+    Returns the number removed.
+    """
+    removed = 0
+    expired = f"(pending <= 0 OR pending_at < datetime('now', '{PENDING_EXPIRY}'))"
+    rows = conn.execute(f"SELECT path FROM blobs WHERE refcount <= 0 AND {expired}").fetchall()
+    for (relpath,) in rows:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed += _delete_unreferenced(conn, relpath, expired)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return removed
+
+
+def sweep_orphan_files(conn, min_age: float = ORPHAN_MIN_AGE) -> dict:
+    """
+    Deletes files under uploads/ that the database does not know: blob
+    files (and their derivatives) with no `blobs` row, report PDFs with no
+    patients row, and leftover temp files. Files younger than min_age
+    seconds are kept.
+
+    Returns:
+        dict: Counts of deleted blob files, report PDFs and temp files.
+    """
+    cutoff = time.time() - min_age
+    summary = {"blob_files": 0, "pdfs": 0, "tmp_files": 0}
+
+    def old_files(root):
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        yield path, name
+                except OSError:
+                    continue  # deleted meanwhile
+
+    def remove_if(path, sql, params):
+        # Checked under the write lock, so an upload cannot take a reference in between
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            orphan = not conn.execute(sql, params).fetchone()
+            if orphan and os.path.exists(path):
+                os.remove(path)
+            conn.commit()
+            return orphan
+        except BaseException:
+            conn.rollback()
+            raise
+
+    for path, name in old_files(BLOB_DIR):
+        # <digest><ext>, or a derivative / attention map named <digest><ext>.<suffix>.jpg
+        owner = ".".join(name.split(".")[:2])
+        relpath = f"{BLOB_PREFIX}{_shard(owner)}/{owner}"
+        if conn.execute("SELECT 1 FROM blobs WHERE path = ?", (relpath,)).fetchone():
+            continue
+        summary["blob_files"] += remove_if(path, "SELECT 1 FROM blobs WHERE path = ?", (relpath,))
+    for path, name in old_files(REPORT_DIR):
+        if name.endswith(".tmp"):
+            os.remove(path)
+            summary["tmp_files"] += 1
+        elif name.endswith(".pdf"):
+            report_id = name[:-len(".pdf")]
+            if not conn.execute("SELECT 1 FROM patients WHERE report_id = ?", (report_id,)).fetchone():
+                summary["pdfs"] += remove_if(path, "SELECT 1 FROM patients WHERE report_id = ?", (report_id,))
+    for path, _ in old_files(TMP_DIR):
+        os.remove(path)
+        summary["tmp_files"] += 1
+    return summary
+
+
+def _delete_unreferenced(conn, relpath: str, condition: str) -> bool:
+    """
+    Deletes a blob's row and files if it has no references left. Runs inside
+    the caller's write transaction, so no upload can take a pending reference
+    between the check and the removal.
+    """
+    cur = conn.execute(f"DELETE FROM blobs WHERE path = ? AND refcount <= 0 AND {condition}", (relpath,))
+    exists = conn.execute("SELECT 1 FROM blobs WHERE path = ?", (relpath,)).fetchone()
+    if cur.rowcount or not exists:
+        _remove_blob_files(relpath)
+    return cur.rowcount > 0
+
+
+def _remove_blob_files(relpath: str):
+    """Deletes a blob and its cached derivatives (<blob>.<kind>.jpg) from disk."""
+    abs_path = resolve_path(relpath, must_exist=False)
+    for path in [abs_path, *glob.glob(glob.escape(abs_path) + ".*.jpg")]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def resolve_path(stored_path: str, must_exist: bool = True):
+    """
+    Resolves an image path stored in the DB to an absolute path.
+    Handles blob paths, legacy "uploads/<file>" paths (including ones written
+    with Windows separators) and bare filenames in the legacy uploads folder.
+
+    Returns:
+        str | None: The absolute path, or None if `must_exist` and it is missing.
+    """
+    if not stored_path:
+        return None
+    normalized = stored_path.replace("\\", "/")
+    if os.path.isabs(normalized):
+        candidates = [normalized]
+    else:
+        candidates = [os.path.join(BASE_DIR, *normalized.split("/"))]
+        if not normalized.startswith(BLOB_PREFIX):
+            candidates.append(os.path.join(UPLOAD_FOLDER, os.path.basename(normalized)))
+    if not must_exist:
+        return candidates[0]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+# --- Report PDFs ---
+
+def report_pdf_path(report_id: str) -> str:
+    """Absolute path where the PDF for `report_id` is written."""
+    return os.path.join(REPORT_DIR, *_shard(report_id).split("/"), f"{report_id}.pdf")
+
+
+def find_report_pdf(report_id: str):
+    """Absolute path of an existing report PDF (sharded or legacy flat), or None."""
+    for candidate in (report_pdf_path(report_id), os.path.join(UPLOAD_FOLDER, f"{report_id}.pdf")):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+# --- Legacy Layout Migration ---
+
+def migrate_legacy_uploads(conn, keep_legacy: bool = False) -> dict:
+    """
+    Moves every flat uploads/ image referenced by `patients` into the blob
+    store, rewrites the stored paths in one transaction, and moves legacy
+    report PDFs into their shards.
+
+    Returns:
+        dict: Counts of migrated images, duplicates, missing files and PDFs.
+    """
+    summary = {"images": 0, "deduplicated": 0, "missing": 0, "pdfs": 0}
+    legacy_files = set()
+    updates = []
+    rows = conn.execute(
+        "SELECT id, left_eye_path, right_eye_path, report_id FROM patients"
+    ).fetchall()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for row_id, left, right, _ in rows:
+            new_paths = []
+            for stored in (left, right):
+                if not stored or stored.replace("\\", "/").startswith(BLOB_PREFIX):
+                    new_paths.append(stored)
+                    continue
+                source = resolve_path(stored)
+                if not source:
+                    summary["missing"] += 1
+                    new_paths.append(stored)
+                    continue
+                relpath = store_file(source)
+                existed = conn.execute("SELECT 1 FROM blobs WHERE path = ?", (relpath,)).fetchone()
+                register_blob(conn, relpath, pending=False)
+                summary["deduplicated" if existed else "images"] += 1
+                legacy_files.add(source)
+                new_paths.append(relpath)
+            if new_paths != [left, right]:
+                updates.append((new_paths[0], new_paths[1], row_id))
+        # The UPDATE trigger counts each new reference
+        conn.executemany("UPDATE patients SET left_eye_path = ?, right_eye_path = ? WHERE id = ?", updates)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    if not keep_legacy:
+        for source in legacy_files:
+            os.remove(source)
+
+    for _, _, _, report_id in rows:
+        legacy_pdf = os.path.join(UPLOAD_FOLDER, f"{report_id}.pdf")
+        if report_id and os.path.isfile(legacy_pdf):
+            target = report_pdf_path(report_id)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if keep_legacy:
+                shutil.copy2(legacy_pdf, target)
+            else:
+                os.replace(legacy_pdf, target)
+            summary["pdfs"] += 1
+    return summary
+
+
+if __name__ == "__main__":
+    from db_init import DB_PATH, migrate_db
+
+    parser = argparse.ArgumentParser(description="Content-addressed upload store maintenance")
+    parser.add_argument("--migrate", action="store_true", help="Move legacy flat uploads into the blob store")
+    parser.add_argument("--keep-legacy", action="store_true", help="Copy instead of moving legacy files")
+    parser.add_argument("--gc", action="store_true", help="Delete blobs no record references")
+    parser.add_argument("--sweep", action="store_true",
+                        help="Also delete files under uploads/ the database does not know (orphans)")
+    parser.add_argument("--db", type=str, default=DB_PATH, help="Path to records.db")
+    args = parser.parse_args()
+
+    if not (args.migrate or args.gc or args.sweep):
+        parser.print_help()
+    else:
+        conn = sqlite3.connect(args.db)
+        try:
+            migrate_db(conn)  # the blobs table and refcount triggers arrive with migration 5
+            if args.migrate:
+                summary = migrate_legacy_uploads(conn, keep_legacy=args.keep_legacy)
+                print(f"✅ Migrated {summary['images']} images ({summary['deduplicated']} duplicates), "
+                      f"{summary['pdfs']} PDFs; {summary['missing']} referenced files were missing.")
+            if args.gc:
+                print(f"✅ Removed {collect_garbage(conn)} unreferenced blobs.")
+            if args.sweep:
+                summary = sweep_orphan_files(conn)
+                print(f"✅ Removed {summary['blob_files']} orphaned blob files, {summary['pdfs']} orphaned "
+                      f"report PDFs and {summary['tmp_files']} leftover temp files.")
+        finally:
+            conn.close()
@@ -0,0 +1,265 @@
+# backend/build_static.py
+# Build step for the Flask UI's static assets (see static_assets.py).
+#
+# For every file under Flask/static it writes, below Flask/static/dist/:
+#   <name>.<hash>.<ext>        the asset, fingerprinted by its content hash; PNGs
+#                              and JPEGs are re-encoded losslessly/optimized when
+#                              that makes them smaller
+#   <name>.<hash>.<ext>.br/.gz precompressed variants of text assets (CSS, SVG, JS)
+#   <name>.<hash>.<ext>.webp   a WebP variant of PNG/JPEG images, when smaller
+# and dist/manifest.json, which maps original filenames to fingerprinted ones.
+# Relative url(...) references inside CSS are rewritten to the fingerprinted
+# names before the CSS itself is hashed.
+#
+# Files from the previous build are kept (a running server keeps linking to
+# them until it restarts); anything older is pruned. Images whose source is
+# unchanged reuse their previous optimized and WebP output.
+#
+# Usage: python build_static.py [--static-dir ../Flask/static] [--webp-quality 85]
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+import time
+
+import brotli
+from PIL import Image
+
+from static_assets import DIST_DIR, MANIFEST_NAME
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "..", "Flask", "static")
+
+TEXT_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".map"}
+RASTER_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+HASH_LENGTH = 10
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def fingerprinted_name(rel_path: str, data: bytes) -> str:
+    """'css/style.css' -> 'dist/css/style.<hash>.css'"""
+    stem, ext = posixpath.splitext(rel_path)
+    return f"{DIST_DIR}/{stem}.{content_hash(data)}{ext}"
+
+
+def optimize_raster(data: bytes, ext: str) -> bytes:
+    """Re-encodes a PNG (optimize) or JPEG (optimized, progressive, same quality); keeps the smaller."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            out = io.BytesIO()
+            if ext == ".png":
+                img.save(out, format="PNG", optimize=True)
+            else:
+                img.save(out, format="JPEG", optimize=True, progressive=True, quality="keep")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not optimize image ({e}); copying it unchanged.")
+        return data
+    optimized = out.getvalue()
+    return optimized if len(optimized) < len(data) else data
+
+
+def webp_variant(data: bytes, quality: int):
+    """WebP encoding of a raster image, or None if it is not smaller."""
+    with Image.open(io.BytesIO(data)) as img:
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        out = io.BytesIO()
+        img.save(out, format="WEBP", quality=quality, method=6)
+    webp = out.getvalue()
+    return webp if len(webp) < len(data) else None
+
+
+def compressed_variants(data: bytes) -> dict:
+    """{'.br': ..., '.gz': ...} for whichever encodings actually shrink the data."""
+    variants = {
+        ".br": brotli.compress(data, quality=11),
+        ".gz": gzip.compress(data, compresslevel=9, mtime=0),
+    }
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data)}
+
+
+def rewrite_css_urls(css: str, rel_path: str, resolve) -> str:
+    """Points relative url(...) references in a stylesheet at their fingerprinted files."""
+    css_dir = posixpath.dirname(rel_path)
+
+    def replace(match):
+        quote, ref = match.group(1), match.group(2).strip()
+        if ref.startswith(("data:", "http:", "https:", "//", "/", "#")):
+            return match.group(0)
+        path, sep, suffix = ref, "", ""
+        query = re.search(r"[?#]", ref)
+        if query:
+            path, sep, suffix = ref[:query.start()], ref[query.start()], ref[query.start() + 1:]
+        target = posixpath.normpath(posixpath.join(css_dir, path))
+        fingerprinted = resolve(target)
+        if fingerprinted is None:
+            print(f"⚠️ {rel_path}: url({ref}) does not point at a static file; left unchanged.")
+            return match.group(0)
+        # Both files move below dist/, so the reference stays relative
+        new_ref = posixpath.relpath(fingerprinted, posixpath.join(DIST_DIR, css_dir))
+        return f"url({quote}{new_ref}{sep}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, css)
+
+
+def collect_sources(static_dir: str) -> list:
+    """Relative (posix) paths of every source asset, skipping the dist/ output."""
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [d for d in dirs if d != DIST_DIR]
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), static_dir)
+            sources.append(rel.replace(os.sep, "/"))
+    return sorted(sources)
+
+
+def write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.isfile(path) and os.path.getsize(path) == len(data):
+        return  # fingerprinted: same name and size means the same content
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(static_dir: str, webp_quality: int = 85) -> dict:
+    """
+    Builds dist/ and its manifest.
+
+    Args:
+        static_dir (str): The Flask static folder.
+        webp_quality (int): Quality of the WebP image variants (0-100).
+
+    Returns:
+        dict: Totals for the report: files, source bytes, output bytes and
+              smallest-variant bytes.
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    manifest_path = os.path.join(dist_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = {}
+    # Image re-encoding dominates the build, so unchanged images reuse their previous output
+    previous_images = previous.get("images", {})
+
+    sources = set(collect_sources(static_dir))
+    manifest = {}
+    images = {}  # source path -> [source hash + settings, fingerprinted path, variant suffixes]
+    outputs = {}  # fingerprinted path -> {suffix: bytes}, '' being the asset itself
+    stats = {"files": 0, "source_bytes": 0, "output_bytes": 0, "smallest_bytes": 0}
+
+    def reuse_image(rel_path, key):
+        entry = previous_images.get(rel_path)
+        if not entry or entry[0] != key:
+            return None
+        files = {}
+        for suffix in entry[2]:
+            try:
+                with open(os.path.join(static_dir, entry[1] + suffix), "rb") as f:
+                    files[suffix] = f.read()
+            except FileNotFoundError:
+                return None
+        return entry[1], files
+
+    def resolve(rel_path):
+        """Fingerprinted path of a source asset, building it (and its CSS dependencies) on first use."""
+        if rel_path in manifest:
+            return manifest[rel_path]
+        if rel_path not in sources:
+            return None
+        manifest[rel_path] = None  # guards against @import cycles
+        with open(os.path.join(static_dir, rel_path), "rb") as f:
+            data = f.read()
+        stats["source_bytes"] += len(data)
+        ext = posixpath.splitext(rel_path)[1].lower()
+
+        if ext in RASTER_EXTENSIONS:
+            key = f"{content_hash(data)}:webp{webp_quality}"
+            reused = reuse_image(rel_path, key)
+            if reused:
+                fingerprinted, files = reused
+            else:
+                data = optimize_raster(data, ".png" if ext == ".png" else ".jpg")
+                fingerprinted = fingerprinted_name(rel_path, data)
+                files = {"": data}
+                webp = webp_variant(data, webp_quality)
+                if webp is not None:
+                    files[".webp"] = webp
+            images[rel_path] = [key, fingerprinted, sorted(files)]
+        else:
+            if ext == ".css":
+                data = rewrite_css_urls(data.decode("utf-8"), rel_path, resolve).encode("utf-8")
+            fingerprinted = fingerprinted_name(rel_path, data)
+            files = {"": data}
+            if ext in TEXT_EXTENSIONS:
+                files.update(compressed_variants(data))
+
+        outputs[fingerprinted] = files
+        manifest[rel_path] = fingerprinted
+        stats["files"] += 1
+        stats["output_bytes"] += len(files[""])
+        stats["smallest_bytes"] += min(len(body) for body in files.values())
+        return fingerprinted
+
+    for rel_path in sorted(sources):
+        resolve(rel_path)
+
+    for fingerprinted, files in outputs.items():
+        for suffix, data in files.items():
+            write_file(os.path.join(static_dir, fingerprinted + suffix), data)
+
+    current_files = sorted(posixpath.relpath(f + s, DIST_DIR) for f, files in outputs.items() for s in files)
+    prune(dist_dir, {MANIFEST_NAME} | set(current_files) | set(previous.get("files", [])))
+
+    tmp = f"{manifest_path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"built_at": int(time.time()), "assets": dict(sorted(manifest.items())),
+                   "files": current_files, "images": images}, f, indent=1)
+    os.replace(tmp, manifest_path)
+    return stats
+
+
+def prune(dist_dir: str, keep: set):
+    """Deletes files below dist/ that belong to neither the current nor the previous build."""
+    removed = 0
+    for root, dirs, files in os.walk(dist_dir, topdown=False):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), dist_dir).replace(os.sep, "/")
+            if rel not in keep:
+                os.remove(os.path.join(root, name))
+                removed += 1
+        if root != dist_dir and not os.listdir(root):
+            os.rmdir(root)
+    if removed:
+        print(f"  ↳ Pruned {removed} files from older builds.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress the Flask UI's static assets")
+    parser.add_argument("--static-dir", type=str, default=STATIC_DIR)
+    parser.add_argument("--webp-quality", type=int, default=85, help="Quality of the WebP image variants")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = build(os.path.abspath(args.static_dir), args.webp_quality)
+    mb = 1024 * 1024
+    print(f"✅ Built {stats['files']} assets in {time.perf_counter() - start:.1f}s: "
+          f"{stats['source_bytes'] / mb:.2f} MB source, {stats['output_bytes'] / mb:.2f} MB optimized, "
+          f"{stats['smallest_bytes'] / mb:.2f} MB smallest variants.")
+    print("  ↳ Restart the app to serve the new build.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+# backend/camp_upload.py
+# Bulk ingest for screening camps: one ZIP of fundus images plus a CSV
+# manifest that maps each patient to a left and a right image.
+#
+# The upload request only stream-extracts the archive into the blob store and
+# records a camp_jobs row (migration 8 in db_init.py). A background thread then
+#   1. runs batched inference over every distinct image,
+#   2. inserts all patients rows in a single transaction, with a SAVEPOINT
+#      per row so that one bad row never aborts the batch,
+#   3. renders the report PDFs.
+# Progress and per-row errors are kept in camp_jobs, so the progress page
+# can be served by any server process.
+#
+# The thread lives in a web worker, which a restart (deploy, max-requests,
+# timeout) can kill mid-job. The job row therefore also stores the parsed
+# manifest and the extracted images (migration 14), and every progress update
+# is a heartbeat. A job without a heartbeat for STALE_AFTER seconds is
+# resumed by the next process that looks at it (resume_stale_jobs, called by
+# the camp pages) or by `python camp_upload.py --resume`. The batch insert is
+# a single transaction, so a job interrupted before it committed restarts
+# from the beginning. One interrupted while rendering PDFs is finished as is,
+# since missing PDFs are rendered when a report is opened.
+#
+# Manifest columns (header row required, extra columns are ignored):
+#   patient_id, name, left_image, right_image                        - required
+#   age, gender, diabetes_duration, blood_pressure, medications,
+#   other_conditions                                                 - optional
+# left_image / right_image are paths inside the ZIP (or bare file names).
+#
+# Usage: python camp_upload.py --resume [--db records.db]   # resume interrupted jobs in this process
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import threading
+import uuid
+import zipfile
+
+import numpy as np
+
+from backend_utils import allowed_file, predict_probabilities, preprocess_image
+from blob_store import discard_blob, report_pdf_path, resolve_path, store_stream
+from image_derivatives import ensure_derivatives
+from report_delivery import build_patient_info, render_key
+from report_generator import render_reports
+
+REQUIRED_COLUMNS = ("patient_id", "name", "left_image", "right_image")
+OPTIONAL_COLUMNS = ("age", "gender", "diabetes_duration", "blood_pressure", "medications", "other_conditions")
+
+MAX_IMAGES = 5000
+MAX_IMAGE_BYTES = 50 * 1024 * 1024
+MAX_ARCHIVE_BYTES = 10 * 1024 * 1024 * 1024  # uncompressed images in one archive
+MAX_MANIFEST_BYTES = 5 * 1024 * 1024
+PREDICT_BATCH_SIZE = 32
+PROGRESS_EVERY = 25  # rows between progress updates in camp_jobs
+STALE_AFTER = 600  # seconds without a heartbeat after which a running job counts as interrupted
+RUNNING = ("queued", "predicting", "saving", "rendering")
+# The server process has TensorFlow loaded, which is not safe to fork into a
+# process pool, so camp PDFs are rendered in the job thread itself.
+PDF_WORKERS = 1
+
+
+# --- Upload ---
+
+def extract_archive(conn, archive_stream):
+    """
+    Stream-extracts the images in a camp ZIP into the blob store, each
+    holding a pending reference until the job has saved its rows.
+    If the archive is rejected, images already stored are discarded again.
+
+    Args:
+        conn: Open sqlite3 connection.
+        archive_stream: Seekable binary file-like object holding the ZIP.
+
+    Returns:
+        tuple: ({name inside the ZIP: blob path}, manifest CSV text or None).
+    """
+    images, manifest_text = {}, None
+    try:
+        with zipfile.ZipFile(archive_stream) as archive:
+            # Declared sizes are binding: ZipExtFile never yields more than file_size bytes
+            total = sum(member.file_size for member in archive.infolist()
+                        if allowed_file(os.path.basename(member.filename)))
+            if total > MAX_ARCHIVE_BYTES:
+                raise ValueError(f"The archive's images add up to more than "
+                                 f"{MAX_ARCHIVE_BYTES // (1024 * 1024 * 1024)} GB uncompressed")
+            for member in archive.infolist():
+                name = member.filename.replace("\\", "/")
+                base = os.path.basename(name)
+                if member.is_dir() or not base or base.startswith(".") or name.startswith("__MACOSX/"):
+                    continue
+                if base.lower().endswith(".csv"):
+                    if manifest_text is None and member.file_size <= MAX_MANIFEST_BYTES:
+                        manifest_text = archive.read(member).decode("utf-8-sig")
+                    continue
+                if not allowed_file(base):
+                    continue
+                if member.file_size > MAX_IMAGE_BYTES:
+                    raise ValueError(f"{name} is larger than {MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+                if len(images) >= MAX_IMAGES:
+                    raise ValueError(f"The archive holds more than {MAX_IMAGES} images")
+                # ZipExtFile decompresses incrementally; store_stream hashes and writes it chunk by chunk
+                with archive.open(member) as src:
+                    images[name] = store_stream(src, os.path.splitext(base)[1], conn)
+    except BaseException as e:
+        release_images(conn, images)
+        if isinstance(e, zipfile.BadZipFile):
+            raise ValueError(f"Not a valid ZIP archive: {e}")
+        raise
+    return images, manifest_text
+
+
+def release_images(conn, images):
+    """Gives back the pending reference of every extracted image; unused ones are deleted."""
+    for blob in images.values():  # one reference per ZIP member, even for identical images
+        discard_blob(conn, blob)
+
+
+def parse_manifest(text: str):
+    """
+    Parses the camp manifest CSV.
+
+    Raises:
+        ValueError: If the manifest is empty or lacks a required column.
+
+    Returns:
+        list: One dict per data row, with its 1-based line number under "line".
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    header = {(field or "").strip().lower() for field in reader.fieldnames or []}
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"Manifest is missing required column(s): {', '.join(missing)}")
+    rows = []
+    for row in reader:
+        cleaned = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()
+                   if isinstance(value, str)}
+        if any(cleaned.values()):
+            cleaned["line"] = reader.line_num
+            rows.append(cleaned)
+    if not rows:
+        raise ValueError("Manifest has no patient rows")
+    return rows
+
+
+def start_camp_job(db_path, doctor_id, archive_stream, manifest_stream=None,
+                   model=None, class_mapping=None, model_version=None):
+    """
+    Stores a camp upload and starts its background processing.
+
+    Args:
+        db_path (str): Path to records.db; the job thread opens its own connection.
+        doctor_id (int): The uploading doctor.
+        archive_stream: The uploaded ZIP.
+        manifest_stream: The uploaded manifest CSV, or None to use the CSV inside the ZIP.
+        model, class_mapping, model_version: The loaded DR model and its metadata.
+
+    Raises:
+        ValueError: If the archive or manifest cannot be used at all.
+
+    Returns:
+        str: The job id.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        images, manifest_text = extract_archive(conn, archive_stream)
+        try:
+            if manifest_stream is not None:
+                manifest_text = manifest_stream.read(MAX_MANIFEST_BYTES + 1).decode("utf-8-sig")
+            if not manifest_text:
+                raise ValueError("No manifest CSV uploaded or found in the archive")
+            rows = parse_manifest(manifest_text)
+        except BaseException:
+            release_images(conn, images)
+            raise
+
+        job_id = str(uuid.uuid4())
+        conn.execute("""
+            INSERT INTO camp_jobs (id, doctor_id, total_rows, payload, heartbeat_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (job_id, doctor_id, len(rows), json.dumps({"rows": rows, "images": images})))
+        conn.commit()
+    finally:
+        conn.close()
+
+    _start_worker(db_path, job_id, doctor_id, rows, images, model, class_mapping, model_version)
+    return job_id
+
+
+def _start_worker(db_path, job_id, doctor_id, rows, images, model, class_mapping, model_version):
+    worker = threading.Thread(
+        target=run_camp_job, name=f"camp-job-{job_id[:8]}", daemon=True,
+        args=(db_path, job_id, doctor_id, rows, images, model, class_mapping, model_version),
+    )
+    worker.start()
+
+
+def resume_stale_jobs(db_path, model=None, class_mapping=None, model_version=None,
+                      doctor_id=None, background=True):
+    """
+    Resumes camp jobs whose worker stopped sending heartbeats (see the top of
+    this file). Each job is claimed with a conditional UPDATE, so of several
+    processes looking at once only one resumes it.
+
+    Args:
+        db_path (str): Path to records.db.
+        model, class_mapping, model_version: The model the resumed jobs run on.
+        doctor_id (int, optional): Only this doctor's jobs. Defaults to all.
+        background (bool, optional): Run each job on a thread (True) or in
+            the calling thread, one after another. Defaults to True.
+
+    Returns:
+        list: The ids of the jobs taken over.
+    """
+    stale = f"-{STALE_AFTER} seconds"
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    resumed, runs = [], []
+    try:
+        sql = (f"SELECT id FROM camp_jobs WHERE status IN ({', '.join('?' * len(RUNNING))}) "
+               "AND (heartbeat_at IS NULL OR heartbeat_at < datetime('now', ?))")
+        params = [*RUNNING, stale]
+        if doctor_id is not None:
+            sql += " AND doctor_id = ?"
+            params.append(doctor_id)
+        for (job_id,) in conn.execute(sql, params).fetchall():
+            claimed = conn.execute(f"""
+                UPDATE camp_jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ({', '.join('?' * len(RUNNING))})
+                AND (heartbeat_at IS NULL OR heartbeat_at < datetime('now', ?))
+            """, (job_id, *RUNNING, stale)).rowcount
+            conn.commit()
+            if not claimed:
+                continue  # another process got there first
+            resumed.append(job_id)
+            job = conn.execute("SELECT * FROM camp_jobs WHERE id = ?", (job_id,)).fetchone()
+            errors = json.loads(job["errors"] or "[]")
+            if job["status"] == "rendering" or not job["payload"]:
+                # Rows are saved once rendering starts; a job from before migration 14 cannot be restarted
+                note = ("PDF rendering was interrupted; the remaining reports are rendered when opened"
+                        if job["status"] == "rendering" else "interrupted by a server restart")
+                errors.append({"line": None, "patient_id": None, "error": note})
+                _update_job(conn, job_id, status="done" if job["status"] == "rendering" else "failed",
+                            errors=json.dumps(errors), finished_at=_now(conn), payload=None)
+                print(f"⚠️ Camp job {job_id} was interrupted while {job['status']}: {note}")
+                continue
+            payload = json.loads(job["payload"])
+            # Keep the images' pending references from expiring (blob_store.collect_garbage)
+            conn.executemany("UPDATE blobs SET pending_at = CURRENT_TIMESTAMP WHERE path = ?",
+                             [(blob,) for blob in set(payload["images"].values())])
+            _update_job(conn, job_id, status="queued", predicted=0, inserted=0, pdfs_done=0, errors="[]")
+            print(f"⚠️ Camp job {job_id} was interrupted while {job['status']}; restarting it")
+            runs.append((db_path, job_id, job["doctor_id"], payload["rows"], payload["images"],
+                         model, class_mapping, model_version))
+    finally:
+        conn.close()
+    for args in runs:
+        if background:
+            _start_worker(*args)
+        else:
+            run_camp_job(*args)
+    return resumed
+
+
+def get_camp_job(conn, job_id, doctor_id):
+    """Returns a doctor's camp job as a dict (errors decoded), or None."""
+    row = conn.execute("SELECT * FROM camp_jobs WHERE id = ? AND doctor_id = ?", (job_id, doctor_id)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job.pop("payload", None)
+    job["errors"] = json.loads(job["errors"] or "[]")
+    return job
+
+
+# --- Background Processing ---
+
+def _update_job(conn, job_id, **fields):
+    """Updates a job's progress fields; every update is also a heartbeat."""
+    assignments = "".join(f"{column} = ?, " for column in fields)
+    conn.execute(f"UPDATE camp_jobs SET {assignments}heartbeat_at = CURRENT_TIMESTAMP WHERE id = ?",
+                 (*fields.values(), job_id))
+    conn.commit()
+
+
+def _find_image(images, name):
+    """Looks up a manifest image reference by its path inside the ZIP, then by bare file name."""
+    name = name.replace("\\", "/")
+    while name.startswith("./"):
+        name = name.removeprefix("./")
+    if name in images:
+        return images[name]
+    matches = [blob for path, blob in images.items() if os.path.basename(path) == os.path.basename(name)]
+    return matches[0] if len(set(matches)) == 1 else None
+
+
+def predict_blobs(model, blobs, on_batch=None):
+    """
+    Classifies images in batches of PREDICT_BATCH_SIZE.
+
+    Returns:
+        dict: {blob path: predicted class index}, or an error message for images that could not be read.
+    """
+    results = {}
+    for start in range(0, len(blobs), PREDICT_BATCH_SIZE):
+        arrays, batch = [], []
+        for blob in blobs[start:start + PREDICT_BATCH_SIZE]:
+            try:
+                arrays.append(preprocess_image(resolve_path(blob, must_exist=False)))
+                batch.append(blob)
+            except Exception as e:
+                results[blob] = f"unreadable image: {e}"
+        if arrays:
+            predictions = predict_probabilities(model, np.concatenate(arrays)).argmax(axis=1)
+            results.update(zip(batch, (int(p) for p in predictions)))
+        if on_batch:
+            on_batch(min(start + PREDICT_BATCH_SIZE, len(blobs)))
+    return results
+
+
+def run_camp_job(db_path, job_id, doctor_id, rows, images, model, class_mapping, model_version):
+    """Job thread body: inference, a single-transaction insert, then PDF rendering."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    errors = []
+    released = False
+
+    def row_error(row, message):
+        errors.append({"line": row.get("line"), "patient_id": row.get("patient_id"), "error": message})
+
+    try:
+        if model is None:
+            raise RuntimeError("AI model not available")
+
+        # Resolve every row's images before touching the model
+        valid = []
+        for row in rows:
+            missing = [column for column in REQUIRED_COLUMNS if not row.get(column)]
+            if missing:
+                row_error(row, f"missing {', '.join(missing)}")
+                continue
+            left, right = _find_image(images, row["left_image"]), _find_image(images, row["right_image"])
+            if not (left and right):
+                row_error(row, f"image not found in archive: {row['left_image'] if not left else row['right_image']}")
+                continue
+            valid.append((row, left, right))
+
+        # Identical images are stored once and classified once
+        blobs = list(dict.fromkeys(blob for _, left, right in valid for blob in (left, right)))
+        _update_job(conn, job_id, status="predicting")
+        predictions = predict_blobs(model, blobs, on_batch=lambda done: _update_job(conn, job_id, predicted=done))
+        for done, blob in enumerate(blobs, 1):
+            if isinstance(predictions.get(blob), int):
+                try:
+                    ensure_derivatives(resolve_path(blob, must_exist=False))
+                except Exception as e:
+                    print(f"⚠️ Could not create image derivatives for {blob}: {e}")
+            if done % PROGRESS_EVERY == 0:
+                _update_job(conn, job_id)  # heartbeat
+
+        # One transaction for the whole batch; a SAVEPOINT isolates each row
+        _update_job(conn, job_id, status="saving")
+        inserted = []
+        # The blobs rows exist since extraction; the insert triggers count each reference
+        conn.execute("BEGIN")
+        for row, left, right in valid:
+            left_pred, right_pred = predictions.get(left), predictions.get(right)
+            if not isinstance(left_pred, int) or not isinstance(right_pred, int):
+                row_error(row, left_pred if not isinstance(left_pred, int) else right_pred)
+                continue
+            report_id = str(uuid.uuid4())
+            conn.execute("SAVEPOINT camp_row")
+            try:
+                cur = conn.execute("""
+                    INSERT INTO patients (doctor_id, name, patient_id, age, gender, diabetes_duration,
+                    blood_pressure, medications, other_conditions, left_eye_path, right_eye_path,
+                    left_result, right_result, combined_result, report_id, model_version)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    doctor_id, row["name"], row["patient_id"], row.get("age") or None, row.get("gender"),
+                    row.get("diabetes_duration"), row.get("blood_pressure"), row.get("medications"),
+                    row.get("other_conditions"), left, right,
+                    class_mapping.get(left_pred, "Unknown"), class_mapping.get(right_pred, "Unknown"),
+                    class_mapping.get(max(left_pred, right_pred), "Unknown"), report_id, model_version,
+                ))
+                conn.execute("RELEASE camp_row")
+                inserted.append(cur.lastrowid)
+            except sqlite3.IntegrityError:
+                conn.execute("ROLLBACK TO camp_row")
+                conn.execute("RELEASE camp_row")
+                row_error(row, "a patient with this ID (email) already has a record")
+        # Committed with the rows: a job resumed from here on is never re-run, so
+        # its images are never released twice. If the process dies before
+        # release_images below, the pending references expire instead
+        # (blob_store.PENDING_EXPIRY).
+        conn.execute("""
+            UPDATE camp_jobs SET status = 'rendering', inserted = ?, errors = ?, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (len(inserted), json.dumps(errors), job_id))
+        conn.commit()
+
+        # Images that no inserted row uses (failed rows, extra files in the ZIP) are deleted
+        released = True
+        release_images(conn, images)
+
+        render_camp_pdfs(conn, job_id, doctor_id, inserted)
+        _update_job(conn, job_id, status="done", errors=json.dumps(errors), finished_at=_now(conn), payload=None)
+    except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
+        print(f"❌ Camp job {job_id} failed: {e}")
+        errors.append({"line": None, "patient_id": None, "error": str(e)})
+        _update_job(conn, job_id, status="failed", errors=json.dumps(errors), finished_at=_now(conn), payload=None)
+        if not released:
+            release_images(conn, images)
+    finally:
+        conn.close()
+
+
+def render_camp_pdfs(conn, job_id, doctor_id, row_ids):
+    """Renders the PDFs of newly inserted rows and records their filenames and fingerprints."""
+    doctor = conn.execute("SELECT full_name, medical_id, hospital_name FROM users WHERE id = ?",
+                          (doctor_id,)).fetchone()
+    doctor = dict(doctor) if doctor else {}
+    records = [dict(conn.execute("SELECT * FROM patients WHERE id = ?", (row_id,)).fetchone()) for row_id in row_ids]
+    jobs = ((build_patient_info(r), doctor, report_pdf_path(r["report_id"])) for r in records)
+
+    updates = []
+    for done, (record, (_, error)) in enumerate(zip(records, render_reports(jobs, workers=PDF_WORKERS)), 1):
+        if error:
+            # The report routes render missing PDFs on demand, so this is not fatal
+            print(f"⚠️ Camp job {job_id}: PDF for {record['report_id']} failed: {error}")
+        else:
+            updates.append((f"{record['report_id']}.pdf", render_key(record, doctor), record["id"]))
+        if done % PROGRESS_EVERY == 0:
+            _update_job(conn, job_id, pdfs_done=done)
+    conn.executemany("UPDATE patients SET report_filename = ?, report_render_key = ? WHERE id = ?", updates)
+    conn.execute("UPDATE camp_jobs SET pdfs_done = ? WHERE id = ?", (len(records), job_id))
+    conn.commit()
+
+
+def _now(conn):
+    return conn.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+
+
+def main():
+    from backend_utils import MODEL_PATH, get_model_version, load_class_mapping, load_dr_model
+    from db_init import DB_PATH, migrate_db
+
+    parser = argparse.ArgumentParser(description="Resume screening-camp jobs interrupted by a server restart")
+    parser.add_argument("--resume", action="store_true", help="Resume every stale job in this process")
+    parser.add_argument("--db", type=str, default=DB_PATH)
+    args = parser.parse_args()
+    if not args.resume:
+        parser.print_help()
+        return
+    conn = sqlite3.connect(args.db)
+    try:
+        migrate_db(conn)
+    finally:
+        conn.close()
+    resumed = resume_stale_jobs(args.db, load_dr_model(MODEL_PATH), load_class_mapping(),
+                                get_model_version(MODEL_PATH), background=False)
+    print(f"✅ {len(resumed)} interrupted camp jobs resumed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,309 @@
-import sqlite3, os
-DB = "records.db"
-UPLOAD_DIR = "uploads"
+# backend/check_reports.py
+# Incremental integrity check of records.db against the uploads folder.
+#
+# Every file under uploads/ is recorded in a manifest (path, size, mtime,
+# SHA-256, status). A repeat run only re-reads files whose size or mtime
+# changed, so an unchanged tree of millions of files costs one directory walk
+# and one indexed lookup per file. Each changed file is validated:
+#   - images must decode headers and pass Pillow's verify()
+#   - PDFs must start with %PDF- and end with %%EOF
+#   - content-addressed blobs must still hash to their own filename
+# patients rows are then streamed through a cursor and every referenced eye
+# image and report PDF is looked up in the manifest. Files no row references
+# (other than their cached derivatives) are reported as orphans.
+# records.db is opened read-only: the check never migrates or writes it, and
+# reports its schema version instead.
+#
+# Usage:
+#   python check_reports.py                       # human-readable report
+#   python check_reports.py --json summary.json   # also write a JSON summary ("-" for stdout)
+#   python check_reports.py --rehash              # re-examine every file
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from blob_store import BASE_DIR, UPLOAD_FOLDER, report_pdf_path, resolve_path
+from db_init import DB_PATH, SCHEMA_VERSION, get_schema_version
+from attention_maps import attention_map_path, is_attention_map
+from image_derivatives import DERIVATIVES
+
+MANIFEST_PATH = os.path.join(BASE_DIR, "integrity_manifest.db")
+IMAGE_EXTS = {".png", ".jpg", ".jpeg"}
+SKIP_DIRS = {".tmp"}  # in-flight uploads
+BATCH_SIZE = 1000
+MAX_LISTED = 1000  # problems of each kind listed in the JSON summary
+CHUNK_SIZE = 1024 * 1024
+
+
+# --- Manifest ---
+
+def open_manifest(path: str = MANIFEST_PATH):
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        PRAGMA journal_mode = WAL;
+        PRAGMA synchronous = NORMAL;
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT,
+            status TEXT NOT NULL,
+            checked_at TEXT DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID;
+        CREATE TEMP TABLE seen (path TEXT PRIMARY KEY) WITHOUT ROWID;
+        CREATE TEMP TABLE referenced (path TEXT PRIMARY KEY) WITHOUT ROWID;
+    """)
+    return conn
+
+
+def walk_files(root: str):
+    """Yields (relpath, size, mtime_ns) for every file below root, using scandir's cached stat."""
+    prefix_len = len(os.path.join(root, ""))
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_DIRS:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    relpath = entry.path[prefix_len:].replace(os.sep, "/")
+                    yield relpath, st.st_size, st.st_mtime_ns
+
+
+def _is_derivative(relpath: str) -> bool:
+    return any(relpath.endswith(f".{kind}.jpg") for kind in DERIVATIVES) or is_attention_map(relpath)
+
+
+def examine_file(abs_path: str, relpath: str):
+    """
+    Hashes and validates one file.
+
+    Returns:
+        tuple: (sha256, status) where status is "ok" or a description of the problem.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(abs_path, "rb") as f:
+            head = f.read(CHUNK_SIZE)
+            tail = head
+            chunk = head
+            while chunk:
+                digest.update(chunk)
+                tail = chunk
+                chunk = f.read(CHUNK_SIZE)
+    except OSError as e:
+        return None, f"unreadable: {e}"
+
+    sha256 = digest.hexdigest()
+    ext = os.path.splitext(relpath)[1].lower()
+    if ext in IMAGE_EXTS:
+        try:
+            with Image.open(abs_path) as img:
+                img.verify()
+        except Exception as e:
+            return sha256, f"invalid image: {e}"
+    elif ext == ".pdf":
+        if not head.startswith(b"%PDF-") or b"%%EOF" not in tail[-1024:]:
+            return sha256, "invalid PDF: missing header or %%EOF"
+
+    if relpath.startswith("blobs/") and not _is_derivative(relpath):
+        stem = os.path.splitext(os.path.basename(relpath))[0]
+        if stem != sha256:
+            return sha256, "digest mismatch: content changed since upload"
+    return sha256, "ok"
+
+
+def scan_uploads(manifest, root: str = UPLOAD_FOLDER, rehash: bool = False, workers: int = 4) -> dict:
+    """
+    Brings the manifest up to date with the files under root.
+
+    Returns:
+        dict: Counts of files seen, files (re-)examined and files removed since the last run.
+    """
+    counts = {"files": 0, "examined": 0, "vanished": 0}
+
+    def flush(batch, pool):
+        manifest.executemany("INSERT OR IGNORE INTO seen (path) VALUES (?)", [(p,) for p, _, _ in batch])
+        changed = []
+        for relpath, size, mtime_ns in batch:
+            known = manifest.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (relpath,)).fetchone()
+            if rehash or known != (size, mtime_ns):
+                changed.append((relpath, size, mtime_ns))
+        results = pool.map(lambda item: examine_file(os.path.join(root, item[0]), item[0]), changed)
+        manifest.executemany(
+            """INSERT INTO files (path, size, mtime_ns, sha256, status) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,
+                   sha256 = excluded.sha256, status = excluded.status, checked_at = CURRENT_TIMESTAMP""",
+            [(p, size, mtime_ns, sha256, status) for (p, size, mtime_ns), (sha256, status) in zip(changed, results)],
+        )
+        manifest.commit()
+        counts["examined"] += len(changed)
+
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for entry in walk_files(root):
+            batch.append(entry)
+            counts["files"] += 1
+            if len(batch) >= BATCH_SIZE:
+                flush(batch, pool)
+                batch = []
+        if batch:
+            flush(batch, pool)
+
+    counts["vanished"] = manifest.execute(
+        "DELETE FROM files WHERE path NOT IN (SELECT path FROM seen)").rowcount
+    manifest.commit()
+    return counts
+
+
+# --- Records ---
+
+def _upload_relpaths(stored_path: str):
+    """Manifest keys a stored image path may live under (blob path, legacy path, bare filename)."""
+    normalized = stored_path.replace("\\", "/")
+    primary = os.path.relpath(resolve_path(stored_path, must_exist=False), UPLOAD_FOLDER).replace(os.sep, "/")
+    return [primary] if normalized.startswith("uploads/blobs/") else [primary, os.path.basename(normalized)]
+
+
+def check_records(conn, manifest):
+    """
+    Streams patients rows and checks every referenced eye image and report PDF.
+    Yields (kind, row id, report_id, detail) for each problem found.
+    """
+    def lookup(relpaths):
+        for relpath in relpaths:
+            row = manifest.execute("SELECT status FROM files WHERE path = ?", (relpath,)).fetchone()
+            if row:
+                return relpath, row[0]
+        return None, None
+
+    def reference(relpath, model_version=None):
+        paths = [relpath] + [f"{relpath}.{kind}.jpg" for kind in DERIVATIVES]
+        if model_version:
+            paths.append(attention_map_path(relpath, model_version))
+        manifest.executemany("INSERT OR IGNORE INTO referenced (path) VALUES (?)", [(p,) for p in paths])
+
+    # Databases older than migrations 6/7 lack these columns; they read as NULL
+    present = {row[1] for row in conn.execute("PRAGMA table_info(patients)")}
+    optional = [column if column in present else f"NULL AS {column}"
+                for column in ("report_filename", "model_version")]
+    cur = conn.execute(f"SELECT id, report_id, {optional[0]}, left_eye_path, right_eye_path, {optional[1]} "
+                       "FROM patients")
+    for row_id, report_id, report_filename, left, right, model_version in cur:
+        for eye, stored in (("left", left), ("right", right)):
+            if not stored:
+                yield "missing_images", row_id, report_id, f"no {eye} eye path recorded"
+                continue
+            if os.path.isabs(stored.replace("\\", "/")):
+                if not os.path.isfile(stored):
+                    yield "missing_images", row_id, report_id, f"{eye}: {stored}"
+                continue
+            relpath, status = lookup(_upload_relpaths(stored))
+            if relpath is None:
+                yield "missing_images", row_id, report_id, f"{eye}: {stored}"
+                continue
+            reference(relpath, model_version)
+            if status != "ok":
+                yield "corrupt_files", row_id, report_id, f"{relpath}: {status}"
+
+        sharded = os.path.relpath(report_pdf_path(report_id), UPLOAD_FOLDER).replace(os.sep, "/")
+        relpath, status = lookup([sharded, report_filename or f"{report_id}.pdf"])
+        if relpath is None:
+            yield "missing_pdfs", row_id, report_id, sharded
+            continue
+        reference(relpath)
+        if status != "ok":
+            yield "corrupt_files", row_id, report_id, f"{relpath}: {status}"
 
 
 def main():
-    print("DB:", DB)
-    print("Uploads:", os.path.abspath(UPLOAD_DIR))
-    files = set(os.listdir(UPLOAD_DIR)) if os.path.exists(UPLOAD_DIR) else set()
-    print("Number of files in uploads:", len(files))
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, patient_id, report_id, report_filename, created_at FROM patients ORDER BY created_at DESC")
-    rows = cur.fetchall()
-    missing = []
-    for r in rows:
-        rid = r["report_id"]
-        fname = r["report_filename"] if "report_filename" in r.keys() else None
-        expected = fname if fname else f"{rid}.pdf"
-        exists = expected in files
-        status = "OK" if exists else "MISSING"
-        print(f"id={r['id']:>3} name={r['name']:<20} report_id={rid} report_filename={fname} -> {status}")
-        if not exists:
-            missing.append((r["id"], r["name"], rid, expected))
-    print()
-    print("Total rows:", len(rows))
-    print("Missing files count:", len(missing))
-    if missing:
-        print("\nMissing rows (id, name, report_id, expected_filename):")
-        for x in missing:
-            print(" ", x)
-    conn.close()
+    parser = argparse.ArgumentParser(description="Check records.db against the files in uploads/")
+    parser.add_argument("--db", type=str, default=DB_PATH, help="Path to records.db")
+    parser.add_argument("--manifest", type=str, default=MANIFEST_PATH, help="Path to the manifest database")
+    parser.add_argument("--rehash", action="store_true", help="Re-examine every file, not only changed ones")
+    parser.add_argument("--workers", type=int, default=4, help="Threads hashing changed files")
+    parser.add_argument("--json", type=str, default=None, help="Write a JSON summary to this file ('-' for stdout)")
+    parser.add_argument("--quiet", action="store_true", help="Do not print one line per problem")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    out = sys.stderr if args.json == "-" else sys.stdout
+    if not os.path.isfile(args.db):
+        print(f"❌ No database at {args.db}", file=out)
+        sys.exit(1)
+    manifest = open_manifest(args.manifest)
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    try:
+        schema = get_schema_version(conn)
+        print(f"Database: {args.db} (schema v{schema}"
+              f"{'' if schema >= SCHEMA_VERSION else f', behind v{SCHEMA_VERSION}: run db_init.py to upgrade'})",
+              file=out)
+        scan = scan_uploads(manifest, rehash=args.rehash, workers=args.workers)
+        print(f"Uploads: {UPLOAD_FOLDER} ({scan['files']} files, {scan['examined']} examined, "
+              f"{scan['vanished']} vanished since last run)", file=out)
+
+        problems = {"missing_images": [], "missing_pdfs": [], "corrupt_files": [], "orphans": []}
+        counts = dict.fromkeys(problems, 0)
+        sweepable = 0  # orphans blob_store.py --sweep can delete
+        for kind, row_id, report_id, detail in check_records(conn, manifest):
+            counts[kind] += 1
+            if len(problems[kind]) < MAX_LISTED:
+                problems[kind].append({"id": row_id, "report_id": report_id, "detail": detail})
+            if not args.quiet:
+                print(f"❌ {kind:<15} id={row_id} report_id={report_id} {detail}", file=out)
+        rows = conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+
+        cur = manifest.execute("SELECT path, status FROM files WHERE path NOT IN (SELECT path FROM referenced)")
+        for relpath, status in cur:
+            counts["orphans"] += 1
+            sweepable += relpath.startswith(("blobs/", "reports/"))
+            if len(problems["orphans"]) < MAX_LISTED:
+                problems["orphans"].append({"path": relpath, "status": status})
+            if not args.quiet:
+                print(f"⚠️ orphan          {relpath}", file=out)
+        manifest.commit()
+    finally:
+        conn.close()
+        manifest.close()
+
+    elapsed = time.perf_counter() - start
+    ok = not (counts["missing_images"] or counts["corrupt_files"])
+    print(f"{'✅' if ok else '❌'} {rows} rows: {counts['missing_images']} missing images, "
+          f"{counts['missing_pdfs']} missing PDFs, {counts['corrupt_files']} corrupt files, "
+          f"{counts['orphans']} orphans ({elapsed:.1f}s)", file=out)
+    if counts["missing_pdfs"]:
+        print("  ↳ Missing PDFs can be rebuilt with: python regenerate_reports.py --missing", file=out)
+    if sweepable:
+        print(f"  ↳ {sweepable} orphans under uploads/blobs and uploads/reports can be removed with: "
+              "python blob_store.py --gc --sweep", file=out)
+
+    if args.json:
+        summary = {
+            "ok": ok, "rows": rows, "schema_version": schema, "elapsed_s": round(elapsed, 3), "scan": scan,
+            "counts": counts, "problems": problems, "max_listed": MAX_LISTED,
+        }
+        if args.json == "-":
+            json.dump(summary, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(summary, f, indent=2)
+    sys.exit(0 if ok else 1)
+
 
 if __name__ == '__main__':
     main()
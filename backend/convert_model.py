@@ -1,13 +1,180 @@
-import tensorflow as tf
+# backend/convert_model.py
+# Converts the trained model into the formats the server can load:
+#   (default)  models/best_model.h5 -> models/best_model.keras
+#   --mmap     -> models/best_model.mmap.json + models/best_model.mmap-<hash>.bin:
+#              the architecture and a weight index in JSON, and every weight
+#              array stored raw in one flat file that backend_utils maps into
+#              memory instead of parsing (see load_mmap_model)
+#   --float16  stores the mmap weights as float16: half the file and page cache,
+#              widened back to float32 when loaded
+#   --savedmodel  -> models/best_model_savedmodel/ (TensorFlow SavedModel)
+#   --tflite float32|float16|dynamic  -> models/best_model[.fp16|.dynamic].tflite:
+#              TFLite flatbuffers, optionally with float16 or dynamic-range int8 weights
+# Options can be combined; bench_model_formats.py compares whatever was created.
+#
+# The weight file is named after its content and the index is replaced last,
+# so a server loading or reloading the model never sees a half-written pair.
+# Serve the mmap model with VISIONAI_MODEL_PATH=models/best_model.mmap.json.
+#
+# Usage: python convert_model.py [--source models/best_model.h5] [--mmap [--float16]]
+#                                [--savedmodel] [--tflite float32 --tflite dynamic ...]
+import argparse
+import glob
+import hashlib
+import json
 import os
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from backend_utils import MMAP_ALIGNMENT, MMAP_FORMAT, MMAP_INDEX_SUFFIX, load_mmap_model
 
-BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # goes to project root
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # goes to project root
 old_model_path = os.path.join(BASE_DIR, "models", "best_model.h5")
 new_model_path = os.path.join(BASE_DIR, "models", "best_model.keras")
+mmap_index_path = os.path.join(BASE_DIR, "models", "best_model" + MMAP_INDEX_SUFFIX)
+savedmodel_path = os.path.join(BASE_DIR, "models", "best_model_savedmodel")
+tflite_paths = {
+    "float32": os.path.join(BASE_DIR, "models", "best_model.tflite"),
+    "float16": os.path.join(BASE_DIR, "models", "best_model.fp16.tflite"),
+    "dynamic": os.path.join(BASE_DIR, "models", "best_model.dynamic.tflite"),
+}
+
+
+def _write_atomic(path, write):
+    """Writes a file through a temporary file and os.replace, so readers see the old or the new file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_mmap_model(model, index_path: str, float16: bool = False) -> str:
+    """
+    Writes a model in the memory-mappable format read by backend_utils.load_mmap_model.
+
+    Args:
+        model (Model): The model to write.
+        index_path (str): Path of the <name>.mmap.json index to create.
+        float16 (bool, optional): Store floating-point weights as float16.
+
+    Returns:
+        str: Path of the weight file.
+    """
+    stem = os.path.basename(index_path)[:-len(MMAP_INDEX_SUFFIX)]
+    entries, chunks, offset = [], [], 0
+    for weight in model.get_weights():
+        array = np.ascontiguousarray(weight)
+        if float16 and np.issubdtype(array.dtype, np.floating):
+            array = array.astype(np.float16)
+        padding = -offset % MMAP_ALIGNMENT
+        chunks.append(b"\0" * padding)
+        offset += padding
+        entries.append({"shape": list(array.shape), "dtype": array.dtype.str, "offset": offset})
+        chunks.append(array.tobytes())
+        offset += array.nbytes
+
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    data_name = f"{stem}.mmap-{digest.hexdigest()[:10]}.bin"
+    data_path = os.path.join(os.path.dirname(index_path), data_name)
+    previous = None
+    if os.path.isfile(index_path):
+        with open(index_path, "r") as f:
+            previous = json.load(f).get("data")
+
+    _write_atomic(data_path, lambda f: f.writelines(chunks))
+    index = {"format": MMAP_FORMAT, "data": data_name, "float16": float16, "size": offset,
+             "model": json.loads(model.to_json()), "weights": entries}
+    _write_atomic(index_path, lambda f: f.write(json.dumps(index).encode("utf-8")))
+
+    # Keep the previous weight file: a process may still be loading the previous index
+    for path in glob.glob(os.path.join(os.path.dirname(index_path), f"{stem}.mmap-*.bin")):
+        if os.path.basename(path) not in (data_name, previous):
+            os.remove(path)
+    return data_path
+
+
+def export_savedmodel(model, path: str):
+    """Writes a TensorFlow SavedModel directory with a serving_default signature."""
+    if hasattr(model, "export"):  # Keras 3: model.save only writes .keras files
+        model.export(path)
+    else:
+        tf.saved_model.save(model, path)
+
+
+def export_tflite(model, path: str, quantization: str = "float32"):
+    """
+    Writes a TFLite flatbuffer.
+
+    Args:
+        model (Model): The model to convert.
+        path (str): Output .tflite file.
+        quantization (str, optional): "float32" (none), "float16" (float16
+            weights) or "dynamic" (int8 weights, float32 activations).
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ("float16", "dynamic"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    flatbuffer = converter.convert()
+    _write_atomic(path, lambda f: f.write(flatbuffer))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the trained model to .keras, mmap, SavedModel or TFLite")
+    parser.add_argument("--source", type=str, default=old_model_path, help="Model to convert")
+    parser.add_argument("--mmap", action="store_true", help=f"Write {mmap_index_path} and its weight file")
+    parser.add_argument("--float16", action="store_true", help="Store the mmap weights as float16")
+    parser.add_argument("--savedmodel", action="store_true", help=f"Write {savedmodel_path}")
+    parser.add_argument("--tflite", action="append", choices=sorted(tflite_paths), default=[],
+                        help="Write a TFLite model with this quantization (repeatable)")
+    args = parser.parse_args()
+
+    print("Loading old model...")
+    model = tf.keras.models.load_model(args.source, compile=False)
+
+    if not (args.mmap or args.savedmodel or args.tflite):
+        print("Saving in new format...")
+        model.save(new_model_path)
+        print("✅ Conversion complete:", new_model_path)
+        return
+
+    if args.mmap:
+        print(f"Saving in mmap format ({'float16' if args.float16 else 'float32'} weights)...")
+        data_path = save_mmap_model(model, mmap_index_path, float16=args.float16)
+        print(f"✅ Conversion complete: {mmap_index_path} + {os.path.basename(data_path)} "
+              f"({os.path.getsize(data_path) / 1e6:.1f} MB)")
+
+        # The converted model must predict what the source model does
+        batch = np.random.default_rng(0).random((8, *model.input_shape[1:]), dtype=np.float32)
+        expected = np.asarray(model(batch, training=False))
+        actual = np.asarray(load_mmap_model(mmap_index_path)(batch, training=False))
+        agreement = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+        print(f"   ↳ Max probability difference {np.abs(expected - actual).max():.2e}, "
+              f"class agreement {agreement:.0%} on {len(batch)} random images")
+
+    if args.savedmodel:
+        print("Saving as SavedModel...")
+        export_savedmodel(model, savedmodel_path)
+        print("✅ Conversion complete:", savedmodel_path)
+
+    for quantization in args.tflite:
+        print(f"Converting to TFLite ({quantization})...")
+        export_tflite(model, tflite_paths[quantization], quantization)
+        print(f"✅ Conversion complete: {tflite_paths[quantization]} "
+              f"({os.path.getsize(tflite_paths[quantization]) / 1e6:.1f} MB)")
 
-print("Loading old model...")
-model = tf.keras.models.load_model(old_model_path, compile=False)
 
-print("Saving in new format...")
-model.save(new_model_path)
-print("✅ Conversion complete:", new_model_path)
+if __name__ == "__main__":
+    main()
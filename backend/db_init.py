@@ -49,8 +49,375 @@ import os
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "records.db")
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
+
+def add_column_if_missing(table, column, declaration):
+    """
+    Migration step that adds a column unless it already exists, for columns
+    some older records.db files gained by hand (ALTER TABLE ADD COLUMN has no
+    IF NOT EXISTS form).
+    """
+    def step(conn):
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return step
+
+
+# Rebuilds screening_stats from patients; shared by migration 3 and
+# screening_stats.py --backfill.
+STATS_BACKFILL_SQL = """
+    INSERT INTO screening_stats (doctor_id, month, combined_result, total)
+    SELECT COALESCE(doctor_id, 0), COALESCE(strftime('%Y-%m', created_at), 'unknown'),
+           COALESCE(combined_result, 'Unknown'), COUNT(*)
+    FROM patients
+    GROUP BY 1, 2, 3
+"""
+
+
+# --- Schema Migrations ---
+# Each migration is (version, description, statements). A statement is an SQL
+# string or a callable taking the connection. The version that has
+# been applied to a database file is tracked in SQLite's `PRAGMA user_version`,
+# so existing records.db files are upgraded in place and never re-migrated.
+# Append new migrations to the end of the list; never edit an applied one.
+MIGRATIONS = [
+    (1, "Indexes for the doctor/patient dashboard and report lookups", [
+        # /dashboard: WHERE doctor_id = ? ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_patients_doctor_created ON patients (doctor_id, created_at)",
+        # /patient_dashboard: WHERE patient_id = ? ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_patients_patient_created ON patients (patient_id, created_at)",
+        # /report, /patient_report, regenerate_one_report.py: WHERE report_id = ?
+        "CREATE INDEX IF NOT EXISTS idx_patients_report_id ON patients (report_id)",
+    ]),
+    (2, "Case-insensitive username index for the patient login", [
+        # /patient_login: WHERE lower(username) = ? AND role = 'patient'
+        "CREATE INDEX IF NOT EXISTS idx_users_lower_username_role ON users (lower(username), role)",
+    ]),
+    (3, "Trigger-maintained screening statistics summary table", [
+        # One row per (doctor, month, combined_result) holding the number of records
+        """
+        CREATE TABLE IF NOT EXISTS screening_stats (
+            doctor_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            combined_result TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (doctor_id, month, combined_result)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_stats_insert AFTER INSERT ON patients
+        BEGIN
+            INSERT INTO screening_stats (doctor_id, month, combined_result, total)
+            VALUES (COALESCE(NEW.doctor_id, 0), COALESCE(strftime('%Y-%m', NEW.created_at), 'unknown'),
+                    COALESCE(NEW.combined_result, 'Unknown'), 1)
+            ON CONFLICT (doctor_id, month, combined_result) DO UPDATE SET total = total + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_stats_delete AFTER DELETE ON patients
+        BEGIN
+            UPDATE screening_stats SET total = total - 1
+            WHERE doctor_id = COALESCE(OLD.doctor_id, 0)
+              AND month = COALESCE(strftime('%Y-%m', OLD.created_at), 'unknown')
+              AND combined_result = COALESCE(OLD.combined_result, 'Unknown');
+            DELETE FROM screening_stats
+            WHERE doctor_id = COALESCE(OLD.doctor_id, 0)
+              AND month = COALESCE(strftime('%Y-%m', OLD.created_at), 'unknown')
+              AND combined_result = COALESCE(OLD.combined_result, 'Unknown') AND total <= 0;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_stats_update
+        AFTER UPDATE OF doctor_id, created_at, combined_result ON patients
+        BEGIN
+            UPDATE screening_stats SET total = total - 1
+            WHERE doctor_id = COALESCE(OLD.doctor_id, 0)
+              AND month = COALESCE(strftime('%Y-%m', OLD.created_at), 'unknown')
+              AND combined_result = COALESCE(OLD.combined_result, 'Unknown');
+            INSERT INTO screening_stats (doctor_id, month, combined_result, total)
+            VALUES (COALESCE(NEW.doctor_id, 0), COALESCE(strftime('%Y-%m', NEW.created_at), 'unknown'),
+                    COALESCE(NEW.combined_result, 'Unknown'), 1)
+            ON CONFLICT (doctor_id, month, combined_result) DO UPDATE SET total = total + 1;
+            DELETE FROM screening_stats
+            WHERE doctor_id = COALESCE(OLD.doctor_id, 0)
+              AND month = COALESCE(strftime('%Y-%m', OLD.created_at), 'unknown')
+              AND combined_result = COALESCE(OLD.combined_result, 'Unknown') AND total <= 0;
+        END
+        """,
+        # Seed the table from the rows that existed before the triggers
+        "DELETE FROM screening_stats",
+        STATS_BACKFILL_SQL,
+    ]),
+    (4, "FTS5 full-text index over patient names, IDs, medications and conditions", [
+        # External-content table: stores only the index, rows are read from patients
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+            name, patient_id, medications, other_conditions,
+            content='patients', content_rowid='id', prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_insert AFTER INSERT ON patients
+        BEGIN
+            INSERT INTO patients_fts (rowid, name, patient_id, medications, other_conditions)
+            VALUES (NEW.id, NEW.name, NEW.patient_id, NEW.medications, NEW.other_conditions);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_delete AFTER DELETE ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, name, patient_id, medications, other_conditions)
+            VALUES ('delete', OLD.id, OLD.name, OLD.patient_id, OLD.medications, OLD.other_conditions);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_fts_update
+        AFTER UPDATE OF name, patient_id, medications, other_conditions ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, name, patient_id, medications, other_conditions)
+            VALUES ('delete', OLD.id, OLD.name, OLD.patient_id, OLD.medications, OLD.other_conditions);
+            INSERT INTO patients_fts (rowid, name, patient_id, medications, other_conditions)
+            VALUES (NEW.id, NEW.name, NEW.patient_id, NEW.medications, NEW.other_conditions);
+        END
+        """,
+        # Index the rows that existed before the triggers
+        "INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')",
+    ]),
+    (5, "Reference-counted content-addressed blob store for uploads", [
+        # One row per stored image; refcount = number of patients columns pointing at it
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            path TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            size INTEGER,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_blobs_refcount ON blobs (refcount)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_blobs_insert AFTER INSERT ON patients
+        BEGIN
+            UPDATE blobs SET refcount = refcount + 1 WHERE path = NEW.left_eye_path;
+            UPDATE blobs SET refcount = refcount + 1 WHERE path = NEW.right_eye_path;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_blobs_delete AFTER DELETE ON patients
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE path = OLD.left_eye_path;
+            UPDATE blobs SET refcount = refcount - 1 WHERE path = OLD.right_eye_path;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_blobs_update
+        AFTER UPDATE OF left_eye_path, right_eye_path ON patients
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE path = OLD.left_eye_path;
+            UPDATE blobs SET refcount = refcount - 1 WHERE path = OLD.right_eye_path;
+            UPDATE blobs SET refcount = refcount + 1 WHERE path = NEW.left_eye_path;
+            UPDATE blobs SET refcount = refcount + 1 WHERE path = NEW.right_eye_path;
+        END
+        """,
+    ]),
+    (6, "Model version and rendered-PDF fingerprint on patient records", [
+        # Model that produced left/right/combined_result (backend_utils.get_model_version)
+        "ALTER TABLE patients ADD COLUMN model_version TEXT",
+        # Fingerprint of the inputs the cached PDF was rendered from (report_delivery.py)
+        "ALTER TABLE patients ADD COLUMN report_render_key TEXT",
+    ]),
+    (7, "report_filename column used by the report regeneration tools", [
+        # Older databases already have it (added by hand); fresh ones do not
+        add_column_if_missing("patients", "report_filename", "TEXT"),
+    ]),
+    (8, "camp_jobs table tracking bulk screening-camp uploads", [
+        """
+        CREATE TABLE IF NOT EXISTS camp_jobs (
+            id TEXT PRIMARY KEY,
+            doctor_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total_rows INTEGER NOT NULL DEFAULT 0,
+            predicted INTEGER NOT NULL DEFAULT 0,
+            inserted INTEGER NOT NULL DEFAULT 0,
+            pdfs_done INTEGER NOT NULL DEFAULT 0,
+            errors TEXT NOT NULL DEFAULT '[]',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (doctor_id) REFERENCES users (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_camp_jobs_doctor_created ON camp_jobs(doctor_id, created_at)",
+    ]),
+    (9, "api_tokens table for the /api/v1 inference API", [
+        """
+        CREATE TABLE IF NOT EXISTS api_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            token_hash TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            revoked_at TIMESTAMP
+        )
+        """,
+    ]),
+    (10, "Per-eye image quality scores on patient records", [
+        # JSON from image_quality.assess_image: scores, passed and reasons (NULL if not checked)
+        "ALTER TABLE patients ADD COLUMN left_image_quality TEXT",
+        "ALTER TABLE patients ADD COLUMN right_image_quality TEXT",
+    ]),
+    (11, "Doctor-confirmed grades on patient records", [
+        # Grade the doctor confirmed or corrected per eye (a class_indices.json label,
+        # NULL if not confirmed); finetune_head.py trains on these
+        "ALTER TABLE patients ADD COLUMN left_confirmed TEXT",
+        "ALTER TABLE patients ADD COLUMN right_confirmed TEXT",
+        "ALTER TABLE patients ADD COLUMN confirmed_at TIMESTAMP",
+        "CREATE INDEX IF NOT EXISTS idx_patients_confirmed_at ON patients (confirmed_at) "
+        "WHERE confirmed_at IS NOT NULL",
+    ]),
+    (12, "Perceptual hashes of eye images for near-duplicate detection", [
+        # One row per record and eye; phash split into 16-bit bands, each indexed
+        # with the doctor: a multi-index hash table (near_duplicates.py)
+        """
+        CREATE TABLE IF NOT EXISTS image_phashes (
+            record_id INTEGER NOT NULL,
+            eye TEXT NOT NULL,
+            doctor_id INTEGER,
+            phash INTEGER NOT NULL,
+            band0 INTEGER NOT NULL,
+            band1 INTEGER NOT NULL,
+            band2 INTEGER NOT NULL,
+            band3 INTEGER NOT NULL,
+            PRIMARY KEY (record_id, eye)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_image_phashes_band0 ON image_phashes (doctor_id, band0)",
+        "CREATE INDEX IF NOT EXISTS idx_image_phashes_band1 ON image_phashes (doctor_id, band1)",
+        "CREATE INDEX IF NOT EXISTS idx_image_phashes_band2 ON image_phashes (doctor_id, band2)",
+        "CREATE INDEX IF NOT EXISTS idx_image_phashes_band3 ON image_phashes (doctor_id, band3)",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_phashes_delete AFTER DELETE ON patients
+        BEGIN
+            DELETE FROM image_phashes WHERE record_id = OLD.id;
+        END
+        """,
+        # A record's images changed: its hashes are stale (near_duplicates.py --backfill re-hashes)
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_phashes_update
+        AFTER UPDATE OF left_eye_path, right_eye_path, doctor_id ON patients
+        BEGIN
+            DELETE FROM image_phashes WHERE record_id = OLD.id;
+        END
+        """,
+    ]),
+    (13, "Pending references on blobs held by uploads not yet saved", [
+        # Taken by store_stream(conn=...) before the file is put in place and
+        # released by register_blob or discard_blob, so a blob is only deleted
+        # when neither a record nor an in-flight upload holds it
+        "ALTER TABLE blobs ADD COLUMN pending INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE blobs ADD COLUMN pending_at TIMESTAMP",
+    ]),
+    (14, "Resumable camp jobs: stored manifest and a heartbeat", [
+        # payload: JSON of the parsed manifest rows and the extracted images, so
+        # any process can restart a job whose worker died (camp_upload.py);
+        # heartbeat_at is bumped with every progress update
+        "ALTER TABLE camp_jobs ADD COLUMN payload TEXT",
+        "ALTER TABLE camp_jobs ADD COLUMN heartbeat_at TIMESTAMP",
+    ]),
+    (15, "Doctor-scoped full-text index: patients_fts with a doctor token column", [
+        # The doctor column holds "d<doctor_id>", so search_patients ANDs it into
+        # the MATCH and bm25 only scores the doctor's own rows. patients has no
+        # such column, so the index is contentless (content='') and the triggers
+        # pass the old values to 'delete'; rows are read by rowid from patients.
+        # detail=column drops token positions, which single-word prefix terms
+        # never need, and halves the doclists a broad query reads.
+        "DROP TRIGGER IF EXISTS trg_patients_fts_insert",
+        "DROP TRIGGER IF EXISTS trg_patients_fts_delete",
+        "DROP TRIGGER IF EXISTS trg_patients_fts_update",
+        "DROP TABLE IF EXISTS patients_fts",
+        """
+        CREATE VIRTUAL TABLE patients_fts USING fts5(
+            name, patient_id, medications, other_conditions, doctor,
+            content='', prefix='2 3', detail=column
+        )
+        """,
+        """
+        CREATE TRIGGER trg_patients_fts_insert AFTER INSERT ON patients
+        BEGIN
+            INSERT INTO patients_fts (rowid, name, patient_id, medications, other_conditions, doctor)
+            VALUES (NEW.id, NEW.name, NEW.patient_id, NEW.medications, NEW.other_conditions, 'd' || NEW.doctor_id);
+        END
+        """,
+        """
+        CREATE TRIGGER trg_patients_fts_delete AFTER DELETE ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, name, patient_id, medications, other_conditions, doctor)
+            VALUES ('delete', OLD.id, OLD.name, OLD.patient_id, OLD.medications, OLD.other_conditions,
+                    'd' || OLD.doctor_id);
+        END
+        """,
+        """
+        CREATE TRIGGER trg_patients_fts_update
+        AFTER UPDATE OF name, patient_id, medications, other_conditions, doctor_id ON patients
+        BEGIN
+            INSERT INTO patients_fts (patients_fts, rowid, name, patient_id, medications, other_conditions, doctor)
+            VALUES ('delete', OLD.id, OLD.name, OLD.patient_id, OLD.medications, OLD.other_conditions,
+                    'd' || OLD.doctor_id);
+            INSERT INTO patients_fts (rowid, name, patient_id, medications, other_conditions, doctor)
+            VALUES (NEW.id, NEW.name, NEW.patient_id, NEW.medications, NEW.other_conditions, 'd' || NEW.doctor_id);
+        END
+        """,
+        """
+        INSERT INTO patients_fts (rowid, name, patient_id, medications, other_conditions, doctor)
+        SELECT id, name, patient_id, medications, other_conditions, 'd' || doctor_id FROM patients
+        """,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Returns the migration version currently applied to `conn`."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_db(conn):
+    """
+    Applies every pending migration to an open connection.
+    Each migration runs in its own transaction together with the
+    `user_version` bump, so an interrupted upgrade can simply be re-run.
+    The version is re-read under the write lock, so processes migrating the
+    same file at once (e.g. several ASGI workers starting) apply each
+    migration only once.
+    Returns the list of versions that were applied.
+    """
+    applied = []
+    current = get_schema_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if get_schema_version(conn) >= version:
+                conn.rollback()  # another process applied it meanwhile
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            # PRAGMA does not accept bound parameters; version is an int from MIGRATIONS
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        print(f"  ↳ Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+def create_tables(conn):
+    """Creates the base (version 0) tables if they do not exist yet."""
     c = conn.cursor()
 
     # Create a comprehensive 'users' table for both doctors and patients
@@ -97,8 +464,17 @@ def init_db():
     """)
 
     conn.commit()
-    conn.close()
-    print("✅ Initialized Upgraded DB at:", DB_PATH)
+
+
+def init_db(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path)
+    try:
+        create_tables(conn)
+        migrate_db(conn)
+        version = get_schema_version(conn)
+    finally:
+        conn.close()
+    print(f"✅ Initialized Upgraded DB (schema v{version}) at:", db_path)
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    init_db()
@@ -0,0 +1,490 @@
+# backend/embedding_index.py
+# Similar-case retrieval: the prior fundus images closest to a case, by the
+# model's own view of them.
+#
+# Every graded eye's embedding (the input of the softmax head: the Dense(1024)
+# activations of build_vgg16_model, see backend_utils.build_embedding_model)
+# is L2-normalised and appended to an append-only float16 matrix on disk. There
+# is one store per model version, as embeddings of different models are not
+# comparable:
+#   embeddings/<model tag>/vectors.f16    n x dim float16 rows
+#   embeddings/<model tag>/rows.bin       n ROW_DTYPE entries: patients.id, doctor_id, eye
+#   embeddings/<model tag>/ivf.npz        optional IVF partitioning (build-ivf)
+#   embeddings/<model tag>/ivf-<n>.f32    the rows it indexes, projected, list by list
+# Appends take a file lock and write the vectors before the row entries, so a
+# reader never sees a row without its vector; an append cut short by a crash is
+# truncated by the next one.
+#
+# Searches are scoped to one doctor's cases and rank by cosine similarity:
+#   - exact: the doctor's rows, scored in float32 chunks. Used when there is no
+#     IVF, for a doctor with at most EXACT_MAX indexed rows, and for the rows
+#     appended since the IVF was built.
+#   - IVF: build-ivf projects the rows to PROJ_DIM dimensions (PCA), clusters
+#     them into nlist lists (k-means) and stores the projected rows list by
+#     list. A query scans the doctor's rows in the lists closest to it -
+#     proportionally more lists the smaller the doctor's share of the index,
+#     so about nprobe lists' worth of rows are scanned for any doctor - and
+#     re-ranks the best RERANK * k on the full float16 vectors.
+# Rebuild the IVF (cron) when `stats` shows many unindexed rows: those are
+# scored exactly on every query.
+#
+# Usage:
+#   python embedding_index.py backfill [--db records.db] [--model models/best_model.keras]
+#   python embedding_index.py build-ivf [--nlist 1024] [--model ...]
+#   python embedding_index.py stats [--model ...]
+import argparse
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl  # appends from several worker processes (serve.py)
+except ImportError:
+    fcntl = None
+
+from attention_maps import model_tag
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBEDDINGS_DIR = os.path.join(BASE_DIR, "embeddings")
+EYES = ("left", "right")
+ROW_DTYPE = np.dtype([("record", "<i8"), ("doctor", "<i4"), ("eye", "u1"), ("pad", "V3")])
+
+EXACT_MAX = 8192      # doctor rows scored exactly even when there is an IVF (~30 ms)
+EXACT_CHUNK = 4096    # float16 rows widened to float32 at a time
+PROJ_DIM = 128
+RERANK = 8            # IVF candidates re-ranked on the full vectors, per result
+DEFAULT_NPROBE = 16
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class _FileLock:
+    """Exclusive lock on a store's directory across processes (a no-op without fcntl)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+
+class EmbeddingStore:
+    """The append-only embeddings of one model version, with its optional IVF."""
+
+    def __init__(self, directory, model_version=None):
+        self.directory = directory
+        self.model_version = model_version
+        self.vectors_path = os.path.join(directory, "vectors.f16")
+        self.rows_path = os.path.join(directory, "rows.bin")
+        self.ivf_path = os.path.join(directory, "ivf.npz")
+        self.lock = threading.Lock()
+        self.dim = None
+        # (vectors, records, doctors, eyes) of the rows mapped so far, replaced as a whole
+        self._rows = (None, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint8))
+        self._ivf = None
+        self._ivf_mtime = None
+        self._read_meta()
+
+    def _read_meta(self):
+        meta = os.path.join(self.directory, "meta.json")
+        if os.path.isfile(meta):
+            with open(meta, "r") as f:
+                self.dim = json.load(f)["dim"]
+
+    # --- Appending ---
+
+    def append(self, record_id: int, doctor_id: int, eyes, embeddings):
+        """
+        Adds the embeddings of a record's eyes.
+
+        Args:
+            record_id (int): patients.id of the record.
+            doctor_id (int): Its doctor; searches only return a doctor's own cases.
+            eyes (list): "left"/"right" for each embedding.
+            embeddings (np.ndarray): Shape (len(eyes), dim), as returned by the model.
+        """
+        self.append_rows([record_id] * len(eyes), [doctor_id] * len(eyes), eyes, embeddings)
+
+    def append_rows(self, record_ids, doctor_ids, eyes, embeddings):
+        """Adds embeddings of any records in one append; one record id, doctor id and eye per row."""
+        vectors = normalize(embeddings).astype(np.float16)
+        rows = np.zeros(len(vectors), dtype=ROW_DTYPE)
+        rows["record"], rows["doctor"] = record_ids, doctor_ids
+        rows["eye"] = [EYES.index(eye) for eye in eyes]
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock, _FileLock(os.path.join(self.directory, ".lock")):
+            if self.dim is None:
+                self._read_meta()  # another process may have created the store since
+            if self.dim is None:
+                self._write_meta(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"embedding dimension {vectors.shape[1]} != store dimension {self.dim}")
+            count = self._stored_count()
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(count * self.dim * 2)  # drop a partial append of a crashed writer
+                f.write(vectors.tobytes())
+                f.flush()
+            with open(self.rows_path, "ab") as f:
+                f.truncate(count * ROW_DTYPE.itemsize)
+                f.write(rows.tobytes())
+                f.flush()
+
+    def _write_meta(self, dim):
+        meta = os.path.join(self.directory, "meta.json")
+        with open(meta + ".tmp", "w") as f:
+            json.dump({"model": self.model_version, "dim": dim}, f)
+        os.replace(meta + ".tmp", meta)
+        self.dim = dim
+
+    def _stored_count(self) -> int:
+        """Rows whose vector and row entry are both complete."""
+        if self.dim is None or not os.path.isfile(self.rows_path) or not os.path.isfile(self.vectors_path):
+            return 0
+        return min(os.path.getsize(self.rows_path) // ROW_DTYPE.itemsize,
+                   os.path.getsize(self.vectors_path) // (self.dim * 2))
+
+    # --- Reading ---
+
+    def refresh(self):
+        """
+        Maps the rows appended (by any process) since the last call.
+
+        Returns:
+            tuple: (vectors, records, doctors, eyes) of every stored row; vectors is None if there are none.
+        """
+        with self.lock:
+            vectors, records, doctors, eyes = self._rows
+            if self.dim is None:
+                self._read_meta()
+            if self.dim is None:
+                return self._rows
+            count = self._stored_count()
+            known = len(records) if count >= len(records) else 0
+            if count != len(records):
+                rows = np.fromfile(self.rows_path, dtype=ROW_DTYPE, count=count - known,
+                                   offset=known * ROW_DTYPE.itemsize)
+                records = np.concatenate([records[:known], rows["record"]])
+                doctors = np.concatenate([doctors[:known], rows["doctor"]])
+                eyes = np.concatenate([eyes[:known], rows["eye"]])
+                vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r",
+                                    shape=(count, self.dim)) if count else None
+                self._rows = (vectors, records, doctors, eyes)
+            return self._rows
+
+    def record_vectors(self, record_id: int):
+        """The stored (eye, normalised vector) pairs of a record."""
+        vectors, records, _, eyes = self.refresh()
+        # Both eyes of a record are appended together: keep the latest append
+        latest = {}
+        for position in np.flatnonzero(records == record_id):
+            latest[EYES[eyes[position]]] = position
+        return [(eye, np.asarray(vectors[position], dtype=np.float32)) for eye, position in latest.items()]
+
+    def indexed_records(self) -> set:
+        return set(self.refresh()[1].tolist())
+
+    def _load_ivf(self):
+        try:
+            mtime = os.stat(self.ivf_path).st_mtime_ns
+        except FileNotFoundError:
+            self._ivf = self._ivf_mtime = None
+            return None
+        if mtime != self._ivf_mtime:
+            with np.load(self.ivf_path) as data:
+                ivf = {key: data[key] for key in data.files}
+            ivf["count"] = int(ivf["count"])
+            ivf["projected"] = np.memmap(os.path.join(self.directory, str(ivf["data"])), dtype=np.float32,
+                                         mode="r", shape=(ivf["count"], ivf["components"].shape[0]))
+            self._ivf, self._ivf_mtime = ivf, mtime
+        return self._ivf
+
+    # --- Searching ---
+
+    @staticmethod
+    def _exact(vectors, query, positions):
+        scores = np.empty(len(positions), dtype=np.float32)
+        for start in range(0, len(positions), EXACT_CHUNK):
+            chunk = positions[start:start + EXACT_CHUNK]
+            scores[start:start + len(chunk)] = vectors[chunk].astype(np.float32) @ query
+        return scores
+
+    def _probe(self, ivf, query, doctor_id, k, nprobe):
+        """IVF candidates of a doctor: positions of the best RERANK * k rows in the closest lists."""
+        in_lists = np.flatnonzero(ivf["doctors"] == doctor_id)  # list order
+        if not len(in_lists):
+            return in_lists
+        nlist = len(ivf["centroids"])
+        share = len(in_lists) / ivf["count"]
+        probes = min(nlist, math.ceil(nprobe / share))
+        if probes < nlist:
+            residual = (query - ivf["mean"]) @ ivf["components"].T
+            distances = ((ivf["centroids"] - residual) ** 2).sum(axis=1)
+            selected = np.zeros(nlist, dtype=bool)
+            selected[np.argpartition(distances, probes - 1)[:probes]] = True
+            lists = np.searchsorted(ivf["offsets"], in_lists, side="right") - 1
+            in_lists = in_lists[selected[lists]]
+        # Projected scores differ from the full ones by a per-query constant
+        scores = ivf["projected"][in_lists] @ (ivf["components"] @ query)
+        keep = min(len(scores), RERANK * k)
+        best = np.argpartition(-scores, keep - 1)[:keep] if keep < len(scores) else np.arange(len(scores))
+        return ivf["order"][in_lists[best]]
+
+    def search(self, query, doctor_id: int, k: int = 10, exclude_record=None, nprobe: int = DEFAULT_NPROBE):
+        """
+        The doctor's stored rows most similar to a query embedding.
+
+        Args:
+            query (np.ndarray): An embedding, shape (dim,).
+            doctor_id (int): Only this doctor's rows are searched.
+            k (int, optional): Number of results. Defaults to 10.
+            exclude_record (int, optional): A record to leave out (the one being reviewed).
+            nprobe (int, optional): IVF lists' worth of rows to scan.
+
+        Returns:
+            list: (record id, eye, cosine similarity) tuples, most similar first.
+        """
+        vectors, records, doctors, eyes = self.refresh()
+        if vectors is None:
+            return []
+        query = normalize(query)[0]
+        ivf = self._load_ivf()
+        indexed = min(ivf["count"], len(records)) if ivf else 0
+        doctor_rows = np.flatnonzero(doctors == doctor_id)
+        if ivf and np.searchsorted(doctor_rows, indexed) > EXACT_MAX:
+            tail = doctor_rows[np.searchsorted(doctor_rows, indexed):]
+            positions = np.concatenate([np.sort(self._probe(ivf, query, doctor_id, k, nprobe)), tail])
+        else:
+            positions = doctor_rows
+        if exclude_record is not None:
+            positions = positions[records[positions] != exclude_record]
+        if not len(positions):
+            return []
+        scores = self._exact(vectors, query, positions)
+        order = np.argsort(-scores, kind="stable")
+        results, seen = [], set()
+        for i in order:
+            position = positions[i]
+            key = (int(records[position]), EYES[eyes[position]])
+            if key not in seen:  # a record appended twice (backfill during an upload)
+                seen.add(key)
+                results.append((*key, float(scores[i])))
+                if len(results) == k:
+                    break
+        return results
+
+    def similar_records(self, record_id: int, doctor_id: int, k: int = 10, nprobe: int = DEFAULT_NPROBE):
+        """
+        The doctor's other records most similar to either eye of a record.
+
+        Returns:
+            list: {"record", "eye", "query_eye", "score"} dicts, one per record, most similar first,
+            or None if the record has no stored embeddings.
+        """
+        vectors = self.record_vectors(record_id)
+        if not vectors:
+            return None
+        best = {}
+        for query_eye, vector in vectors:
+            # Extra hits: several of the nearest rows can be the two eyes of one record
+            for record, eye, score in self.search(vector, doctor_id, 2 * k, record_id, nprobe):
+                if record not in best or score > best[record]["score"]:
+                    best[record] = {"record": record, "eye": eye, "query_eye": query_eye, "score": round(score, 4)}
+        return sorted(best.values(), key=lambda hit: -hit["score"])[:k]
+
+    def stats(self) -> dict:
+        _, records, doctors, _ = self.refresh()
+        count = len(records)
+        ivf = self._load_ivf()
+        return {
+            "model": self.model_version, "dim": self.dim, "rows": count,
+            "records": int(len(np.unique(records))), "doctors": int(len(np.unique(doctors))),
+            "ivf_lists": int(len(ivf["centroids"])) if ivf else None,
+            "unindexed_rows": count - (min(ivf["count"], count) if ivf else 0),
+        }
+
+
+# --- IVF Build ---
+
+def _kmeans(points, nlist, iterations, rng):
+    """Lloyd's k-means; empty lists are reseeded with random points."""
+    centroids = points[rng.choice(len(points), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(points, centroids)
+        counts = np.bincount(assignment, minlength=nlist)
+        order = np.argsort(assignment, kind="stable")
+        empty = counts == 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        centroids[~empty] = np.add.reduceat(points[order], starts, axis=0) / counts[~empty, None]
+        centroids[empty] = points[rng.choice(len(points), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def _assign(points, centroids):
+    # argmin of ||x - c||^2 = ||c||^2 - 2 x.c (+ ||x||^2)
+    return np.argmin((centroids ** 2).sum(axis=1) - 2 * points @ centroids.T, axis=1)
+
+
+def build_ivf(store: EmbeddingStore, nlist: int = 1024, proj_dim: int = PROJ_DIM, sample: int = 64,
+              iterations: int = 10, seed: int = 0) -> dict:
+    """
+    Builds (or rebuilds) the store's IVF over all of its current rows.
+
+    Args:
+        store (EmbeddingStore): The store.
+        nlist (int, optional): Number of lists; capped for small stores.
+        proj_dim (int, optional): Dimensions of the projected rows. Defaults to PROJ_DIM.
+        sample (int, optional): Training rows per list for PCA and k-means.
+        iterations (int, optional): k-means iterations.
+
+    Returns:
+        dict: The store's stats afterwards.
+    """
+    vectors, _, doctors, _ = store.refresh()
+    count = len(doctors)
+    if count < proj_dim:
+        raise ValueError(f"only {count} rows stored; too few to index")
+    nlist = max(1, min(nlist, count // 39))  # at least ~39 training rows per list
+    rng = np.random.default_rng(seed)
+    training = vectors[np.sort(rng.choice(count, min(count, nlist * sample), replace=False))].astype(np.float32)
+
+    # PCA on the training rows, then k-means in the projected space
+    mean = training.mean(axis=0)
+    centered = training - mean
+    eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered)
+    components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :proj_dim].T)
+    explained = float(eigenvalues[::-1][:proj_dim].sum() / eigenvalues.sum())
+    centroids = _kmeans(centered @ components.T, nlist, iterations, rng)
+
+    stamp = f"ivf-{count}-{int(time.time())}.f32"
+    data_path = os.path.join(store.directory, stamp)
+    projected = np.lib.format.open_memmap(data_path + ".tmp.npy", mode="w+", dtype=np.float32,
+                                          shape=(count, proj_dim))
+    assignment = np.empty(count, dtype=np.int32)
+    for start in range(0, count, 65536):
+        chunk = (vectors[start:start + 65536].astype(np.float32) - mean) @ components.T
+        projected[start:start + len(chunk)] = chunk
+        assignment[start:start + len(chunk)] = _assign(chunk, centroids)
+    order = np.argsort(assignment, kind="stable").astype(np.int64)
+    with open(data_path, "wb") as f:
+        for start in range(0, count, 65536):
+            f.write(np.ascontiguousarray(projected[order[start:start + 65536]]).tobytes())
+    del projected
+    os.remove(data_path + ".tmp.npy")
+
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+    tmp_path = store.ivf_path + ".tmp.npz"
+    np.savez(tmp_path, count=count, data=stamp, mean=mean, components=components,
+             centroids=centroids.astype(np.float32), offsets=offsets, order=order,
+             doctors=doctors[order])
+    os.replace(tmp_path, store.ivf_path)
+    # Processes still searching the previous IVF keep their mapping of its data file
+    for old in glob.glob(os.path.join(store.directory, "ivf-*.f32")):
+        if os.path.basename(old) != stamp:
+            os.remove(old)
+    sizes = np.diff(offsets)
+    print(f"✅ IVF over {count} rows: {nlist} lists ({sizes.min()}-{sizes.max()} rows), "
+          f"{proj_dim} dimensions keeping {explained:.0%} of the variance")
+    return store.stats()
+
+
+# --- Stores per Model ---
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_for(model_version: str) -> EmbeddingStore:
+    """The (cached) embedding store of a model version."""
+    with _stores_lock:
+        if model_version not in _stores:
+            _stores[model_version] = EmbeddingStore(os.path.join(EMBEDDINGS_DIR, model_tag(model_version)),
+                                                    model_version)
+        return _stores[model_version]
+
+
+# --- Backfill ---
+
+def backfill(db_path, model_path, batch_size=16):
+    """Embeds every gradable eye of the records not yet in the current model's store."""
+    import sqlite3
+
+    from backend_utils import (build_embedding_model, get_model_version, load_class_mapping, load_dr_model,
+                               predict_with_embeddings, preprocess_image)
+    from blob_store import resolve_path
+
+    store = store_for(get_model_version(model_path))
+    done = store.indexed_records()
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = [row for row in conn.execute("""
+            SELECT id, doctor_id, left_eye_path, right_eye_path, left_result, right_result
+            FROM patients WHERE doctor_id IS NOT NULL ORDER BY id
+        """) if row["id"] not in done]
+    finally:
+        conn.close()
+    print(f"✅ {len(rows)} records to embed ({len(done)} already stored)")
+    if not rows:
+        return
+    embedding_model = build_embedding_model(load_dr_model(model_path))
+    grades = set(load_class_mapping().values())  # not "Ungradable"
+    skipped = 0
+    for start in range(0, len(rows), batch_size):
+        eyes, arrays = [], []
+        for row in rows[start:start + batch_size]:
+            for eye in EYES:
+                path = resolve_path(row[f"{eye}_eye_path"]) if row[f"{eye}_result"] in grades else None
+                try:
+                    arrays.append(preprocess_image(path))
+                    eyes.append((row, eye))
+                except Exception:
+                    skipped += 1
+        if arrays:
+            _, embeddings = predict_with_embeddings(embedding_model, np.concatenate(arrays))
+            store.append_rows([row["id"] for row, _ in eyes], [row["doctor_id"] for row, _ in eyes],
+                              [eye for _, eye in eyes], embeddings)
+        print(f"   ↳ {min(start + batch_size, len(rows))}/{len(rows)} records")
+    print(f"✅ Backfill done ({skipped} eyes skipped: ungradable or image missing)")
+
+
+def main():
+    from backend_utils import MODEL_PATH, get_model_version
+    from db_init import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Similar-case embedding store and index")
+    parser.add_argument("command", choices=["backfill", "build-ivf", "stats"])
+    parser.add_argument("--db", type=str, default=DB_PATH)
+    parser.add_argument("--model", type=str, default=str(MODEL_PATH), help="Model whose store to use")
+    parser.add_argument("--nlist", type=int, default=1024, help="IVF lists (build-ivf)")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        backfill(args.db, args.model)
+        return
+    store = store_for(get_model_version(args.model))
+    if args.command == "build-ivf":
+        try:
+            build_ivf(store, args.nlist)
+        except ValueError as e:
+            print(f"❌ No IVF built: {e}")
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# backend/finetune_head.py
+# Incremental fine-tuning of the classification head on doctor-confirmed cases.
+#
+# Every eye with a doctor-confirmed grade in `patients` (left/right_confirmed,
+# set from the dashboard) becomes a training example. The model is split at
+# its last pooling layer: the frozen VGG16 base runs once per image and its
+# pooled features are cached in models/feature_cache/, keyed by the base's
+# weights and the image's content, so later runs only run the base on newly
+# confirmed images. Only the dense head is trained, on the cached features,
+# warm-started from the serving model's head.
+#
+# Records are split into training and evaluation sets by a hash of the record id,
+# so both eyes of a patient land on the same side and the split is stable as
+# cases accumulate. The serving model's head and the candidate are evaluated
+# on the same held-out eyes.
+#
+# The result is a candidate, not a deployment:
+#   models/candidates/best_model-<timestamp>.keras   the full model (new head)
+#   models/candidates/best_model-<timestamp>.json    training data and metrics
+# Deploy it by copying it over the serving model file; with the model watcher
+# or the admin reload API it can first run in shadow mode (model_registry.py).
+#
+# Usage: python finetune_head.py [--epochs 30] [--eval-fraction 0.2] [--since 2025-01-01] [--min-cases 20]
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+import numpy as np
+import tensorflow as tf
+from sklearn.metrics import cohen_kappa_score, confusion_matrix
+from sklearn.utils.class_weight import compute_class_weight
+
+from backend_utils import MODEL_PATH, ROOT_DIR, get_model_version, load_class_mapping, load_dr_model, preprocess_image
+from blob_store import resolve_path
+from db_init import DB_PATH, migrate_db
+
+FEATURE_CACHE_DIR = os.path.join(ROOT_DIR, "models", "feature_cache")
+CANDIDATES_DIR = os.path.join(ROOT_DIR, "models", "candidates")
+FEATURE_BATCH_SIZE = 16
+
+
+# --- Confirmed Cases ---
+
+def confirmed_cases(conn, since=None):
+    """
+    Eyes with a doctor-confirmed grade.
+
+    Returns:
+        list: (record id, stored image path, confirmed label, confirmed_at) tuples.
+    """
+    sql = """
+        SELECT id, left_eye_path, right_eye_path, left_confirmed, right_confirmed, confirmed_at
+        FROM patients WHERE confirmed_at IS NOT NULL
+    """
+    params = ()
+    if since:
+        sql += " AND confirmed_at >= ?"
+        params = (since,)
+    cases = []
+    for row in conn.execute(sql + " ORDER BY confirmed_at, id", params):
+        for eye in ("left", "right"):
+            if row[f"{eye}_confirmed"] and row[f"{eye}_eye_path"]:
+                cases.append((row["id"], row[f"{eye}_eye_path"], row[f"{eye}_confirmed"], row["confirmed_at"]))
+    return cases
+
+
+def is_eval_record(record_id, eval_fraction):
+    """Stable train/eval assignment of a record (both eyes go together)."""
+    return zlib.crc32(str(record_id).encode("utf-8")) % 1000 < eval_fraction * 1000
+
+
+# --- Frozen Base and Feature Cache ---
+
+def split_model(model):
+    """
+    Splits the model after its last pooling layer.
+
+    Returns:
+        tuple: (base model: image -> pooled features, list of the head layers after it)
+    """
+    pool_index = max(i for i, layer in enumerate(model.layers) if "Pooling" in type(layer).__name__)
+    base = tf.keras.Model(model.input, model.layers[pool_index].output)
+    return base, model.layers[pool_index + 1:]
+
+
+def base_fingerprint(base) -> str:
+    """Identifies the base's weights: cached features are only valid for the same base."""
+    digest = hashlib.sha256()
+    for weight in base.get_weights():
+        digest.update(np.ascontiguousarray(weight).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def load_feature_cache(path):
+    if not os.path.isfile(path):
+        return {}
+    with np.load(path) as cache:
+        return dict(zip(cache["keys"].tolist(), cache["features"]))
+
+
+def save_feature_cache(path, cache):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+    os.close(fd)
+    try:
+        keys = sorted(cache)
+        np.savez(tmp_path, keys=np.array(keys), features=np.stack([cache[k] for k in keys]))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def image_features(base, image_paths, cache):
+    """
+    Pooled base features of the images, running the base only on images not in the cache.
+
+    Returns:
+        tuple: (features as an array in image_paths order, number of images computed)
+    """
+    keys = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            keys.append(hashlib.sha256(f.read()).hexdigest())
+    missing = [(key, path) for key, path in dict(zip(keys, image_paths)).items() if key not in cache]
+    for start in range(0, len(missing), FEATURE_BATCH_SIZE):
+        chunk = missing[start:start + FEATURE_BATCH_SIZE]
+        batch = np.concatenate([preprocess_image(path) for _, path in chunk])
+        for (key, _), features in zip(chunk, np.asarray(base(batch, training=False))):
+            cache[key] = features.astype(np.float32)
+        print(f"   ↳ Base features: {min(start + FEATURE_BATCH_SIZE, len(missing))}/{len(missing)} new images")
+    return np.stack([cache[key] for key in keys]), len(missing)
+
+
+# --- Head Training ---
+
+def build_head(head_layers, feature_dim):
+    """A trainable copy of the head layers (same names and weights) on a features input."""
+    inputs = tf.keras.Input(shape=(feature_dim,))
+    x = inputs
+    copies = []
+    for layer in head_layers:
+        copy = type(layer).from_config(layer.get_config())
+        x = copy(x)
+        copy.set_weights(layer.get_weights())
+        copies.append(copy)
+    return tf.keras.Model(inputs, x), copies
+
+
+def evaluate(head, features, labels, n_classes):
+    if len(labels) == 0:
+        return None
+    predictions = np.asarray(head(features, training=False)).argmax(axis=1)
+    classes = list(range(n_classes))
+    return {
+        "eyes": int(len(labels)),
+        "accuracy": round(float((predictions == labels).mean()), 4),
+        # The usual DR grading metric: disagreements weighted by how many grades apart they are
+        "quadratic_kappa": round(float(cohen_kappa_score(labels, predictions, labels=classes,
+                                                         weights="quadratic")), 4)
+        if len(set(labels)) > 1 or len(set(predictions)) > 1 else None,
+        "confusion_matrix": confusion_matrix(labels, predictions, labels=classes).tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fine-tune the classification head on doctor-confirmed cases")
+    parser.add_argument("--db", type=str, default=DB_PATH)
+    parser.add_argument("--model", type=str, default=str(MODEL_PATH), help="Model to start from")
+    parser.add_argument("--since", type=str, default=None, help="Only cases confirmed on/after this date")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--learning-rate", type=float, default=1e-4)
+    parser.add_argument("--eval-fraction", type=float, default=0.2, help="Share of records held out")
+    parser.add_argument("--min-cases", type=int, default=20, help="Minimum confirmed training eyes")
+    parser.add_argument("--out", type=str, default=CANDIDATES_DIR)
+    args = parser.parse_args()
+    started = time.time()
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        migrate_db(conn)
+        cases = confirmed_cases(conn, args.since)
+    finally:
+        conn.close()
+
+    class_mapping = load_class_mapping()
+    label_index = {label: index for index, label in class_mapping.items()}
+    usable, skipped = [], 0
+    for record_id, stored_path, label, confirmed_at in cases:
+        path = resolve_path(stored_path)
+        if path and label in label_index:
+            usable.append((record_id, path, label_index[label], confirmed_at))
+        else:
+            skipped += 1
+    train = [c for c in usable if not is_eval_record(c[0], args.eval_fraction)]
+    held_out = [c for c in usable if is_eval_record(c[0], args.eval_fraction)]
+    print(f"✅ {len(usable)} confirmed eyes ({len(train)} training, {len(held_out)} evaluation, "
+          f"{skipped} skipped: image missing or unknown grade)")
+    if len(train) < args.min_cases:
+        print(f"❌ Need at least {args.min_cases} confirmed training eyes; not training.")
+        return
+
+    # --- Features (frozen base, cached) ---
+    model = load_dr_model(args.model)
+    base, head_layers = split_model(model)
+    cache_path = os.path.join(FEATURE_CACHE_DIR, f"{base_fingerprint(base)}.npz")
+    cache = load_feature_cache(cache_path)
+    features, computed = image_features(base, [c[1] for c in train + held_out], cache)
+    if computed:
+        save_feature_cache(cache_path, cache)
+    print(f"   ↳ {computed} images through the base, {len(train) + len(held_out) - computed} from the cache")
+    labels = np.array([c[2] for c in train + held_out])
+    train_x, eval_x = features[:len(train)], features[len(train):]
+    train_y, eval_y = labels[:len(train)], labels[len(train):]
+
+    # --- Head training ---
+    n_classes = len(class_mapping)
+    head, copies = build_head(head_layers, features.shape[1])
+    baseline = evaluate(head, eval_x, eval_y, n_classes)
+    present = np.unique(train_y)
+    class_weight = dict(zip(present.tolist(),
+                            compute_class_weight(class_weight="balanced", classes=present, y=train_y)))
+    head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=args.learning_rate),
+                 loss="categorical_crossentropy", metrics=["accuracy"])
+    callbacks, validation = [], None
+    if len(eval_y):
+        validation = (eval_x, tf.keras.utils.to_categorical(eval_y, n_classes))
+        callbacks.append(tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=5,
+                                                          restore_best_weights=True))
+    history = head.fit(train_x, tf.keras.utils.to_categorical(train_y, n_classes), validation_data=validation,
+                       epochs=args.epochs, batch_size=32, class_weight=class_weight, callbacks=callbacks,
+                       verbose=2)
+    candidate = evaluate(head, eval_x, eval_y, n_classes)
+
+    # --- Candidate ---
+    for copy in copies:
+        model.get_layer(copy.name).set_weights(copy.get_weights())
+    os.makedirs(args.out, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    model_path = os.path.join(args.out, f"best_model-{stamp}.keras")
+    model.save(model_path)
+    metadata = {
+        "candidate": os.path.basename(model_path),
+        "base_model": get_model_version(args.model),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "training_eyes": len(train),
+        "evaluation_eyes": len(held_out),
+        "confirmed_through": max(c[3] for c in usable),
+        "since": args.since,
+        "epochs_run": len(history.history["loss"]),
+        "features_computed": computed,
+        "seconds": round(time.time() - started, 1),
+        "metrics": {"baseline": baseline, "candidate": candidate},
+    }
+    with open(os.path.join(args.out, f"best_model-{stamp}.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    print(f"✅ Candidate saved: {model_path} ({metadata['seconds']}s)")
+    if baseline and candidate:
+        print(f"   ↳ Held-out accuracy {baseline['accuracy']:.1%} -> {candidate['accuracy']:.1%}, "
+              f"quadratic kappa {baseline['quadratic_kappa']} -> {candidate['quadratic_kappa']}")
+    else:
+        print("⚠️ No held-out eyes: the candidate is unevaluated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# backend/image_derivatives.py
+# Downsized copies of uploaded fundus images, generated once and cached
+# next to the original:
+#   <original>.print.jpg  - print-resolution JPEG embedded in report PDFs
+#   <original>.thumb.jpg  - small thumbnail for dashboards
+#
+# Uploads are content-addressed (see blob_store.py), so each distinct image
+# is only ever downsized once no matter how many reports use it.
+import os
+import tempfile
+
+from PIL import Image
+
+# kind -> (max long side in px, JPEG quality).
+# The PDF shows each eye at most ~8.5 x 10 cm, i.e. ~1000 px at 300 dpi.
+DERIVATIVES = {
+    "print": (1024, 85),
+    "thumb": (192, 75),
+}
+
+
+def derivative_path(original_path: str, kind: str) -> str:
+    """Cache path of the `kind` derivative of an image."""
+    if kind not in DERIVATIVES:
+        raise ValueError(f"Unknown image derivative: {kind}")
+    return f"{original_path}.{kind}.jpg"
+
+
+def _render(img: Image.Image, kind: str, out_path: str):
+    max_side, quality = DERIVATIVES[kind]
+    out = img.copy()
+    out.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".jpg")
+    os.close(fd)
+    try:
+        out.save(tmp_path, "JPEG", quality=quality, optimize=True)
+        os.replace(tmp_path, out_path)  # atomic: readers never see a partial file
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def ensure_derivatives(original_path: str, kinds=tuple(DERIVATIVES)) -> dict:
+    """
+    Generates any missing derivatives of an image, decoding it only once.
+
+    Args:
+        original_path (str): Absolute path of the uploaded image.
+        kinds (tuple, optional): Derivative kinds to produce. Defaults to all.
+
+    Returns:
+        dict: kind -> absolute derivative path.
+    """
+    paths = {kind: derivative_path(original_path, kind) for kind in kinds}
+    missing = [kind for kind, path in paths.items() if not os.path.isfile(path)]
+    if missing:
+        with Image.open(original_path) as img:
+            # Let the JPEG decoder downscale while decoding when it can
+            img.draft("RGB", (DERIVATIVES["print"][0],) * 2)
+            img = img.convert("RGB")
+            for kind in missing:
+                _render(img, kind, paths[kind])
+    return paths
+
+
+def get_derivative(original_path: str, kind: str):
+    """
+    Returns the `kind` derivative of an image, creating it if needed.
+    Falls back to the original path if the derivative cannot be produced.
+    """
+    if not original_path or not os.path.isfile(original_path):
+        return original_path
+    try:
+        return ensure_derivatives(original_path, kinds=(kind,))[kind]
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not create {kind} derivative for {original_path}: {e}")
+        return original_path
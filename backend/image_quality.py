@@ -0,0 +1,181 @@
+# backend/image_quality.py
+# Cheap gradability check of fundus photos, run before the DR model so that
+# blurred, badly exposed or non-fundus images are not given a meaningless label.
+#
+# The image is decoded at reduced size and resampled to ANALYSIS_SIZE on its
+# long side. Every measure is then plain NumPy on that small copy:
+#   sharpness  - variance of the Laplacian of the green channel (where retinal
+#                vessels have the most contrast) inside the retina
+#   exposure   - mean brightness and the fractions of under- and over-exposed
+#                pixels inside the retina
+#   coverage   - fraction of the frame covered by the bright retina disc, and
+#                roundness: how much of the disc's bounding circle it fills
+#
+# Thresholds default to QUALITY_THRESHOLDS and can be overridden with
+# VISIONAI_QUALITY_<NAME> environment variables (e.g. VISIONAI_QUALITY_MIN_SHARPNESS=10).
+#
+# Usage (scores for tuning thresholds): python image_quality.py IMAGE [IMAGE ...]
+import argparse
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+ANALYSIS_SIZE = 256  # long side of the analysed copy, in px
+
+QUALITY_THRESHOLDS = {
+    "min_sharpness": 15.0,        # Laplacian variance (0-255 intensity scale)
+    "min_brightness": 40.0,      # mean retina brightness (0-255)
+    "max_brightness": 180.0,
+    "max_dark_fraction": 0.3,    # retina pixels below DARK_LEVEL
+    "max_bright_fraction": 0.15,  # retina pixels above BRIGHT_LEVEL
+    "min_coverage": 0.25,        # fraction of the frame that is retina
+    "min_roundness": 0.6,        # retina area / area of its bounding circle
+}
+BACKGROUND_LEVEL = 20  # pixels darker than this (on the 0-255 scale) are background
+DARK_LEVEL = 30
+BRIGHT_LEVEL = 245
+
+# Check name -> message shown when it fails
+FAILURE_MESSAGES = {
+    "min_sharpness": "image is blurred",
+    "min_brightness": "image is under-exposed",
+    "max_brightness": "image is over-exposed",
+    "max_dark_fraction": "large parts of the retina are too dark",
+    "max_bright_fraction": "large parts of the retina are washed out",
+    "min_coverage": "no retina visible",
+    "min_roundness": "retina disc not fully visible",
+}
+
+
+def load_thresholds(environ=os.environ) -> dict:
+    """
+    QUALITY_THRESHOLDS with any VISIONAI_QUALITY_<NAME> overrides applied.
+
+    Raises:
+        ValueError: If an override is not a number.
+    """
+    thresholds = dict(QUALITY_THRESHOLDS)
+    for name in thresholds:
+        value = environ.get(f"VISIONAI_QUALITY_{name.upper()}")
+        if value is not None:
+            try:
+                thresholds[name] = float(value)
+            except ValueError:
+                raise ValueError(f"VISIONAI_QUALITY_{name.upper()} must be a number, got {value!r}")
+    return thresholds
+
+
+def _analysis_copy(source) -> np.ndarray:
+    """Decodes a path or bytes into a float32 RGB array with ANALYSIS_SIZE as its long side."""
+    try:
+        img = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+        img.draft("RGB", (ANALYSIS_SIZE * 2, ANALYSIS_SIZE * 2))  # JPEG: decode at reduced size
+        img = img.convert("RGB")
+    except Exception:
+        raise ValueError("not a readable PNG or JPEG image")
+    scale = ANALYSIS_SIZE / max(img.size)
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    img = img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(img, dtype=np.float32)
+
+
+def quality_scores(source) -> dict:
+    """
+    Measures an image's gradability.
+
+    Args:
+        source (str | bytes): Image file path or encoded image bytes.
+
+    Raises:
+        ValueError: If the image cannot be decoded.
+
+    Returns:
+        dict: sharpness, brightness, dark_fraction, bright_fraction, coverage and roundness.
+    """
+    rgb = _analysis_copy(source)
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    green = rgb[..., 1]
+
+    retina = gray > BACKGROUND_LEVEL
+    area = int(retina.sum())
+    coverage = area / retina.size
+    if area == 0:
+        return {"sharpness": 0.0, "brightness": 0.0, "dark_fraction": 1.0, "bright_fraction": 0.0,
+                "coverage": 0.0, "roundness": 0.0}
+
+    rows = np.flatnonzero(retina.any(axis=1))
+    cols = np.flatnonzero(retina.any(axis=0))
+    diameter = max(rows[-1] - rows[0], cols[-1] - cols[0]) + 1
+    roundness = min(1.0, area / (np.pi * (diameter / 2.0) ** 2))
+
+    # 4-neighbour Laplacian on the interior; only where the pixel and all its
+    # neighbours are retina, so the disc's rim does not count as detail
+    lap = (green[:-2, 1:-1] + green[2:, 1:-1] + green[1:-1, :-2] + green[1:-1, 2:]
+           - 4.0 * green[1:-1, 1:-1])
+    inner = (retina[1:-1, 1:-1] & retina[:-2, 1:-1] & retina[2:, 1:-1]
+             & retina[1:-1, :-2] & retina[1:-1, 2:])
+    sharpness = float(lap[inner].var()) if inner.any() else 0.0
+
+    values = gray[retina]
+    return {
+        "sharpness": round(sharpness, 3),
+        "brightness": round(float(values.mean()), 2),
+        "dark_fraction": round(float((values < DARK_LEVEL).mean()), 4),
+        "bright_fraction": round(float((values > BRIGHT_LEVEL).mean()), 4),
+        "coverage": round(coverage, 4),
+        "roundness": round(float(roundness), 4),
+    }
+
+
+def assess_image(source, thresholds: dict = None) -> dict:
+    """
+    Scores an image and checks it against the thresholds.
+
+    Args:
+        source (str | bytes): Image file path or encoded image bytes.
+        thresholds (dict, optional): Defaults to load_thresholds().
+
+    Raises:
+        ValueError: If the image cannot be decoded.
+
+    Returns:
+        dict: The quality_scores plus "passed" (bool) and "reasons" (list of
+              messages for the failed checks).
+    """
+    thresholds = thresholds or load_thresholds()
+    scores = quality_scores(source)
+    checks = {
+        "min_coverage": scores["coverage"] >= thresholds["min_coverage"],
+        "min_roundness": scores["roundness"] >= thresholds["min_roundness"],
+        "min_sharpness": scores["sharpness"] >= thresholds["min_sharpness"],
+        "min_brightness": scores["brightness"] >= thresholds["min_brightness"],
+        "max_brightness": scores["brightness"] <= thresholds["max_brightness"],
+        "max_dark_fraction": scores["dark_fraction"] <= thresholds["max_dark_fraction"],
+        "max_bright_fraction": scores["bright_fraction"] <= thresholds["max_bright_fraction"],
+    }
+    reasons = [FAILURE_MESSAGES[name] for name, ok in checks.items() if not ok]
+    return {**scores, "passed": not reasons, "reasons": reasons}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print fundus image quality scores")
+    parser.add_argument("images", nargs="+")
+    args = parser.parse_args()
+
+    thresholds = load_thresholds()
+    for path in args.images:
+        try:
+            result = assess_image(path, thresholds)
+        except ValueError as e:
+            print(f"❌ {path}: {e}")
+            continue
+        scores = " ".join(f"{k}={result[k]}" for k in ("sharpness", "brightness", "dark_fraction",
+                                                         "bright_fraction", "coverage", "roundness"))
+        status = "✅" if result["passed"] else f"⚠️ {'; '.join(result['reasons'])}:"
+        print(f"{status} {path}  {scores}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# backend/model_registry.py
+# The serving model, swappable without a restart.
+#
+# Routes take one snapshot per request (bundle = MODELS.current) and use its
+# model, class mapping, Grad-CAM model and version together, so a request that
+# is in flight during a swap finishes on the model it started with.
+#
+# A reload loads the model file, builds its Grad-CAM and embedding models and warms it up on a
+# background thread, then replaces the serving bundle with one attribute
+# assignment. Requests keep being served by the old model the whole time, and a
+# file that fails to load leaves it in place. Reloads are triggered by:
+#   - the admin API: POST /api/v1/admin/model/reload (see app.py)
+#   - the file watcher: with VISIONAI_MODEL_WATCH=<seconds>, each process polls
+#     the model file (MODEL_PATH) and reloads once a changed file has stopped changing
+#
+# Shadow mode loads the new model as a candidate next to the serving one
+# instead of swapping it in. A sampled fraction of live predictions is then
+# re-run on the candidate on a single background thread, and the agreement of
+# the two models is counted (and logged every SHADOW_LOG_EVERY samples). The
+# request never waits for it: samples that find the shadow queue full are
+# dropped. The candidate is promoted or discarded through the admin API.
+#
+# State is per process. Under serve.py with several workers, an admin call only
+# reaches the worker that serves it, so roll out new files with the watcher.
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from backend_utils import (MODEL_PATH, build_embedding_model, build_gradcam_model, get_model_version,
+                           load_class_mapping, load_dr_model, predict_probabilities, predict_with_embeddings,
+                           predict_with_gradcam)
+
+SHADOW_MAX_PENDING = 4   # queued shadow batches; further samples are dropped
+SHADOW_LOG_EVERY = 100   # shadow samples between agreement log lines
+SHADOW_DISAGREEMENTS_KEPT = 20
+
+
+class ModelBundle:
+    """A loaded model with everything that must change together with it."""
+
+    def __init__(self, model, class_mapping, version, gradcam_model=None, embedding_model=None):
+        self.model = model
+        self.class_mapping = class_mapping
+        self.version = version
+        self.gradcam_model = gradcam_model
+        self.embedding_model = embedding_model
+        self.loaded_at = time.time()
+
+    def info(self) -> dict:
+        return {"version": self.version, "gradcam": self.gradcam_model is not None,
+                "embeddings": self.embedding_model is not None,
+                "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at))}
+
+
+def load_bundle(model_path=MODEL_PATH, gradcam: bool = True, warm: bool = False) -> ModelBundle:
+    """
+    Loads a model file into a ModelBundle.
+
+    Args:
+        model_path (str | Path, optional): The model file. Defaults to MODEL_PATH.
+        gradcam (bool, optional): Also build its Grad-CAM model. A failure there
+                                  only disables Grad-CAM. Defaults to True.
+        warm (bool, optional): Run one prediction first, so the first request on
+                               the new model does not pay for tracing and allocation.
+
+    Raises:
+        FileNotFoundError: If the model or class mapping file is missing.
+        RuntimeError: If the file was replaced while it was being loaded.
+
+    Returns:
+        ModelBundle: The loaded model.
+    """
+    version = get_model_version(model_path)
+    model = load_dr_model(model_path)
+    class_mapping = load_class_mapping()
+    if get_model_version(model_path) != version:
+        raise RuntimeError("model file changed while it was being loaded")
+
+    gradcam_model = None
+    if gradcam:
+        try:
+            gradcam_model = build_gradcam_model(model)
+        except Exception as e:
+            print(f"⚠️ Grad-CAM disabled: {e}")
+    try:
+        embedding_model = build_embedding_model(model)
+    except Exception as e:
+        embedding_model = None
+        print(f"⚠️ Similar-case embeddings disabled: {e}")
+
+    if warm:
+        batch = np.zeros((1, *model.input_shape[1:]), dtype=np.float32)
+        predict_probabilities(model, batch)
+        if gradcam_model is not None:
+            predict_with_gradcam(gradcam_model, batch)
+        if embedding_model is not None:
+            predict_with_embeddings(embedding_model, batch)
+    return ModelBundle(model, class_mapping, version, gradcam_model, embedding_model)
+
+
+class ModelRegistry:
+    """The serving ModelBundle, background reloads and the optional shadow candidate."""
+
+    def __init__(self, model_path=MODEL_PATH, gradcam: bool = True, shadow_fraction: float = 0.1,
+                 watch_interval: float = 0, watch_shadow: bool = False):
+        self.model_path = model_path
+        self.gradcam = gradcam
+        self.shadow_fraction = shadow_fraction
+        self.watch_interval = watch_interval
+        self.watch_shadow = watch_shadow
+        self._current = None
+        self._shadow = None
+        self.reloads = 0
+        self.last_error = None
+        self._reset_process_state()
+        # Threads, locks and executors do not survive fork(): workers forked from
+        # a preloading master (serve.py) start their own on first use
+        os.register_at_fork(after_in_child=self._reset_process_state)
+
+    def _reset_process_state(self):
+        self.lock = threading.Lock()
+        self._loading = False
+        self._watcher_pid = None
+        self._executor = None
+        self.shadow_pending = 0
+        self._reset_shadow_counters()
+
+    def _reset_shadow_counters(self):
+        # shadow_pending is left alone: batches of a replaced candidate may still be queued
+        self.shadow_samples = self.shadow_agreed = self.shadow_dropped = 0
+        self.shadow_abs_diff = 0.0
+        self.shadow_disagreements = []
+
+    # --- Serving ---
+
+    @property
+    def current(self):
+        """The serving ModelBundle, or None if no model could be loaded."""
+        if self.watch_interval > 0 and self._watcher_pid != os.getpid():
+            self._start_watcher()
+        return self._current
+
+    def load(self):
+        """Loads the model file synchronously and serves it (used at startup)."""
+        self._current = load_bundle(self.model_path, gradcam=self.gradcam)
+        return self._current
+
+    # --- Reloading ---
+
+    def reload_async(self, shadow: bool = False) -> bool:
+        """
+        Starts loading the model file on a background thread. When it is loaded
+        and warmed up, it replaces the serving model, or becomes the shadow
+        candidate if shadow is set.
+
+        Returns:
+            bool: False if a reload is already running.
+        """
+        with self.lock:
+            if self._loading:
+                return False
+            self._loading = True
+        threading.Thread(target=self._reload, args=(shadow,), name="model-reload", daemon=True).start()
+        return True
+
+    def _reload(self, shadow):
+        start = time.perf_counter()
+        try:
+            bundle = load_bundle(self.model_path, gradcam=self.gradcam, warm=True)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"❌ Model reload failed, still serving {self._current.version if self._current else 'no model'}: {e}")
+            return
+        finally:
+            with self.lock:
+                self._loading = False
+
+        with self.lock:
+            self.last_error = None
+            self.reloads += 1
+            if shadow:
+                self._shadow = bundle
+                self._reset_shadow_counters()
+            else:
+                self._current = bundle
+        role = "shadow candidate" if shadow else "serving model"
+        print(f"✅ Loaded {bundle.version} as the {role} in {time.perf_counter() - start:.1f}s")
+
+    def promote_shadow(self):
+        """Makes the shadow candidate the serving model. Returns it, or None if there is none."""
+        with self.lock:
+            bundle, self._shadow = self._shadow, None
+            if bundle is not None:
+                self._current = bundle
+        if bundle is not None:
+            print(f"✅ Promoted shadow model {bundle.version} to serving")
+        return bundle
+
+    def discard_shadow(self):
+        """Drops the shadow candidate. Returns it, or None if there was none."""
+        with self.lock:
+            bundle, self._shadow = self._shadow, None
+        return bundle
+
+    # --- Shadow Evaluation ---
+
+    def shadow_sample(self, batch: np.ndarray, probabilities: np.ndarray):
+        """
+        Queues a served batch for the shadow candidate, if there is one and the
+        batch is sampled. Returns immediately; never raises.
+
+        Args:
+            batch (np.ndarray): The preprocessed batch the serving model ran on.
+                                It must not be modified afterwards.
+            probabilities (np.ndarray): The serving model's output for it.
+        """
+        candidate = self._shadow
+        if candidate is None or random.random() >= self.shadow_fraction:
+            return
+        with self.lock:
+            if self.shadow_pending >= SHADOW_MAX_PENDING:
+                self.shadow_dropped += 1
+                return
+            self.shadow_pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-shadow")
+            executor = self._executor
+        executor.submit(self._run_shadow, candidate, batch, probabilities)
+
+    def _run_shadow(self, candidate, batch, served):
+        try:
+            shadow = predict_probabilities(candidate.model, batch)
+        except Exception as e:
+            print(f"⚠️ Shadow inference failed on {candidate.version}: {e}")
+            shadow = None
+        with self.lock:
+            self.shadow_pending -= 1
+            if shadow is None or candidate is not self._shadow:
+                return  # the candidate was promoted or replaced in the meantime
+            served_labels, shadow_labels = served.argmax(axis=1), shadow.argmax(axis=1)
+            self.shadow_samples += len(batch)
+            self.shadow_agreed += int((served_labels == shadow_labels).sum())
+            self.shadow_abs_diff += float(np.abs(served - shadow).max(axis=1).sum())
+            for served_label, shadow_label in zip(served_labels, shadow_labels):
+                if served_label != shadow_label:
+                    self.shadow_disagreements.append(
+                        {"serving": int(served_label), "shadow": int(shadow_label), "at": round(time.time())})
+            del self.shadow_disagreements[:-SHADOW_DISAGREEMENTS_KEPT]
+            log = self.shadow_samples // SHADOW_LOG_EVERY != (self.shadow_samples - len(batch)) // SHADOW_LOG_EVERY
+            summary = self._shadow_stats() if log else None
+        if summary:
+            print(f"   ↳ Shadow {candidate.version}: {summary['agreement']:.1%} agreement "
+                  f"over {summary['samples']} images ({summary['dropped']} samples dropped)")
+
+    def _shadow_stats(self):
+        if self._shadow is None:
+            return None
+        samples = self.shadow_samples
+        return {
+            **self._shadow.info(),
+            "fraction": self.shadow_fraction,
+            "samples": samples,
+            "agreement": round(self.shadow_agreed / samples, 4) if samples else None,
+            "mean_max_abs_diff": round(self.shadow_abs_diff / samples, 6) if samples else None,
+            "dropped": self.shadow_dropped,
+            "pending": self.shadow_pending,
+            "recent_disagreements": list(self.shadow_disagreements),
+        }
+
+    # --- File Watcher ---
+
+    def _start_watcher(self):
+        with self.lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name="model-watch", daemon=True).start()
+
+    def _watch(self):
+        seen = self._current.version if self._current else get_model_version(self.model_path)
+        previous = seen
+        while True:
+            time.sleep(self.watch_interval)
+            version = get_model_version(self.model_path)
+            # Only reload a file that looked the same on two polls in a row: one
+            # that is still being copied in changes between them
+            if version != seen and version == previous and version != "unknown":
+                if self.reload_async(shadow=self.watch_shadow):
+                    seen = version
+            previous = version
+
+    def stats(self) -> dict:
+        """Serving and shadow model state, for the admin API and /api/v1/metrics."""
+        with self.lock:
+            return {
+                "serving": self._current.info() if self._current else None,
+                "shadow": self._shadow_stats(),
+                "reloading": self._loading,
+                "reloads": self.reloads,
+                "last_error": self.last_error,
+                "watch_seconds": self.watch_interval,
+            }
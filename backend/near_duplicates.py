@@ -0,0 +1,205 @@
+# backend/near_duplicates.py
+# Perceptual-hash detection of re-uploaded fundus images.
+#
+# The blob store only merges byte-identical uploads. A re-taken photo of the
+# same eye, or the same photo re-exported as another format or size, gets a new
+# blob, a new inference and a new record. Each eye image therefore also gets a
+# 64-bit perceptual hash (pHash): the signs of the low-frequency DCT
+# coefficients of its thumbnail (image_derivatives.py) relative to their
+# median. Recompression, resizing and small exposure changes flip few bits;
+# a different eye flips about half of them.
+#
+# The hashes live in image_phashes (migration 12 in db_init.py), one row per
+# record and eye, as a multi-index hash table: the hash is split into four 16-bit
+# bands, each indexed together with doctor_id. Two hashes within Hamming
+# distance 7 have at least one band that differs in at most one bit
+# (pigeonhole), so a lookup probes each band's value and its 16 one-bit
+# neighbours (68 index probes; below distance 4 one band is equal, and the
+# 4 exact probes suffice). The full distance is computed in the query (a
+# phash_distance() SQL function) for the rows the probes find, so only real
+# matches leave SQLite. Rows that share a band but are far away are still
+# read and rejected: their number, not the doctor's total, bounds a lookup.
+# A doctor with many near-identical images (a camera's blank frames, say)
+# gets the MAX_CANDIDATES closest matches, newest first among equals.
+#
+# Usage: python near_duplicates.py --backfill [--db records.db]   # hash records stored before migration 12
+import argparse
+import sqlite3
+
+import numpy as np
+from PIL import Image
+
+from blob_store import resolve_path
+from image_derivatives import get_derivative
+
+HASH_SIZE = 8             # 8 x 8 DCT coefficients -> 64 bits
+HASH_IMAGE_SIZE = 32
+BANDS = 4
+BAND_BITS = 64 // BANDS
+MAX_DISTANCE = 2 * BANDS - 1  # the largest distance the one-bit probes are guaranteed to find
+# Fundus photos share their layout (round field, optic disc on one side), so
+# different eyes hash closer than unrelated photos do: on our uploads
+# re-encodes stay within 4 bits and different eyes start at 6
+# (bench_near_duplicates.py)
+DEFAULT_DISTANCE = 4
+MAX_CANDIDATES = 200
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix: coefficients = D @ x."""
+    k, i = np.arange(n)[:, None], np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_IMAGE_SIZE)
+
+
+def phash(path: str) -> int:
+    """
+    The 64-bit perceptual hash of an image.
+
+    Args:
+        path (str): The image; pass the thumbnail, which decodes fastest.
+
+    Returns:
+        int: The hash, as an unsigned integer.
+    """
+    with Image.open(path) as img:
+        pixels = np.asarray(img.convert("L").resize((HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), Image.LANCZOS),
+                            dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term (overall brightness) is left out of the median
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _phash_distance(a: int, b: int) -> int:
+    # Hamming distance of two stored (signed) hashes, as an SQL function
+    mask = (1 << 64) - 1
+    return hamming(a & mask, b & mask)
+
+
+def _bands(value: int):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (band * BAND_BITS)) & mask for band in range(BANDS)]
+
+
+# --- Storage and Lookup ---
+
+def store_hashes(conn, record_id: int, doctor_id: int, hashes: dict):
+    """
+    Stores the hashes of a record's eyes (the caller commits).
+
+    Args:
+        conn (sqlite3.Connection): Connection to records.db.
+        record_id (int): patients.id of the record.
+        doctor_id (int): Its doctor; lookups only search a doctor's own records.
+        hashes (dict): eye ("left"/"right") -> phash.
+    """
+    conn.executemany("""
+        INSERT OR REPLACE INTO image_phashes (record_id, eye, doctor_id, phash, band0, band1, band2, band3)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(record_id, eye, doctor_id, _signed(value), *_bands(value)) for eye, value in hashes.items()])
+
+
+def find_near_duplicates(conn, doctor_id: int, value: int, max_distance: int = DEFAULT_DISTANCE,
+                         exclude_record=None) -> list:
+    """
+    The doctor's stored eye images within a Hamming distance of a hash.
+
+    Args:
+        conn (sqlite3.Connection): Connection to records.db.
+        doctor_id (int): Only this doctor's records are searched.
+        value (int): The hash to look up.
+        max_distance (int, optional): At most MAX_DISTANCE. Defaults to DEFAULT_DISTANCE.
+        exclude_record (int, optional): A record to leave out.
+
+    Raises:
+        ValueError: If max_distance is above MAX_DISTANCE.
+
+    Returns:
+        list: At most MAX_CANDIDATES (distance, record id, eye) tuples, closest
+        first and newest first among equals.
+    """
+    if max_distance > MAX_DISTANCE:
+        raise ValueError(f"max_distance must be at most {MAX_DISTANCE}")
+    conn.create_function("phash_distance", 2, _phash_distance, deterministic=True)
+    probes, params = [], []
+    flips = range(BAND_BITS) if max_distance >= BANDS else ()
+    for band, band_value in enumerate(_bands(value)):
+        neighbours = [band_value] + [band_value ^ (1 << bit) for bit in flips]
+        probes.append(f"SELECT phash_distance(phash, ?) AS distance, record_id, eye FROM image_phashes "
+                      f"WHERE doctor_id = ? AND band{band} IN ({', '.join('?' * len(neighbours))}) "
+                      f"AND record_id IS NOT ? AND phash_distance(phash, ?) <= ?")
+        params += [_signed(value), doctor_id, *neighbours, exclude_record, _signed(value), max_distance]
+    query = " UNION ".join(probes) + " ORDER BY distance, record_id DESC LIMIT ?"
+    return [tuple(row) for row in conn.execute(query, (*params, MAX_CANDIDATES))]
+
+
+# --- Backfill ---
+
+def backfill(db_path):
+    """
+    Hashes the eye images of every record that has no stored hashes. Images
+    that are missing or cannot be decoded are counted and skipped.
+    """
+    from db_init import migrate_db
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        migrate_db(conn)
+        rows = conn.execute("""
+            SELECT id, doctor_id, left_eye_path, right_eye_path FROM patients
+            WHERE doctor_id IS NOT NULL AND id NOT IN (SELECT record_id FROM image_phashes)
+        """).fetchall()
+        print(f"✅ {len(rows)} records to hash")
+        missing = unreadable = 0
+        for done, row in enumerate(rows, 1):
+            hashes = {}
+            for eye in ("left", "right"):
+                path = resolve_path(row[f"{eye}_eye_path"])
+                if not path:
+                    missing += 1
+                    continue
+                try:
+                    hashes[eye] = phash(get_derivative(path, "thumb"))
+                except (OSError, ValueError) as e:
+                    unreadable += 1
+                    print(f"⚠️ Record {row['id']}, {eye} eye: {e}")
+            store_hashes(conn, row["id"], row["doctor_id"], hashes)
+            if done % 500 == 0:
+                conn.commit()
+                print(f"   ↳ {done}/{len(rows)} records")
+        conn.commit()
+        print(f"✅ Backfill done ({missing} images missing, {unreadable} unreadable)")
+    finally:
+        conn.close()
+
+
+def main():
+    from db_init import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Perceptual hashes of stored eye images")
+    parser.add_argument("--backfill", action="store_true", help="Hash records stored before the hashes existed")
+    parser.add_argument("--db", type=str, default=DB_PATH)
+    args = parser.parse_args()
+    if args.backfill:
+        backfill(args.db)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
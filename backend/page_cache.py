@@ -0,0 +1,137 @@
+# backend/page_cache.py
+# Response cache for public pages whose HTML is the same for every anonymous
+# visitor (/, /services, /contact).
+#
+# Entries are keyed by the request path and the modification times of the
+# page's template and every template it includes or extends, so editing a
+# template is picked up on the next request. Only anonymous GETs without a query
+# string are served from or stored in the cache. A logged-in session or a
+# pending flash message renders normally. The cache is an LRU bounded in
+# entries, each entry expiring after a TTL. Each worker process keeps its own.
+#
+#   PAGE_CACHE = PageCache(max_entries=64, ttl=300)
+#
+#   @app.route("/")
+#   @PAGE_CACHE.cached("index.html")
+#   def home():
+#       return render_template("index.html")
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, make_response, request, session
+from jinja2 import TemplateNotFound, meta
+
+
+def template_files(env, name: str) -> list:
+    """
+    Paths of a template and of every template it includes, imports or extends.
+
+    Args:
+        env (jinja2.Environment): The app's Jinja environment.
+        name (str): Template name, as passed to render_template.
+
+    Returns:
+        list: Absolute file paths (templates not loaded from files are skipped).
+    """
+    files, pending, seen = [], [name], set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        try:
+            source, filename, _ = env.loader.get_source(env, name)
+        except TemplateNotFound:
+            continue
+        if filename:
+            files.append(filename)
+        # Dynamic names (variables) come back as None and cannot be followed
+        pending.extend(ref for ref in meta.find_referenced_templates(env.parse(source)) if ref)
+    return files
+
+
+class PageCache:
+    """Bounded LRU + TTL cache of rendered anonymous page responses."""
+
+    def __init__(self, max_entries: int = 64, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # (path, mtimes) -> (expires_at, status, headers, body)
+        self.templates = {}  # template name -> its file and the files it includes
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.bypassed = 0
+
+    def cached(self, template: str):
+        """
+        Decorator: serves the view's response from the cache for anonymous GETs.
+
+        Args:
+            template (str): The template the view renders; its mtime (and those
+                            of the templates it includes) is part of the key.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.max_entries <= 0 or request.method not in ("GET", "HEAD") or request.args or session:
+                    self._count("bypassed")
+                    return view(*args, **kwargs)
+
+                files = self.templates.get(template)
+                key = self._key(request.path, files) if files else None
+                now = time.monotonic()
+                if key is not None:
+                    with self.lock:
+                        entry = self.entries.get(key)
+                        if entry and entry[0] > now:
+                            self.entries.move_to_end(key)
+                            self.hits += 1
+                            return current_app.response_class(entry[3], status=entry[1], headers=entry[2])
+                self._count("misses")
+
+                response = make_response(view(*args, **kwargs))
+                if (response.status_code != 200 or response.direct_passthrough
+                        or "Set-Cookie" in response.headers):
+                    return response
+                # Rediscovered on every miss: an edited template may include different templates
+                files = template_files(current_app.jinja_env, template)
+                key = self._key(request.path, files)
+                if key is None:
+                    return response
+                headers = [(k, v) for k, v in response.headers.items() if k.lower() != "vary"]
+                with self.lock:
+                    self.templates[template] = files
+                    self.entries[key] = (now + self.ttl, response.status_code, headers, response.get_data())
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def _key(path, files):
+        try:
+            return path, tuple(os.stat(f).st_mtime_ns for f in files)
+        except OSError:
+            return None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.templates.clear()
+
+    def stats(self) -> dict:
+        """Entry count and hit/miss/bypass counters, for /api/v1/metrics."""
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "ttl_seconds": self.ttl,
+                "hits": self.hits, "misses": self.misses, "bypassed": self.bypassed}
+
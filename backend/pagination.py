@@ -0,0 +1,92 @@
+# backend/pagination.py
+# Keyset (cursor) pagination helpers for the doctor and patient dashboards.
+#
+# Pages are ordered newest first on (created_at, id). Instead of OFFSET, each
+# page query seeks directly to the row after/before a cursor using the
+# (doctor_id, created_at) / (patient_id, created_at) indexes, so the cost of
+# rendering a page does not grow with the length of a patient history.
+
+import base64
+import binascii
+
+PAGE_SIZES = (10, 25, 50, 100)
+DEFAULT_PAGE_SIZE = 25
+
+
+def get_page_size(value) -> int:
+    """Returns a supported page size for a `per_page` query argument."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return size if size in PAGE_SIZES else DEFAULT_PAGE_SIZE
+
+
+def encode_cursor(row) -> str:
+    """Encodes the (created_at, id) position of a row as a URL-safe token."""
+    raw = f"{row['created_at']}|{row['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Decodes a token produced by encode_cursor.
+    Returns a (created_at, id) tuple, or None if the token is missing or invalid.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+        return created_at, int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def keyset_page(conn, columns, where, params, page_size, after=None, before=None):
+    """
+    Fetches one page of `patients` rows matching `where`, newest first.
+
+    Args:
+        conn: Open sqlite3 connection.
+        columns (list[str]): Columns to select; `id` and `created_at` are always added.
+        where (str): SQL condition with `?` placeholders, e.g. "doctor_id = ?".
+        params (tuple): Values for the placeholders in `where`.
+        page_size (int): Number of rows per page.
+        after (str, optional): Cursor token; return the rows older than it.
+        before (str, optional): Cursor token; return the rows newer than it.
+
+    Returns:
+        tuple: (rows, next_cursor, prev_cursor). A cursor is None when there
+        is no page in that direction.
+    """
+    select_cols = ", ".join(dict.fromkeys(["id", "created_at", *columns]))
+    after_key, before_key = decode_cursor(after), decode_cursor(before)
+
+    if before_key:
+        # Walk backwards (oldest first) from the cursor, then restore display order
+        sql = (f"SELECT {select_cols} FROM patients WHERE {where} AND (created_at, id) > (?, ?) "
+               f"ORDER BY created_at ASC, id ASC LIMIT ?")
+        rows = conn.execute(sql, (*params, *before_key, page_size + 1)).fetchall()
+        has_prev = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_next = True
+    else:
+        if after_key:
+            sql = (f"SELECT {select_cols} FROM patients WHERE {where} AND (created_at, id) < (?, ?) "
+                   f"ORDER BY created_at DESC, id DESC LIMIT ?")
+            query_params = (*params, *after_key, page_size + 1)
+        else:
+            sql = (f"SELECT {select_cols} FROM patients WHERE {where} "
+                   f"ORDER BY created_at DESC, id DESC LIMIT ?")
+            query_params = (*params, page_size + 1)
+        rows = conn.execute(sql, query_params).fetchall()
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = after_key is not None
+
+    if not rows:
+        return [], None, None
+    next_cursor = encode_cursor(rows[-1]) if has_next else None
+    prev_cursor = encode_cursor(rows[0]) if has_prev else None
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,82 @@
+# backend/patient_search.py
+# Ranked prefix search over a doctor's patient records.
+#
+# Uses the `patients_fts` FTS5 index (migrations 4 and 15 in db_init.py), which
+# is kept in sync with `patients` by triggers, instead of LIKE '%...%' scans.
+# The doctor is part of the MATCH (its "d<doctor_id>" token in the doctor
+# column), so only that doctor's rows are matched and ranked. A full patient
+# email is looked up by the unique patient_id index first: its "example" and
+# "com" terms would otherwise match nearly every row.
+import re
+
+# bm25 column weights, in patients_fts column order:
+# name, patient_id, medications, other_conditions, doctor
+BM25_WEIGHTS = (10.0, 5.0, 1.0, 1.0, 0.0)
+
+# The columns the typed words are matched against
+TEXT_COLUMNS = ("name", "patient_id", "medications", "other_conditions")
+
+# Columns returned for each hit (matches the dashboard table)
+RESULT_COLUMNS = ("id", "name", "patient_id", "age", "gender", "created_at", "report_id", "combined_result",
+                  "left_result", "right_result", "left_confirmed", "right_confirmed")
+
+MAX_TERMS = 8
+
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.\w+")
+
+
+def build_match_query(text: str) -> str:
+    """
+    Turns free text typed by a doctor into a safe FTS5 MATCH expression.
+    Every word becomes a quoted prefix term and all terms must match,
+    so "jan doe" finds "Janet Doe". Returns "" if there is nothing to search.
+    """
+    terms = re.findall(r"\w+", text or "")[:MAX_TERMS]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def doctor_match_query(doctor_id: int, match: str) -> str:
+    """Scopes a build_match_query expression to one doctor's rows."""
+    return f'doctor : "d{int(doctor_id)}" AND {{{" ".join(TEXT_COLUMNS)}}} : ({match})'
+
+
+def search_patients(conn, doctor_id: int, text: str, page: int = 1, page_size: int = 25):
+    """
+    Full-text searches the patients of one doctor, best matches first.
+
+    Args:
+        conn: Open sqlite3 connection.
+        doctor_id (int): Only records created by this doctor are returned.
+        text (str): Free-text query (names, patient email, medications, conditions).
+        page (int, optional): 1-based page number. Defaults to 1.
+        page_size (int, optional): Results per page. Defaults to 25.
+
+    Returns:
+        tuple: (rows, has_next) for the requested page.
+    """
+    match = build_match_query(text)
+    if not match:
+        return [], False
+
+    page = max(1, page)
+    columns = ", ".join(f"p.{col}" for col in RESULT_COLUMNS)
+    if EMAIL_RE.fullmatch(text.strip()):
+        row = conn.execute(f"SELECT {columns} FROM patients AS p WHERE p.patient_id = ? AND p.doctor_id = ?",
+                           (text.strip(), doctor_id)).fetchone()
+        if row:
+            return ([row] if page == 1 else []), False
+    weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+    # The page is ranked inside the index; only its rows are read from patients
+    rows = conn.execute(f"""
+        SELECT {columns}
+        FROM (
+            SELECT rowid, bm25(patients_fts, {weights}) AS score FROM patients_fts
+            WHERE patients_fts MATCH ?
+            ORDER BY score, rowid DESC
+            LIMIT ? OFFSET ?
+        ) AS hit
+        JOIN patients AS p ON p.id = hit.rowid
+        WHERE p.doctor_id = ?
+        ORDER BY hit.score, p.id DESC
+    """, (doctor_match_query(doctor_id, match), page_size + 1, (page - 1) * page_size, doctor_id)).fetchall()
+    return rows[:page_size], len(rows) > page_size
@@ -1,6 +1,8 @@
 # backend/regenerate_one_report.py
 import sqlite3, os, sys
-from report_generator import generate_pdf
+from report_generator import render_reports
+from blob_store import report_pdf_path
+from report_delivery import build_patient_info, render_key
 
 if len(sys.argv) < 2:
     print("Usage: python regenerate_one_report.py <report_id>")
@@ -8,7 +10,6 @@ if len(sys.argv) < 2:
 
 report_id = sys.argv[1]
 DB = "records.db"
-UPLOAD_DIR = os.path.join("uploads")  # relative to backend folder
 
 conn = sqlite3.connect(DB)
 conn.row_factory = sqlite3.Row
@@ -22,25 +23,13 @@ if not row:
 # Convert sqlite3.Row -> dict for safe .get() usage and clearer code
 rowd = dict(row)
 
-# Resolve image paths stored in DB (they might be "uploads/xxx.png" or just filenames)
-def resolve_path(p):
-    if not p:
-        return None
-    # if it's already an absolute path, return it
-    if os.path.isabs(p):
-        return p
-    # possible stored forms: "uploads/xxx.png" or "xxx.png"
-    cand1 = os.path.join(p)
-    cand2 = os.path.join("uploads", os.path.basename(p))
-    cand3 = os.path.join(os.getcwd(), p)
-    cand4 = os.path.join(os.getcwd(), "uploads", os.path.basename(p))
-    for c in (cand1, cand2, cand3, cand4):
-        if os.path.exists(c):
-            return os.path.abspath(c)
-    return None
-
-left = resolve_path(rowd.get("left_eye_path") or "")
-right = resolve_path(rowd.get("right_eye_path") or "")
+# Same inputs as the server's on-demand rendering (report_delivery.ensure_report_pdf):
+# resolved image paths, attention maps and the doctor's details
+patient_info = build_patient_info(rowd)
+left, right = patient_info["left_eye_path"], patient_info["right_eye_path"]
+doctor = cur.execute("SELECT full_name, medical_id, hospital_name FROM users WHERE id = ?",
+                     (rowd.get("doctor_id"),)).fetchone()
+doctor = dict(doctor) if doctor else {}
 
 print("Resolved left image:", left)
 print("Resolved right image:", right)
@@ -53,41 +42,22 @@ if not left or not right:
     conn.close()
     sys.exit(1)
 
-# Build patient_info dict expected by generate_pdf
-patient_info = {
-    "name": rowd.get("name", ""),
-    "patient_id": rowd.get("patient_id", ""),
-    "age": rowd.get("age", ""),
-    "gender": rowd.get("gender", ""),
-    "diabetes_duration": rowd.get("diabetes_duration", ""),
-    "blood_pressure": rowd.get("blood_pressure", "") or rowd.get("blood_sugar_level", ""),
-    "medications": rowd.get("medications", ""),
-    "other_conditions": rowd.get("other_conditions", ""),
-    "report_id": report_id,
-    "left_eye_path": left,
-    "right_eye_path": right,
-    "left_result": rowd.get("left_result", ""),
-    "right_result": rowd.get("right_result", ""),
-    "combined_result": rowd.get("combined_result", "")
-}
-
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 pdf_filename = f"{report_id}.pdf"
-pdf_path = os.path.join(UPLOAD_DIR, pdf_filename)
+pdf_path = report_pdf_path(report_id)
 
 try:
     print("Generating PDF to:", pdf_path)
-    generate_pdf(patient_info, {}, pdf_path)
-    if not os.path.exists(pdf_path):
-        print("Failed: generate_pdf did not create the PDF at:", pdf_path)
+    # Rendered to a temp file and moved into place, so a live server never streams a partial PDF
+    _, error = next(render_reports([(patient_info, doctor, pdf_path)], workers=1))
+    if error or not os.path.exists(pdf_path):
+        print("Failed: generate_pdf did not create the PDF at:", pdf_path, error or "")
         conn.close()
         sys.exit(1)
-    # Update DB report_filename if needed
-    existing_fname = rowd.get("report_filename")
-    if not existing_fname or existing_fname != pdf_filename:
-        cur.execute("UPDATE patients SET report_filename = ? WHERE id = ?", (pdf_filename, rowd["id"]))
-        conn.commit()
-        print("DB updated report_filename ->", pdf_filename)
+    # Record the filename and fingerprint, so the server does not render it again on the next view
+    cur.execute("UPDATE patients SET report_filename = ?, report_render_key = ? WHERE id = ?",
+                (pdf_filename, render_key(rowd, doctor), rowd["id"]))
+    conn.commit()
+    print("DB updated report_filename ->", pdf_filename)
     print("Success: PDF created and DB updated ->", pdf_filename)
 except Exception as e:
     print("Exception during PDF generation:", e)
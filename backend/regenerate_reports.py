@@ -0,0 +1,164 @@
+# backend/regenerate_reports.py
+# Bulk, parallel, resumable regeneration of report PDFs.
+#
+# Rows are streamed from records.db, rendered across worker processes
+# (report_generator.render_reports) and every finished report is appended to
+# a journal file. The report_filename / report_render_key updates are applied
+# in a single transaction at the end; after an interruption, --resume skips
+# the reports already in the journal and still applies their updates.
+#
+# Usage:
+#   python regenerate_reports.py --all
+#   python regenerate_reports.py --missing                 # PDF file not on disk
+#   python regenerate_reports.py --stale                   # missing or out of date
+#   python regenerate_reports.py --since 2025-01-01 --until 2025-02-01 --doctor 3
+#   python regenerate_reports.py --all --resume            # continue an interrupted run
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+
+from blob_store import find_report_pdf, report_pdf_path
+from db_init import DB_PATH, migrate_db
+from report_delivery import build_patient_info, render_key
+from report_generator import render_reports
+
+DEFAULT_JOURNAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regenerate_reports.journal")
+
+
+def build_query(args):
+    """SQL filters for the row-level selectors (doctor, date range)."""
+    clauses, params = [], []
+    if args.doctor is not None:
+        clauses.append("doctor_id = ?")
+        params.append(args.doctor)
+    if args.since:
+        clauses.append("created_at >= ?")
+        params.append(args.since)
+    if args.until:
+        clauses.append("created_at < ?")
+        params.append(args.until)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def load_journal(path):
+    """Returns {report_id: entry} for reports finished by an earlier run."""
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a torn last line from an interrupted write
+                done[entry["report_id"]] = entry
+    return done
+
+
+def print_progress(done, total, errors, skipped, start):
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    rate = (done - skipped) / elapsed
+    width = 30
+    filled = int(width * done / total) if total else width
+    eta = (total - done) / rate if rate > 0 else 0
+    sys.stderr.write(f"\r[{'#' * filled}{'.' * (width - filled)}] {done}/{total} "
+                     f"{rate:6.1f} reports/s  skipped {skipped}  errors {errors}  ETA {eta:5.0f}s ")
+    sys.stderr.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate report PDFs in bulk")
+    parser.add_argument("--all", action="store_true", help="Select every report")
+    parser.add_argument("--missing", action="store_true", help="Only reports whose PDF is not on disk")
+    parser.add_argument("--stale", action="store_true", help="Only reports whose PDF is missing or out of date")
+    parser.add_argument("--since", type=str, help="Only reports created on/after this date (YYYY-MM-DD)")
+    parser.add_argument("--until", type=str, help="Only reports created before this date (YYYY-MM-DD)")
+    parser.add_argument("--doctor", type=int, help="Only reports created by this doctor id")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--resume", action="store_true", help="Skip reports finished by an interrupted run")
+    parser.add_argument("--journal", type=str, default=DEFAULT_JOURNAL, help="Progress journal file")
+    parser.add_argument("--db", type=str, default=DB_PATH, help="Path to records.db")
+    args = parser.parse_args()
+
+    if not (args.all or args.missing or args.stale or args.since or args.until or args.doctor is not None):
+        parser.error("select reports with --all, --missing, --stale, --since/--until or --doctor")
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    migrate_db(conn)
+
+    done = load_journal(args.journal) if args.resume else {}
+    journal = open(args.journal, "a" if args.resume else "w")
+    if done:
+        journal.write("\n")  # never append onto a torn last line
+
+    where, params = build_query(args)
+    total = conn.execute(f"SELECT COUNT(*) FROM patients{where}", params).fetchone()[0]
+    doctors = {row["id"]: dict(row) for row in
+               conn.execute("SELECT id, full_name, medical_id, hospital_name FROM users WHERE role = 'doctor'")}
+
+    pending = deque()  # (report_id, row id, pdf filename, key) in job order
+    counts = {"done": 0, "skipped": 0, "errors": 0}
+
+    def jobs():
+        # Streams rows through a cursor; nothing is materialised up front
+        for row in conn.execute(f"SELECT * FROM patients{where} ORDER BY id", params):
+            record = dict(row)
+            report_id = record["report_id"]
+            doctor = doctors.get(record["doctor_id"], {})
+            key = render_key(record, doctor)
+            existing = find_report_pdf(report_id) if (args.missing or args.stale) else None
+            if (report_id in done
+                    or (args.missing and existing)
+                    or (args.stale and existing and record.get("report_render_key") == key)):
+                counts["done"] += 1
+                counts["skipped"] += 1
+                continue
+            pending.append((report_id, record["id"], f"{report_id}.pdf", key))
+            yield build_patient_info(record), doctor, report_pdf_path(report_id)
+
+    start = time.perf_counter()
+    try:
+        for _, error in render_reports(jobs(), workers=args.workers):
+            report_id, row_id, filename, key = pending.popleft()
+            counts["done"] += 1
+            if error:
+                counts["errors"] += 1
+                sys.stderr.write(f"\n❌ {report_id}: {error}\n")
+            else:
+                entry = {"report_id": report_id, "id": row_id, "report_filename": filename, "key": key}
+                journal.write(json.dumps(entry) + "\n")
+                journal.flush()
+                done[report_id] = entry
+            print_progress(counts["done"], total, counts["errors"], counts["skipped"], start)
+    except KeyboardInterrupt:
+        sys.stderr.write(f"\n⚠️ Interrupted. Re-run with --resume to continue (journal: {args.journal})\n")
+        journal.close()
+        conn.close()
+        sys.exit(130)
+    journal.close()
+    sys.stderr.write("\n")
+
+    # One transaction for every report_filename / render-key update
+    updates = [(e["report_filename"], e["key"], e["id"]) for e in done.values()]
+    try:
+        conn.executemany("UPDATE patients SET report_filename = ?, report_render_key = ? WHERE id = ?", updates)
+        conn.commit()
+    finally:
+        conn.close()
+    os.remove(args.journal)
+
+    rendered = counts["done"] - counts["skipped"] - counts["errors"]
+    print(f"✅ Rendered {rendered} reports, skipped {counts['skipped']}, "
+          f"{counts['errors']} errors; updated {len(updates)} rows in "
+          f"{time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
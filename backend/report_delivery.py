@@ -0,0 +1,125 @@
+# backend/report_delivery.py
+# On-demand report PDFs and efficient delivery for /report and /patient_report.
+#
+# A report PDF is a cache of its patients row: it is rendered when it is
+# missing or when its fingerprint (the row's data, the doctor's details, the
+# model version and the report template version) no longer matches the one
+# stored in patients.report_render_key. Responses carry a strong ETag, so
+# browsers revalidate with If-None-Match (304) and resume with Range (206),
+# and can optionally hand the file transfer to a front proxy.
+import hashlib
+import json
+import os
+import tempfile
+
+from flask import Response, current_app, request, send_file
+
+from attention_maps import find_attention_map
+from blob_store import UPLOAD_FOLDER, report_pdf_path, find_report_pdf, resolve_path
+from report_generator import REPORT_TEMPLATE_VERSION, generate_pdf
+
+# patients columns that appear in the rendered PDF
+RENDERED_FIELDS = (
+    "name", "patient_id", "age", "gender", "diabetes_duration", "blood_sugar_level",
+    "blood_pressure", "medications", "other_conditions", "left_eye_path", "right_eye_path",
+    "left_result", "right_result", "combined_result", "model_version",
+)
+DOCTOR_FIELDS = ("full_name", "medical_id", "hospital_name")
+
+# Values for app.config["REPORT_SENDFILE"]
+SENDFILE_MODES = ("", "x-sendfile", "x-accel-redirect")
+
+
+def render_key(record: dict, doctor: dict) -> str:
+    """Fingerprint of everything a report PDF is rendered from."""
+    payload = {
+        "template": REPORT_TEMPLATE_VERSION,
+        "record": {field: record.get(field) for field in RENDERED_FIELDS},
+        "doctor": {field: doctor.get(field) for field in DOCTOR_FIELDS},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def build_patient_info(record: dict) -> dict:
+    """Maps a patients row to the patient_info dict expected by generate_pdf."""
+    info = {field: record.get(field) or "" for field in RENDERED_FIELDS}
+    info["blood_pressure"] = record.get("blood_pressure") or record.get("blood_sugar_level") or ""
+    info["report_id"] = record.get("report_id")
+    info["left_eye_path"] = resolve_path(record.get("left_eye_path"))
+    info["right_eye_path"] = resolve_path(record.get("right_eye_path"))
+    # Grad-CAM overlays, if the model that produced this record's results saved them
+    info["left_attention_path"] = find_attention_map(info["left_eye_path"], record.get("model_version"))
+    info["right_attention_path"] = find_attention_map(info["right_eye_path"], record.get("model_version"))
+    return info
+
+
+def ensure_report_pdf(conn, record: dict):
+    """
+    Returns the path of an up-to-date PDF for a patients row, rendering it
+    (and recording its fingerprint) if it is missing or stale.
+
+    Args:
+        conn: Open sqlite3 connection.
+        record (dict): The full patients row.
+
+    Returns:
+        tuple: (pdf_path, etag).
+    """
+    doctor = conn.execute("SELECT full_name, medical_id, hospital_name FROM users WHERE id = ?",
+                          (record.get("doctor_id"),)).fetchone()
+    doctor = dict(doctor) if doctor else {}
+    key = render_key(record, doctor)
+
+    pdf_path = find_report_pdf(record["report_id"])
+    if not pdf_path or record.get("report_render_key") != key:
+        pdf_path = report_pdf_path(record["report_id"])
+        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+        # Render to a temp file and swap it in, so concurrent readers never see a partial PDF
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(pdf_path), suffix=".pdf")
+        os.close(fd)
+        try:
+            generate_pdf(build_patient_info(record), doctor, tmp_path)
+            os.replace(tmp_path, pdf_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        conn.execute("UPDATE patients SET report_render_key = ? WHERE id = ?", (key, record["id"]))
+        conn.commit()
+
+    # The file's size and mtime are part of the ETag, so a re-rendered file
+    # (whose bytes differ) never reuses an ETag handed out for the old one
+    stat = os.stat(pdf_path)
+    etag = f"{key[:32]}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    return pdf_path, etag
+
+
+def send_report_pdf(pdf_path: str, etag: str, as_attachment: bool = False):
+    """
+    Sends a report PDF with a strong ETag, answering If-None-Match with 304
+    and Range requests with 206. With app.config["REPORT_SENDFILE"] set to
+    "x-sendfile" or "x-accel-redirect" the body is left to the front proxy.
+    """
+    mode = current_app.config.get("REPORT_SENDFILE", "")
+    download_name = os.path.basename(pdf_path)
+
+    if not mode:
+        response = send_file(pdf_path, mimetype="application/pdf", as_attachment=as_attachment,
+                             download_name=download_name, conditional=True, etag=etag, max_age=0)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(status=200, mimetype="application/pdf")
+        if mode == "x-accel-redirect":
+            prefix = current_app.config.get("X_ACCEL_PREFIX", "/protected-uploads/")
+            relpath = os.path.relpath(pdf_path, UPLOAD_FOLDER).replace(os.sep, "/")
+            response.headers["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + relpath
+        else:
+            response.headers["X-Sendfile"] = pdf_path
+        disposition = "attachment" if as_attachment else "inline"
+        response.headers["Content-Disposition"] = f'{disposition}; filename="{download_name}"'
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
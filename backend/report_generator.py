@@ -1,12 +1,64 @@
 # backend/report_generator.py
+from reportlab import rl_config
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, KeepTogether
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.lib import colors
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import islice
 import os
 
+from image_derivatives import get_derivative
+
+# Bump whenever the report layout changes so cached PDFs are re-rendered
+REPORT_TEMPLATE_VERSION = 3
+
+# Embed image data as binary streams instead of ASCII85 text: the pure-Python
+# ASCII85 encoder dominated render time and inflated every PDF by 25%.
+rl_config.useA85 = 0
+
+# --- Static Report Template ---
+# Everything that does not depend on the record is built once at import time
+# and shared by every render (and by every worker of render_reports).
+
+PAGE_MARGINS = dict(leftMargin=1.8*cm, rightMargin=1.8*cm, topMargin=1.5*cm, bottomMargin=1.2*cm)
+FRAME_WIDTH = A4[0] - PAGE_MARGINS["leftMargin"] - PAGE_MARGINS["rightMargin"]
+HALF_WIDTH = FRAME_WIDTH / 2.0
+LABEL_WIDTH = 4.5*cm
+IMAGE_CELL_WIDTH = (FRAME_WIDTH - 1.0*cm) / 2.0  # two images side by side
+IMAGE_MAX_HEIGHT = 10*cm
+# With Grad-CAM overlays the images take two rows; this keeps a typical report on
+# one page (very long medical notes push the overlay row onto a second page)
+ATTENTION_IMAGE_MAX_HEIGHT = 4.8*cm
+
+TITLE_STYLE = ParagraphStyle(
+    name="Title",
+    fontSize=18,
+    leading=22,
+    alignment=1,  # center
+    textColor=colors.HexColor("#1A237E"),  # navy
+    fontName="Helvetica-Bold"
+)
+META_STYLE = ParagraphStyle(name="Meta", fontSize=9.5, leading=12)
+LABEL_BOLD = ParagraphStyle(name="LabelBold", fontSize=10, fontName="Helvetica-Bold")
+SECTION_TITLE = ParagraphStyle(name="SectionTitle", fontSize=12, fontName="Helvetica-Bold",
+                               textColor=colors.HexColor("#0D47A1"), spaceBefore=6, spaceAfter=4)
+ASSESSMENT_STYLE = ParagraphStyle(name="Assessment", fontSize=11, fontName="Helvetica-Bold", textColor=colors.red)
+CAPTION_STYLE = ParagraphStyle(name="Caption", fontSize=9, alignment=1)  # center
+FOOTER_STYLE = ParagraphStyle(name="Footer", fontSize=8, alignment=1, textColor=colors.gray)
+
+HEADER_TABLE_STYLE = TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP')])
+MED_TABLE_STYLE = TableStyle([('VALIGN',(0,0),(-1,-1),'TOP'),('BOTTOMPADDING',(0,0),(-1,-1),4)])
+RES_TABLE_STYLE = TableStyle([('BOTTOMPADDING',(0,0),(-1,-1),4)])
+IMAGE_CELL_STYLE = TableStyle([('ALIGN',(0,0),(-1,-1),'CENTER'), ('VALIGN',(0,0),(-1,-1),'MIDDLE'), ('BOTTOMPADDING',(0,0),(-1,-1),6)])
+IMAGES_TABLE_STYLE = TableStyle([('VALIGN',(0,0),(-1,-1),'TOP'),('ALIGN',(0,0),(-1,-1),'CENTER')])
+
+REPORT_TITLE = "Diabetic Retinopathy Screening Report"
+DISCLAIMER = "Disclaimer: This AI-generated report is a screening aid and not a substitute for a detailed ophthalmic examination."
+
+
 def _safe_image_flowable(path, max_w, max_h):
     """
     Return an Image flowable restricted to max_w x max_h while preserving aspect ratio,
@@ -25,14 +77,30 @@ def _safe_image_flowable(path, max_w, max_h):
     except Exception:
         return None
 
-def generate_pdf(patient_info: dict, doctor_info: dict, pdf_path: str):
+def _image_with_caption(img_flowable, caption_text):
+    """A small nested table: [image], [caption] (or a placeholder if the image is missing)."""
+    if img_flowable:
+        cell = [[img_flowable], [Paragraph(caption_text, CAPTION_STYLE)]]
+    else:
+        cell = [[Paragraph("<i>Image not available</i>", META_STYLE)], [Paragraph(caption_text, CAPTION_STYLE)]]
+    nested = Table(cell, colWidths=[IMAGE_CELL_WIDTH])
+    nested.setStyle(IMAGE_CELL_STYLE)
+    return nested
+
+def _labelled_rows(rows):
+    """[(label, value), ...] -> Table rows of bold label / value paragraphs."""
+    return [[Paragraph(f"<b>{label}</b>", LABEL_BOLD), Paragraph(str(value), META_STYLE)] for label, value in rows]
+
+def generate_pdf(patient_info: dict, doctor_info: dict, pdf_path: str, embed_derivatives: bool = True):
     """
     Generate a single-page formatted DR screening PDF.
     patient_info keys: name, patient_id, age, gender, diabetes_duration,
                        blood_pressure, medications, other_conditions,
-                       left_eye_path, right_eye_path, left_result, right_result, combined_result
+                       left_eye_path, right_eye_path, left_result, right_result, combined_result,
+                       optionally left_attention_path, right_attention_path (Grad-CAM overlays)
     doctor_info keys: full_name, medical_id, hospital_name
     pdf_path: where to write the output PDF file
+    embed_derivatives: embed the cached print-resolution JPEGs instead of the raw uploads
     """
 
     # Ensure output directory exists
@@ -40,133 +108,106 @@ def generate_pdf(patient_info: dict, doctor_info: dict, pdf_path: str):
     os.makedirs(out_dir, exist_ok=True)
 
     # Document
-    doc = SimpleDocTemplate(
-        pdf_path,
-        pagesize=A4,
-        leftMargin=1.8*cm,
-        rightMargin=1.8*cm,
-        topMargin=1.5*cm,
-        bottomMargin=1.2*cm,
-    )
-
-    styles = getSampleStyleSheet()
-    # Custom styles
-    title_style = ParagraphStyle(
-        name="Title",
-        fontSize=18,
-        leading=22,
-        alignment=1,  # center
-        textColor=colors.HexColor("#1A237E"),  # navy
-        fontName="Helvetica-Bold"
-    )
-    meta_style = ParagraphStyle(name="Meta", fontSize=9.5, leading=12)
-    label_bold = ParagraphStyle(name="LabelBold", fontSize=10, fontName="Helvetica-Bold")
-    section_title = ParagraphStyle(name="SectionTitle", fontSize=12, fontName="Helvetica-Bold",
-                                   textColor=colors.HexColor("#0D47A1"), spaceBefore=6, spaceAfter=4)
-    assessment_style = ParagraphStyle(name="Assessment", fontSize=11, fontName="Helvetica-Bold", textColor=colors.red)
-    caption_style = ParagraphStyle(name="Caption", fontSize=9, alignment=1)  # center
-    footer_style = ParagraphStyle(name="Footer", fontSize=8, alignment=1, textColor=colors.gray)
+    doc = SimpleDocTemplate(pdf_path, pagesize=A4, **PAGE_MARGINS)
 
     story = []
 
     # Title and date
-    story.append(Paragraph("Diabetic Retinopathy Screening Report", title_style))
+    story.append(Paragraph(REPORT_TITLE, TITLE_STYLE))
     story.append(Spacer(1, 0.12*cm))
-    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%d %B %Y, %I:%M %p')}", meta_style))
+    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%d %B %Y, %I:%M %p')}", META_STYLE))
     story.append(Spacer(1, 0.4*cm))
 
     # Header: Physician (left) | Patient (right)
-    doc_left = []
-    doc_left.append(Paragraph("<b>Physician</b>", label_bold))
-    doc_left.append(Paragraph(str(doctor_info.get("full_name", "")), meta_style))
-    doc_left.append(Spacer(1, 0.12*cm))
-    doc_left.append(Paragraph("<b>Medical ID</b>", label_bold))
-    doc_left.append(Paragraph(str(doctor_info.get("medical_id", "")), meta_style))
-    doc_left.append(Spacer(1, 0.12*cm))
-    doc_left.append(Paragraph("<b>Hospital/Clinic</b>", label_bold))
-    doc_left.append(Paragraph(str(doctor_info.get("hospital_name", "")), meta_style))
-
-    doc_right = []
-    doc_right.append(Paragraph("<b>Patient Details</b>", label_bold))
-    doc_right.append(Paragraph(f"<b>Name:</b> {patient_info.get('name','')}", meta_style))
-    doc_right.append(Spacer(1, 0.08*cm))
-    doc_right.append(Paragraph(f"<b>Patient ID (Email):</b> {patient_info.get('patient_id','')}", meta_style))
-    doc_right.append(Spacer(1, 0.08*cm))
-    doc_right.append(Paragraph(f"<b>Age:</b> {patient_info.get('age','')}", meta_style))
-    doc_right.append(Spacer(1, 0.08*cm))
-    doc_right.append(Paragraph(f"<b>Gender:</b> {patient_info.get('gender','')}", meta_style))
-
-    # Put side-by-side: make each column a KeepTogether Table so they don't split awkwardly
-    left_col = Table([[doc_left]], colWidths=[doc.width/2.0 - 6])
-    right_col = Table([[doc_right]], colWidths=[doc.width/2.0 - 6])
-    header_table = Table([[left_col, right_col]], colWidths=[doc.width/2.0, doc.width/2.0])
-    header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP')]))
+    doc_left = [
+        Paragraph("<b>Physician</b>", LABEL_BOLD),
+        Paragraph(str(doctor_info.get("full_name", "")), META_STYLE),
+        Spacer(1, 0.12*cm),
+        Paragraph("<b>Medical ID</b>", LABEL_BOLD),
+        Paragraph(str(doctor_info.get("medical_id", "")), META_STYLE),
+        Spacer(1, 0.12*cm),
+        Paragraph("<b>Hospital/Clinic</b>", LABEL_BOLD),
+        Paragraph(str(doctor_info.get("hospital_name", "")), META_STYLE),
+    ]
+    doc_right = [
+        Paragraph("<b>Patient Details</b>", LABEL_BOLD),
+        Paragraph(f"<b>Name:</b> {patient_info.get('name','')}", META_STYLE),
+        Spacer(1, 0.08*cm),
+        Paragraph(f"<b>Patient ID (Email):</b> {patient_info.get('patient_id','')}", META_STYLE),
+        Spacer(1, 0.08*cm),
+        Paragraph(f"<b>Age:</b> {patient_info.get('age','')}", META_STYLE),
+        Spacer(1, 0.08*cm),
+        Paragraph(f"<b>Gender:</b> {patient_info.get('gender','')}", META_STYLE),
+    ]
+
+    # Put side-by-side: make each column a Table so they don't split awkwardly
+    left_col = Table([[doc_left]], colWidths=[HALF_WIDTH - 6])
+    right_col = Table([[doc_right]], colWidths=[HALF_WIDTH - 6])
+    header_table = Table([[left_col, right_col]], colWidths=[HALF_WIDTH, HALF_WIDTH])
+    header_table.setStyle(HEADER_TABLE_STYLE)
     story.append(header_table)
     story.append(Spacer(1, 0.4*cm))
 
     # Medical Information
-    story.append(Paragraph("Patient Medical Information", section_title))
-    med_rows = []
-    md = patient_info.get('diabetes_duration', '')
-    med_rows.append([Paragraph("<b>Diabetes Duration:</b>", label_bold), Paragraph(str(md), meta_style)])
+    story.append(Paragraph("Patient Medical Information", SECTION_TITLE))
     bp = patient_info.get('blood_pressure', '') or patient_info.get('blood_sugar_level','')
-    med_rows.append([Paragraph("<b>Blood Pressure:</b>", label_bold), Paragraph(str(bp), meta_style)])
-    med_rows.append([Paragraph("<b>Medications:</b>", label_bold), Paragraph(str(patient_info.get('medications','')), meta_style)])
-    med_rows.append([Paragraph("<b>Other Conditions:</b>", label_bold), Paragraph(str(patient_info.get('other_conditions','')), meta_style)])
-    med_table = Table(med_rows, colWidths=[4.5*cm, doc.width - 4.5*cm])
-    med_table.setStyle(TableStyle([('VALIGN',(0,0),(-1,-1),'TOP'),('BOTTOMPADDING',(0,0),(-1,-1),4)]))
+    med_table = Table(_labelled_rows([
+        ("Diabetes Duration:", patient_info.get('diabetes_duration', '')),
+        ("Blood Pressure:", bp),
+        ("Medications:", patient_info.get('medications','')),
+        ("Other Conditions:", patient_info.get('other_conditions','')),
+    ]), colWidths=[LABEL_WIDTH, FRAME_WIDTH - LABEL_WIDTH])
+    med_table.setStyle(MED_TABLE_STYLE)
     story.append(med_table)
     story.append(Spacer(1, 0.35*cm))
 
     # Screening Results
-    story.append(Paragraph("Screening Results", section_title))
-    res_rows = []
-    res_rows.append([Paragraph("<b>Left Eye Diagnosis:</b>", label_bold), Paragraph(str(patient_info.get('left_result','')), meta_style)])
-    res_rows.append([Paragraph("<b>Right Eye Diagnosis:</b>", label_bold), Paragraph(str(patient_info.get('right_result','')), meta_style)])
-    res_table = Table(res_rows, colWidths=[4.5*cm, doc.width - 4.5*cm])
-    res_table.setStyle(TableStyle([('BOTTOMPADDING',(0,0),(-1,-1),4)]))
+    story.append(Paragraph("Screening Results", SECTION_TITLE))
+    res_table = Table(_labelled_rows([
+        ("Left Eye Diagnosis:", patient_info.get('left_result','')),
+        ("Right Eye Diagnosis:", patient_info.get('right_result','')),
+    ]), colWidths=[LABEL_WIDTH, FRAME_WIDTH - LABEL_WIDTH])
+    res_table.setStyle(RES_TABLE_STYLE)
     story.append(res_table)
     story.append(Spacer(1, 0.12*cm))
     overall = patient_info.get('combined_result','')
     if overall:
-        story.append(Paragraph(f"Overall Assessment: <font color='red'><b>{overall}</b></font>", assessment_style))
+        story.append(Paragraph(f"Overall Assessment: <font color='red'><b>{overall}</b></font>", ASSESSMENT_STYLE))
     story.append(Spacer(1, 0.35*cm))
 
     # Fundus images (side-by-side) with captions under each image individually
-    story.append(Paragraph("Fundus Images", section_title))
+    story.append(Paragraph("Fundus Images", SECTION_TITLE))
     story.append(Spacer(1, 0.2*cm))
 
-    # Calculate max image sizes to fit two images horizontally
-    page_half = (doc.width - 1.0*cm) / 2.0
-    max_img_w = page_half
-    max_img_h = 10 * cm  # cap height
-
     left_path = patient_info.get('left_eye_path')
     right_path = patient_info.get('right_eye_path')
+    if embed_derivatives:
+        left_path = get_derivative(left_path, "print")
+        right_path = get_derivative(right_path, "print")
 
-    left_img = _safe_image_flowable(left_path, max_img_w, max_img_h)
-    right_img = _safe_image_flowable(right_path, max_img_w, max_img_h)
+    left_attention = patient_info.get('left_attention_path')
+    right_attention = patient_info.get('right_attention_path')
+    max_h = ATTENTION_IMAGE_MAX_HEIGHT if (left_attention or right_attention) else IMAGE_MAX_HEIGHT
 
-    # For each side, create a small nested table: [image], [caption]
-    def image_with_caption(img_flowable, caption_text):
-        if img_flowable:
-            cell = [[img_flowable], [Paragraph(caption_text, caption_style)]]
-        else:
-            cell = [[Paragraph("<i>Image not available</i>", meta_style)], [Paragraph(caption_text, caption_style)]]
-        nested = Table(cell, colWidths=[page_half])
-        nested.setStyle(TableStyle([('ALIGN',(0,0),(-1,-1),'CENTER'), ('VALIGN',(0,0),(-1,-1),'MIDDLE'), ('BOTTOMPADDING',(0,0),(-1,-1),6)]))
-        return nested
+    left_img = _safe_image_flowable(left_path, IMAGE_CELL_WIDTH, max_h)
+    right_img = _safe_image_flowable(right_path, IMAGE_CELL_WIDTH, max_h)
+    rows = [[_image_with_caption(left_img, "Left Eye"), _image_with_caption(right_img, "Right Eye")]]
+    if left_attention or right_attention:
+        # Grad-CAM overlays: where the model looked for its finding in each eye
+        rows.append([
+            _image_with_caption(_safe_image_flowable(left_attention, IMAGE_CELL_WIDTH, max_h),
+                                "Left Eye - Model Attention (Grad-CAM)"),
+            _image_with_caption(_safe_image_flowable(right_attention, IMAGE_CELL_WIDTH, max_h),
+                                "Right Eye - Model Attention (Grad-CAM)"),
+        ])
 
-    left_cell = image_with_caption(left_img, "Left Eye")
-    right_cell = image_with_caption(right_img, "Right Eye")
-
-    images_table = Table([[left_cell, right_cell]], colWidths=[page_half, page_half])
-    images_table.setStyle(TableStyle([('VALIGN',(0,0),(-1,-1),'TOP'),('ALIGN',(0,0),(-1,-1),'CENTER')]))
+    images_table = Table(rows, colWidths=[IMAGE_CELL_WIDTH, IMAGE_CELL_WIDTH])
+    images_table.setStyle(IMAGES_TABLE_STYLE)
     story.append(images_table)
 
     # Footer / disclaimer
     story.append(Spacer(1, 0.6*cm))
-    story.append(Paragraph("Disclaimer: This AI-generated report is a screening aid and not a substitute for a detailed ophthalmic examination.", footer_style))
+    story.append(Paragraph(DISCLAIMER, FOOTER_STYLE))
 
     # Build PDF and verify
     try:
@@ -179,3 +220,47 @@ def generate_pdf(patient_info: dict, doctor_info: dict, pdf_path: str):
 
     # success
     # print(f"✅ Report created at: {pdf_path}")
+
+
+# --- Batch Rendering ---
+
+def _render_job(job):
+    """
+    Worker entry point: renders one (patient_info, doctor_info, pdf_path) job.
+    The PDF is written next to its target and moved into place once complete,
+    so a server streaming the old file never sees a half-written one.
+    """
+    patient_info, doctor_info, pdf_path = job
+    tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+    try:
+        generate_pdf(patient_info, doctor_info, tmp_path)
+        os.replace(tmp_path, pdf_path)
+        return pdf_path, None
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return pdf_path, str(e)
+
+def render_reports(jobs, workers: int = None, chunksize: int = 8):
+    """
+    Render many reports in parallel across a process pool.
+
+    jobs: iterable of (patient_info, doctor_info, pdf_path) tuples, as for generate_pdf
+    workers: number of worker processes (defaults to the CPU count); 1 renders in-process
+    chunksize: jobs handed to a worker at a time, amortising inter-process overhead
+    Yields (pdf_path, error) in job order; error is None on success.
+    Jobs are consumed lazily in bounded windows, so `jobs` may be a generator
+    over millions of database rows.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = iter(jobs)
+    if workers == 1:
+        yield from map(_render_job, jobs)
+        return
+    window = workers * chunksize * 4
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = list(islice(jobs, window))
+            if not batch:
+                break
+            yield from pool.map(_render_job, batch, chunksize=chunksize)
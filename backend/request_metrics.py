@@ -0,0 +1,47 @@
+# backend/request_metrics.py
+# In-process request latency tracking. app.py keeps one tracker for the
+# /api/v1 routes and one for the HTML routes, so the inference API's latency
+# is never averaged together with page renders and PDF downloads.
+import threading
+import time
+from collections import defaultdict, deque
+
+WINDOW = 1000  # most recent samples kept per key
+
+
+class LatencyTracker:
+    """Thread-safe rolling window of latencies (seconds), keyed by endpoint or stage."""
+
+    def __init__(self, window: int = WINDOW):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            self._samples[key].append(seconds)
+            self._counts[key] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: {key: {"count", "p50_ms", "p95_ms", "p99_ms", "max_ms"}}, where
+            count is the total since start-up and the percentiles cover the window.
+        """
+        with self._lock:
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+            counts = dict(self._counts)
+        summary = {}
+        for key, values in samples.items():
+            if not values:
+                continue
+            pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+            summary[key] = {
+                "count": counts[key],
+                "p50_ms": round(pick(0.50), 2),
+                "p95_ms": round(pick(0.95), 2),
+                "p99_ms": round(pick(0.99), 2),
+                "max_ms": round(values[-1] * 1000, 2),
+            }
+        return summary
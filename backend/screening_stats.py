@@ -0,0 +1,93 @@
+# backend/screening_stats.py
+# Per-doctor screening statistics read from the `screening_stats` summary table.
+#
+# The table is kept current by triggers on `patients` (see migration 3 in
+# db_init.py), so reading statistics never aggregates the patients table.
+#
+# Usage (one-shot rebuild for an existing database):
+#   python screening_stats.py --backfill [--db records.db]
+import argparse
+import sqlite3
+
+from db_init import DB_PATH, STATS_BACKFILL_SQL, migrate_db
+
+# Grades that warrant referral to an ophthalmologist (moderate DR or worse)
+REFERABLE_RESULTS = ("Moderate", "Severe", "Proliferative_DR")
+
+
+def get_doctor_stats(conn, doctor_id: int, months: int = 12) -> dict:
+    """
+    Summarises a doctor's screenings from the summary table.
+
+    Args:
+        conn: Open sqlite3 connection.
+        doctor_id (int): The doctor whose records are summarised.
+        months (int, optional): Number of most recent months in the trend. Defaults to 12.
+
+    Returns:
+        dict: Overall per-severity counts, referral counts/rate and a
+        newest-first monthly trend.
+    """
+    rows = conn.execute(
+        "SELECT month, combined_result, total FROM screening_stats WHERE doctor_id = ? ORDER BY month DESC",
+        (doctor_id,),
+    ).fetchall()
+
+    by_severity, by_month = {}, {}
+    for month, result, total in rows:
+        by_severity[result] = by_severity.get(result, 0) + total
+        entry = by_month.setdefault(month, {"month": month, "total": 0, "referrals": 0, "by_severity": {}})
+        entry["total"] += total
+        entry["by_severity"][result] = total
+        if result in REFERABLE_RESULTS:
+            entry["referrals"] += total
+
+    for entry in by_month.values():
+        entry["referral_rate"] = entry["referrals"] / entry["total"] if entry["total"] else 0.0
+
+    total = sum(by_severity.values())
+    referrals = sum(v for k, v in by_severity.items() if k in REFERABLE_RESULTS)
+    return {
+        "total": total,
+        "referrals": referrals,
+        "referral_rate": referrals / total if total else 0.0,
+        "by_severity": by_severity,
+        "monthly": list(by_month.values())[:months],
+    }
+
+
+def backfill_stats(conn) -> int:
+    """
+    Rebuilds screening_stats from the patients table in a single transaction.
+
+    Returns:
+        int: Number of summary rows written.
+    """
+    migrate_db(conn)  # the summary table and its triggers arrive with migration 3
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM screening_stats")
+        conn.execute(STATS_BACKFILL_SQL)
+        count = conn.execute("SELECT COUNT(*) FROM screening_stats").fetchone()[0]
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screening statistics summary table maintenance")
+    parser.add_argument("--backfill", action="store_true", help="Rebuild screening_stats from patients")
+    parser.add_argument("--db", type=str, default=DB_PATH, help="Path to records.db")
+    args = parser.parse_args()
+
+    if not args.backfill:
+        parser.print_help()
+    else:
+        conn = sqlite3.connect(args.db)
+        try:
+            rows = backfill_stats(conn)
+        finally:
+            conn.close()
+        print(f"✅ Rebuilt screening_stats ({rows} summary rows) in: {args.db}")
@@ -0,0 +1,126 @@
+# backend/serve.py
+# Production launcher: a pre-forking gunicorn master that loads the DR model
+# and class mapping once, then forks workers that share the weight pages
+# copy-on-write instead of each loading its own copy.
+#
+#   python serve.py --workers 4 --threads 4 --port 8000
+#
+# Fork safety: TensorFlow creates its CPU thread pools when its runtime
+# starts. A forked child inherits the pool objects but none of their threads,
+# so work scheduled onto them would wait forever. In the default preload mode
+# the master therefore starts TensorFlow with one intra-op and one inter-op
+# thread. Kernels then run inline on the calling thread, and the app only
+# runs the model eagerly (backend_utils.predict_probabilities, never the
+# tf.function behind Model.predict). Parallelism comes from the workers, so
+# run roughly one worker per core.
+#
+# Preloading with --intra-op-threads / --inter-op-threads above 1 keeps
+# TensorFlow's runtime out of the master instead: it imports the app (and
+# TensorFlow's libraries) without loading the model, and every worker sizes
+# its pools and loads the model in post_fork. The code pages stay shared, the
+# weights are private to each worker.
+#
+# With --no-preload every worker imports the app and loads a private model
+# after the fork, trading memory for per-worker parallelism.
+#
+# bench_prefork_memory.py measures the per-worker proportional set size (PSS)
+# of both modes.
+import argparse
+import gc
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class VisionAIServer(BaseApplication):
+    """gunicorn application serving app.py's Flask app."""
+
+    def __init__(self, options, preload=True, intra_op=1, inter_op=1):
+        self.options = options
+        self.preload = preload
+        self.intra_op = intra_op
+        self.inter_op = inter_op
+        # Pools larger than one thread must be created after the fork, so the
+        # model (which starts the TensorFlow runtime) is then loaded in post_fork
+        self.load_in_worker = preload and (intra_op, inter_op) != (1, 1)
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("preload_app", self.preload)
+
+    def load(self):
+        # Runs once in the master when preloading, otherwise in every worker after its fork
+        from backend_utils import configure_tensorflow_threads
+        if self.load_in_worker:
+            os.environ["VISIONAI_LOAD_MODEL"] = "0"
+        elif self.preload:
+            configure_tensorflow_threads(1, 1)
+        else:
+            configure_tensorflow_threads(self.intra_op, self.inter_op)
+
+        import app as flask_app  # loads the serving model into MODELS (unless load_in_worker)
+
+        if self.preload:
+            # Move everything loaded so far out of the GC's reach, so collections in
+            # the workers never write to (and thereby un-share) the preloaded objects
+            gc.collect()
+            gc.freeze()
+        return flask_app.app
+
+    def load_worker_model(self):
+        """Starts TensorFlow with the configured pools and loads the model (load_in_worker only)."""
+        from backend_utils import configure_tensorflow_threads
+        import app as flask_app  # already imported by the master
+
+        configure_tensorflow_threads(self.intra_op, self.inter_op)
+        flask_app.MODELS.load()
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked")
+    if server.app.load_in_worker:
+        try:
+            server.app.load_worker_model()
+        except Exception as e:
+            server.log.error(f"Worker {worker.pid} could not load the AI model: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forking production server for VisionAI")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="Request threads per worker")
+    parser.add_argument("--timeout", type=int, default=120, help="Seconds before a stuck worker is restarted")
+    parser.add_argument("--no-preload", action="store_true",
+                        help="Load the model in every worker instead of sharing the master's copy")
+    parser.add_argument("--intra-op-threads", type=int, default=1,
+                        help="TensorFlow intra-op threads per worker (above 1, each worker loads its own weights)")
+    parser.add_argument("--inter-op-threads", type=int, default=1,
+                        help="TensorFlow inter-op threads per worker (above 1, each worker loads its own weights)")
+    args = parser.parse_args()
+
+    from db_init import init_db
+    init_db()  # once, in the master, before any worker opens the database
+
+    options = {
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "worker_class": "gthread",
+        "threads": args.threads,
+        "timeout": args.timeout,
+        "graceful_timeout": 30,
+        "accesslog": "-",
+        "post_fork": post_fork,
+    }
+    server = VisionAIServer(options, preload=not args.no_preload,
+                            intra_op=args.intra_op_threads, inter_op=args.inter_op_threads)
+    mode = "shared preloaded model" if server.preload and not server.load_in_worker else "per-worker models"
+    print(f"🚀 Starting VisionAI with {args.workers} workers x {args.threads} threads on {options['bind']} ({mode})")
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
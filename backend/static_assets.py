@@ -0,0 +1,113 @@
+# backend/static_assets.py
+# Serves the fingerprinted static assets written by build_static.py.
+#
+# build_static.py copies every file under Flask/static to
+# Flask/static/dist/<dir>/<name>.<hash>.<ext>, next to precompressed .br/.gz
+# variants and, for images, a .webp variant. It also writes a manifest mapping
+# each original filename to its fingerprinted one. init_app() makes
+# url_for('static', filename='css/style.css') resolve through that manifest, and
+# serves /static/dist/ with a one-year immutable Cache-Control. A fingerprinted
+# name never changes content, so browsers reuse it without revalidating, and a
+# changed file gets a new name on the next build.
+#
+# Without a manifest (the build has not been run), url_for falls back to the
+# original files, which Flask serves with its default revalidating headers.
+import json
+import mimetypes
+import os
+
+from flask import abort, request, send_from_directory
+
+DIST_DIR = "dist"
+MANIFEST_NAME = "manifest.json"
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Response variants, in order of preference: (variant suffix, Content-Encoding)
+ENCODINGS = ((".br", "br"), (".gz", "gzip"))
+WEBP_SUFFIX = ".webp"
+
+
+def load_manifest(static_folder: str) -> dict:
+    """
+    Reads the manifest written by build_static.py.
+
+    Args:
+        static_folder (str): The app's static folder.
+
+    Returns:
+        dict: Original filename -> fingerprinted filename (both relative to the
+              static folder), or an empty dict if no build exists.
+    """
+    path = os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["assets"]
+    except FileNotFoundError:
+        return {}
+    except (ValueError, KeyError) as e:
+        print(f"⚠️ Ignoring unreadable static manifest {path}: {e}")
+        return {}
+
+
+def find_variants(static_folder: str, manifest: dict) -> dict:
+    """Fingerprinted filename -> set of variant suffixes present on disk, stat'ed once at start-up."""
+    variants = {}
+    for fingerprinted in manifest.values():
+        base = os.path.join(static_folder, fingerprinted)
+        variants[fingerprinted] = {suffix for suffix in (".br", ".gz", WEBP_SUFFIX)
+                                   if os.path.isfile(base + suffix)}
+    return variants
+
+
+def init_app(app):
+    """
+    Resolves url_for('static', ...) through the build manifest and registers the
+    /static/dist/ route that serves fingerprinted assets.
+
+    Args:
+        app (Flask): The application; its static_folder must be set.
+    """
+    manifest = load_manifest(app.static_folder)
+    variants = find_variants(app.static_folder, manifest)
+    app.extensions["static_manifest"] = manifest
+    if manifest:
+        print(f"✅ Serving {len(manifest)} fingerprinted static assets.")
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = app.extensions["static_manifest"].get(values["filename"], values["filename"])
+
+    def serve_fingerprinted(filename):
+        fingerprinted = f"{DIST_DIR}/{filename}"
+        available = variants.get(fingerprinted)
+        if available is None:
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        suffix, encoding, vary = "", None, None
+        if WEBP_SUFFIX in available:
+            vary = "Accept"
+            # Only an explicit image/webp entry: "*/*" and "image/*" also match it, and
+            # browsers that cannot decode WebP send those for images too
+            if any(value == "image/webp" and quality > 0 for value, quality in request.accept_mimetypes):
+                suffix, mimetype = WEBP_SUFFIX, "image/webp"
+        for candidate, content_encoding in ENCODINGS:
+            if candidate in available:
+                vary = "Accept-Encoding"
+                if not suffix and request.accept_encodings[content_encoding]:
+                    suffix, encoding = candidate, content_encoding
+                    break
+
+        response = send_from_directory(os.path.join(app.static_folder, DIST_DIR), filename + suffix,
+                                       mimetype=mimetype, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if vary:
+            response.vary.add(vary)
+        return response
+
+    # More specific than Flask's own /static/<path:filename>, so it matches first
+    app.add_url_rule(f"{app.static_url_path}/{DIST_DIR}/<path:filename>",
+                     endpoint="static_fingerprinted", view_func=serve_fingerprinted)
@@ -0,0 +1,219 @@
+# throughput.py
+# Training throughput instrumentation: is CPU training bound by the
+# ImageDataGenerator input pipeline or by the model's compute?
+#
+#   train_data = TimedSequence(train_gen)          # times every batch the pipeline produces
+#   throughput = ThroughputLogger("training_throughput.csv", train_data, profile_steps=(20, 30))
+#   model.fit(train_data, ..., callbacks=[..., throughput])
+#
+# One CSV row per epoch (the file is shared by every fit() the logger is passed to;
+# the "run" column tells them apart):
+#   seconds, images_per_sec - training part of the epoch (validation excluded)
+#   step_p50/p90/p99_ms     - training step times (Keras batch begin -> end)
+#   producer_s              - time the pipeline spent producing (loading and augmenting)
+#                             batches. This is producer time, not time the model waited:
+#                             Keras prefetches on a worker thread, so it overlaps compute
+#   step_s                  - time spent in training steps, including any wait for data
+#   compute_s               - compute-only baseline for those steps: the median time of a
+#                             forward and backward pass on a batch already in memory (timed
+#                             once per fit() after its first epoch) times the step count.
+#                             The first step of a fit() traces and compiles the training
+#                             function, so it counts as compute in full
+#   wait_s                  - step_s - compute_s, the time the steps spent waiting for data
+#   wait_share              - wait_s / step_s. At or above INPUT_BOUND_WAIT_SHARE training
+#                             is input-bound; below it, compute is the bottleneck
+#   peak_rss_mb             - peak resident memory of the process so far (VmHWM on Linux)
+#
+# The baseline leaves out the optimizer update (so the weights are untouched) and runs
+# in inference mode, so wait_s slightly overstates the wait.
+#
+# profile_steps=(start, stop) captures a TensorFlow profiler trace of those
+# training steps (counted across epochs) into profile_dir, for TensorBoard's Profile tab.
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    import psutil  # optional: peak memory on platforms without /proc
+except ImportError:
+    psutil = None
+
+INPUT_BOUND_WAIT_SHARE = 0.25
+COMPUTE_BASELINE_STEPS = 5
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, or None if it cannot be read.
+    Without /proc (and psutil's peak_wset on Windows) this is the current RSS,
+    so the logger only sees the peaks it happens to sample.
+    """
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    return None
+
+
+class TimedSequence(tf.keras.utils.Sequence):
+    """
+    Wraps a Keras Sequence (e.g. an ImageDataGenerator iterator) and records
+    how long each batch takes to produce. The first (full-size) batch is kept
+    for the compute baseline. Other attributes (class_indices, samples, ...)
+    are passed through to the wrapped sequence.
+    """
+
+    def __init__(self, sequence):
+        self.sequence = sequence
+        super().__init__()
+        self.producer_seconds = 0.0
+        self.images = 0
+        self.sample_batch = None
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        batch = self.sequence[index]
+        self.producer_seconds += time.perf_counter() - start
+        self.images += len(batch[0])
+        if index == 0:
+            self.sample_batch = batch
+        return batch
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+    def __getattr__(self, name):
+        if "sequence" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__["sequence"], name)
+
+    def take_counters(self):
+        """(producer seconds, images) since the last call."""
+        counters = (self.producer_seconds, self.images)
+        self.producer_seconds, self.images = 0.0, 0
+        return counters
+
+
+class ThroughputLogger(tf.keras.callbacks.Callback):
+    """Writes per-epoch throughput, step-time and input-pipeline stats to a CSV file."""
+
+    FIELDS = ["run", "epoch", "steps", "images", "seconds", "images_per_sec", "step_p50_ms", "step_p90_ms",
+              "step_p99_ms", "producer_s", "step_s", "compute_s", "wait_s", "wait_share", "peak_rss_mb"]
+
+    def __init__(self, filename, data, profile_steps=None, profile_dir=None):
+        """
+        Args:
+            filename (str): CSV file to write (replaced by the first run, appended to by later ones).
+            data (TimedSequence): The wrapped training data passed to fit().
+            profile_steps (tuple, optional): (start, stop) training steps to trace, counted across epochs.
+            profile_dir (str, optional): Trace directory. Defaults to "profile" next to filename.
+        """
+        super().__init__()
+        self.filename = filename
+        self.data = data
+        self.profile_steps = profile_steps
+        self.profile_dir = profile_dir or os.path.join(os.path.dirname(os.path.abspath(filename)), "profile")
+        self.run = 0
+        self.global_step = 0
+        self.profiling = False
+
+    def on_train_begin(self, logs=None):
+        self.run += 1
+        self.compute_step_s = None  # re-measured per fit(): the trainable layers may have changed
+        self.run_epochs = 0
+        if self.run == 1:
+            with open(self.filename, "w", newline="") as f:
+                csv.writer(f).writerow(self.FIELDS)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.step_times = []
+        self.peak_rss = peak_rss_mb()
+        self.epoch_start = self.last_step_end = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.profile_steps and self.global_step == self.profile_steps[0] and not self.profiling:
+            tf.profiler.experimental.start(self.profile_dir)
+            self.profiling = True
+        self.step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.last_step_end = time.perf_counter()
+        self.step_times.append(self.last_step_end - self.step_start)
+        self.global_step += 1
+        rss = peak_rss_mb()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0.0, rss)
+        if self.profiling and self.global_step >= self.profile_steps[1]:
+            self._stop_profiler()
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = self.last_step_end - self.epoch_start
+        # Batches prefetched before the epoch began (during the last validation) count towards it
+        producer_s, images = self.data.take_counters()
+        step_s = float(sum(self.step_times))
+        p50, p90, p99 = (np.percentile(self.step_times, [50, 90, 99]) * 1000 if self.step_times
+                         else (0.0, 0.0, 0.0))
+        if self.compute_step_s is None and self.data.sample_batch is not None:
+            self.compute_step_s = self._measure_compute_step()
+        traced = self.step_times[:1] if self.run_epochs == 0 else []
+        self.run_epochs += 1
+        compute_s = min(sum(traced) + (self.compute_step_s or 0.0) * (len(self.step_times) - len(traced)),
+                        step_s)
+        wait_s = step_s - compute_s
+        wait_share = wait_s / step_s if step_s else 0.0
+        row = [self.run, epoch + 1, len(self.step_times), images, round(seconds, 2),
+               round(images / seconds, 2) if seconds else 0.0, round(p50, 1), round(p90, 1), round(p99, 1),
+               round(producer_s, 2), round(step_s, 2), round(compute_s, 2), round(wait_s, 2), round(wait_share, 3),
+               round(self.peak_rss, 1) if self.peak_rss is not None else ""]
+        with open(self.filename, "a", newline="") as f:
+            csv.writer(f).writerow(row)
+
+        bound = "input-bound" if wait_share >= INPUT_BOUND_WAIT_SHARE else "compute-bound"
+        print(f"   ↳ {row[5]} img/s, step p50 {row[6]} ms / p99 {row[8]} ms, "
+              f"waited {wait_s:.1f}s of {step_s:.1f}s in steps ({bound})")
+
+    def _measure_compute_step(self):
+        """
+        Median seconds of a training step's forward and backward pass on the
+        cached sample batch, with no input pipeline involved. The gradients are
+        not applied, so training is unaffected.
+        """
+        x, y = (tf.convert_to_tensor(part) for part in self.data.sample_batch[:2])
+        loss_fn = tf.keras.losses.get(self.model.loss)
+        weights = self.model.trainable_weights
+
+        @tf.function
+        def forward_backward():
+            with tf.GradientTape() as tape:
+                loss = loss_fn(y, self.model(x, training=False))
+            gradients = [g for g in tape.gradient(loss, weights) if g is not None]
+            # Reduced to one scalar, so reading it waits for every gradient without copying them back
+            return tf.add_n([tf.reduce_sum(g) for g in gradients]) if gradients else loss
+
+        forward_backward().numpy()  # trace and warm up
+        times = []
+        for _ in range(COMPUTE_BASELINE_STEPS):
+            start = time.perf_counter()
+            forward_backward().numpy()
+            times.append(time.perf_counter() - start)
+        return float(np.median(times))
+
+    def on_train_end(self, logs=None):
+        if self.profiling:
+            self._stop_profiler()
+
+    def _stop_profiler(self):
+        tf.profiler.experimental.stop()
+        self.profiling = False
+        print(f"✅ Profiler trace of steps {self.profile_steps[0]}-{self.profile_steps[1]} saved to {self.profile_dir}")
@@ -7,6 +7,7 @@ from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, Early
 
 from data_generator import get_generators
 from model import build_vgg16_model
+from throughput import ThroughputLogger, TimedSequence
 from utils import read_csv, get_class_weights
 
 
@@ -36,6 +37,7 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 BATCH_SIZE = 16
 EPOCHS = 30
 INPUT_SHAPE = (224,224,3)
+PROFILE_STEPS = None  # e.g. (20, 30): TensorFlow profiler trace of training steps 20-29 in OUTPUT_DIR/profile
 
 # ========================
 # Load CSVs
@@ -97,17 +99,21 @@ checkpoint = ModelCheckpoint(
 reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1)
 early = EarlyStopping(monitor='val_loss', patience=8, restore_best_weights=True, verbose=1)
 csv_logger = CSVLogger(os.path.join(OUTPUT_DIR, 'training_log.csv'))
+# images/sec, step times, input-pipeline time and peak memory per epoch
+train_data = TimedSequence(train_gen)
+throughput = ThroughputLogger(os.path.join(OUTPUT_DIR, 'training_throughput.csv'), train_data,
+                              profile_steps=PROFILE_STEPS)
 
 # ========================
 # Stage 1: Train top layers
 # ========================
 print("Training top layers...")
 history = model.fit(
-    train_gen,
+    train_data,
     validation_data=val_gen,
     epochs=10,
     class_weight=class_weight,
-    callbacks=[checkpoint, reduce_lr, early, csv_logger]
+    callbacks=[checkpoint, reduce_lr, early, csv_logger, throughput]
 )
 
 # ========================
@@ -125,11 +131,11 @@ model.compile(
 )
 
 history_ft = model.fit(
-    train_gen,
+    train_data,
     validation_data=val_gen,
     epochs=EPOCHS,
     class_weight=class_weight,
-    callbacks=[checkpoint, reduce_lr, early, csv_logger]
+    callbacks=[checkpoint, reduce_lr, early, csv_logger, throughput]
 )
 
 # ========================